@@ -0,0 +1,210 @@
+import logging
+import re
+import sys
+from collections import defaultdict
+from contextlib import ContextDecorator
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+logger = logging.getLogger(__name__)
+
+# Máximo de consultas SQL por nombre de URL. Cubre todas las rutas de
+# usuarios/urls.py, productos/urls.py y pedidos/urls.py (más la de inicio y la
+# de archivos media).
+# Los valores incluyen las consultas de la sesión y del usuario autenticado.
+PRESUPUESTOS = {
+    'inicio': 3,
+    'media': 0,
+
+    # usuarios
+    'registro': 2,
+    'login': 2,
+    'logout': 4,
+    'perfil': 2,
+    'direcciones_lista': 3,
+    'direccion_crear': 2,
+    'direccion_editar': 3,
+    'direccion_eliminar': 3,
+    'usuarios_admin_lista': 3,
+    'usuario_admin_detalle': 5,
+    'usuario_admin_editar': 3,
+
+    # productos
+    'catalogo': 6,
+    'producto_detalle': 5,
+    'autocompletar': 3,
+    # Sólo al generarla: si la imagen es de algún producto
+    'miniatura': 2,
+    'categorias_lista': 3,
+    'categoria_crear': 2,
+    'categoria_editar': 3,
+    'categoria_eliminar': 3,
+    'marcas_lista': 3,
+    'marca_crear': 2,
+    'marca_editar': 3,
+    'marca_eliminar': 3,
+    'productos_lista': 4,
+    'producto_crear': 3,
+    'producto_editar': 4,
+    'producto_eliminar': 3,
+    'productos_ajuste_masivo': 6,
+    'productos_exportar': 3,
+    'cache_catalogo_metricas': 2,
+
+    # pedidos
+    # El carrito vive en la caché: las consultas son de lectura (y la del
+    # carrito sólo la primera vez), salvo apartar las unidades al agregar o
+    # cambiar la cantidad (leer y escribir la reserva, en su savepoint)
+    'carrito_lista': 4,
+    'carrito_agregar': 8,
+    'carrito_actualizar': 8,
+    'carrito_eliminar': 4,
+    'colocar_pedido': 5,
+    'pedidos_lista': 3,
+    'pedido_detalle': 4,
+    'pedidos_admin_lista': 3,
+    'pedidos_exportar': 3,
+    'pedido_admin_detalle': 4,
+    'pedido_actualizar_estado': 3,
+}
+
+
+class PresupuestoExcedido(AssertionError):
+    pass
+
+
+class presupuesto_consultas(ContextDecorator):
+    """
+    Context manager (o decorador) que falla si el bloque ejecuta más consultas
+    que las permitidas. El máximo se toma de PRESUPUESTOS por nombre de URL, o
+    se indica directamente:
+
+        with presupuesto_consultas('catalogo'):
+            self.client.get(reverse('catalogo'))
+
+        @presupuesto_consultas(maximo=2)
+        def calcular(): ...
+    """
+
+    def __init__(self, nombre_url=None, maximo=None):
+        if maximo is None:
+            maximo = PRESUPUESTOS[nombre_url]
+        self.nombre_url = nombre_url
+        self.maximo = maximo
+        self._captura = None
+
+    def __enter__(self):
+        self._captura = CaptureQueriesContext(connection)
+        self._captura.__enter__()
+        return self._captura
+
+    def __exit__(self, tipo, valor, traza):
+        self._captura.__exit__(tipo, valor, traza)
+        if tipo is not None:
+            return False
+        ejecutadas = len(self._captura)
+        if ejecutadas > self.maximo:
+            consultas = '\n'.join(
+                f'{i}. {consulta["sql"]}' for i, consulta in enumerate(self._captura.captured_queries, start=1)
+            )
+            raise PresupuestoExcedido(
+                f'{self.nombre_url or "El bloque"} ejecutó {ejecutadas} consultas '
+                f'(presupuesto: {self.maximo}):\n{consultas}'
+            )
+        return False
+
+
+_LISTAS_PARAMETROS = re.compile(r'\((?:%s|\?)(?:,\s*(?:%s|\?))*\)')
+_NUMEROS = re.compile(r'\b\d+\b')
+
+
+def forma_sql(sql):
+    """
+    Forma de una consulta: el SQL sin valores concretos, para reconocer la misma
+    consulta repetida con distintos parámetros.
+    """
+    sql = _LISTAS_PARAMETROS.sub('(...)', sql)
+    return _NUMEROS.sub('N', sql)
+
+
+def origen_consulta():
+    """
+    Busca en la pila quién disparó la consulta: la línea de la plantilla que se
+    estaba renderizando, el atributo de relación que se accedió, o la primera
+    línea del código propio del proyecto.
+    """
+    plantilla = atributo = codigo = None
+    marco = sys._getframe(1)
+    while marco is not None:
+        nombre = marco.f_code.co_name
+        archivo = marco.f_code.co_filename
+        local = marco.f_locals.get('self')
+        if plantilla is None and nombre == 'render_annotated' and hasattr(local, 'token'):
+            origen = getattr(local, 'origin', None)
+            plantilla = f'{getattr(origen, "template_name", "?")}:{local.token.lineno}'
+        elif atributo is None and nombre == '__get__' and 'related_descriptors' in archivo:
+            campo = getattr(local, 'field', None) or getattr(local, 'related', None)
+            if campo is not None:
+                atributo = f'{campo.model.__name__}.{campo.name}'
+        elif codigo is None and str(settings.BASE_DIR) in archivo and 'consultas.py' not in archivo:
+            codigo = f'{archivo}:{marco.f_lineno} ({nombre})'
+        marco = marco.f_back
+    return ', '.join(parte for parte in (
+        f'plantilla {plantilla}' if plantilla else None,
+        f'atributo {atributo}' if atributo else None,
+        f'código {codigo}' if codigo else None,
+    ) if parte) or 'desconocido'
+
+
+class DetectorNMasUnoMiddleware:
+    """
+    Middleware para desarrollo: registra cada consulta de la petición y avisa
+    (en el log y en la cabecera X-Consultas-Repetidas) cuando la misma forma de
+    SQL se repite N veces, indicando la plantilla o el atributo que la causó.
+    También avisa si la vista excede su presupuesto de PRESUPUESTOS.
+
+    Sólo se activa con DEBUG = True; el umbral se configura con
+    DETECTOR_N_MAS_UNO_UMBRAL (5 por omisión).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.umbral = getattr(settings, 'DETECTOR_N_MAS_UNO_UMBRAL', 5)
+
+    def __call__(self, request):
+        if not settings.DEBUG:
+            return self.get_response(request)
+
+        conteo = defaultdict(int)
+        origenes = {}
+
+        def registrar(execute, sql, params, many, context):
+            forma = forma_sql(sql)
+            conteo[forma] += 1
+            if conteo[forma] == self.umbral:
+                origenes[forma] = origen_consulta()
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(registrar):
+            response = self.get_response(request)
+
+        repetidas = {forma: veces for forma, veces in conteo.items() if veces >= self.umbral}
+        for forma, veces in repetidas.items():
+            logger.warning(
+                'Posible N+1 en %s: consulta repetida %d veces desde %s\n%s',
+                request.path, veces, origenes[forma], forma
+            )
+        if repetidas:
+            response['X-Consultas-Repetidas'] = str(len(repetidas))
+
+        coincidencia = getattr(request, 'resolver_match', None)
+        maximo = PRESUPUESTOS.get(coincidencia.url_name) if coincidencia else None
+        total = sum(conteo.values())
+        if maximo is not None and total > maximo:
+            logger.warning(
+                '%s (%s) ejecutó %d consultas; su presupuesto es %d',
+                request.path, coincidencia.url_name, total, maximo
+            )
+        return response
@@ -0,0 +1,199 @@
+import gzip
+import mimetypes
+import os
+import re
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+try:
+    import brotli
+except ImportError:  # Opcional: sin brotli sólo se generan variantes gzip
+    brotli = None
+
+# Los archivos con hash en el nombre nunca cambian; los demás (los mismos
+# archivos con su nombre original) se revalidan después de un minuto
+SEGUNDOS_INMUTABLE = 365 * 24 * 60 * 60
+SEGUNDOS_MUTABLE = 60
+
+# Extensiones de las variantes comprimidas, en orden de preferencia
+CODIFICACIONES = (('br', '.br'), ('gzip', '.gz'))
+
+# Sólo se comprime texto; imágenes y fuentes woff ya vienen comprimidas
+_COMPRIMIBLES = re.compile(r'\.(css|js|mjs|map|json|svg|txt|xml|html|ico|ttf|otf|eot)$', re.IGNORECASE)
+
+# Una variante sólo se guarda si ahorra al menos el 10 %
+_AHORRO_MINIMO = 0.9
+
+
+def _codificar(contenido, codificacion):
+    if codificacion == 'gzip':
+        # mtime=0 para que el mismo archivo siempre produzca los mismos bytes
+        return gzip.compress(contenido, compresslevel=9, mtime=0)
+    return brotli.compress(contenido, quality=11)
+
+
+class AlmacenamientoEstatico(ManifestStaticFilesStorage):
+    """
+    collectstatic copia cada archivo con el hash de su contenido en el nombre
+    (img/ferreguly.3c1f0a2b9e4d.jpeg) y, para los de texto, guarda junto a
+    cada uno su versión .gz (y .br si está instalado brotli) para que
+    EstaticosMiddleware no tenga que comprimir al servir.
+    """
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # Sin collectstatic (desarrollo y pruebas) se usa el nombre original
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for original, con_hash in self.hashed_files.items():
+            for nombre in (original, con_hash):
+                if _COMPRIMIBLES.search(nombre):
+                    # Las variantes del nombre con hash sólo cambian si cambia el archivo
+                    self._comprimir(nombre, reemplazar=nombre == original)
+
+    def _comprimir(self, nombre, reemplazar):
+        contenido = None
+        for codificacion, extension in CODIFICACIONES:
+            if codificacion == 'br' and brotli is None:
+                continue
+            destino = nombre + extension
+            if self.exists(destino):
+                if not reemplazar:
+                    continue
+                self.delete(destino)
+            if contenido is None:
+                with self.open(nombre) as archivo:
+                    contenido = archivo.read()
+            comprimido = _codificar(contenido, codificacion)
+            if len(comprimido) <= len(contenido) * _AHORRO_MINIMO:
+                self._save(destino, ContentFile(comprimido))
+
+
+Archivo = namedtuple('Archivo', 'tipo inmutable variantes')
+
+# (ruta, etag, fecha) de cada variante de un archivo
+Variante = namedtuple('Variante', 'ruta etag ultima_modificacion')
+
+
+def _variante(ruta):
+    estado = os.stat(ruta)
+    return Variante(ruta, quote_etag(f'{estado.st_mtime_ns:x}-{estado.st_size:x}'), int(estado.st_mtime))
+
+
+def indexar(raiz):
+    """
+    {nombre: Archivo} de todo lo que hay en STATIC_ROOT. Las variantes se
+    indexan bajo la codificación que las produce ('br', 'gzip' o None).
+    """
+    if not raiz or not os.path.isdir(raiz):
+        return {}
+    con_hash = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+    extensiones = tuple(extension for _, extension in CODIFICACIONES)
+    archivos = {}
+    for directorio, _, nombres in os.walk(raiz):
+        for nombre in nombres:
+            ruta = os.path.join(directorio, nombre)
+            relativo = os.path.relpath(ruta, raiz).replace(os.sep, '/')
+            if relativo.endswith(extensiones) and os.path.exists(ruta.rsplit('.', 1)[0]):
+                continue
+            variantes = {None: _variante(ruta)}
+            for codificacion, extension in CODIFICACIONES:
+                if os.path.exists(ruta + extension):
+                    variantes[codificacion] = _variante(ruta + extension)
+            archivos[relativo] = Archivo(
+                mimetypes.guess_type(nombre)[0] or 'application/octet-stream',
+                relativo in con_hash,
+                variantes
+            )
+    return archivos
+
+
+def codificaciones_aceptadas(cabecera):
+    """Codificaciones de Accept-Encoding que el cliente acepta (q > 0)."""
+    aceptadas = set()
+    for parte in cabecera.split(','):
+        codificacion, _, parametros = parte.strip().partition(';')
+        calidad = parametros.strip()
+        if calidad.startswith('q='):
+            try:
+                if float(calidad[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if codificacion:
+            aceptadas.add(codificacion.strip().lower())
+    return aceptadas
+
+
+class EstaticosMiddleware:
+    """
+    Sirve STATIC_URL desde STATIC_ROOT sin un servidor web aparte: elige la
+    variante .br o .gz que acepte el navegador, responde 304 con ETag y marca
+    los archivos con hash en el nombre como `immutable` por un año.
+
+    El índice de STATIC_ROOT se arma en la primera petición; después de
+    collectstatic hay que reiniciar el servidor, como con cualquier despliegue.
+    Las rutas que no están en el índice siguen a las URLs normales.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefijo = '/' + settings.STATIC_URL.lstrip('/')
+        self._lock = threading.Lock()
+        self._archivos = None
+
+    def archivos(self):
+        if self._archivos is None:
+            with self._lock:
+                if self._archivos is None:
+                    self._archivos = indexar(settings.STATIC_ROOT)
+        return self._archivos
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD') and request.path_info.startswith(self.prefijo):
+            archivo = self.archivos().get(request.path_info[len(self.prefijo):])
+            if archivo is not None:
+                return self.servir(request, archivo)
+        return self.get_response(request)
+
+    def servir(self, request, archivo):
+        aceptadas = codificaciones_aceptadas(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        codificacion = next(
+            (codificacion for codificacion, _ in CODIFICACIONES
+             if codificacion in archivo.variantes and codificacion in aceptadas),
+            None
+        )
+        variante = archivo.variantes[codificacion]
+
+        response = get_conditional_response(
+            request, etag=variante.etag, last_modified=variante.ultima_modificacion
+        )
+        if response is None:
+            response = FileResponse(open(variante.ruta, 'rb'), content_type=archivo.tipo)
+            # FileResponse pone el nombre de la variante (.gz) en Content-Disposition
+            response.headers.pop('Content-Disposition', None)
+            if codificacion:
+                response['Content-Encoding'] = codificacion
+
+        response['ETag'] = variante.etag
+        response['Last-Modified'] = http_date(variante.ultima_modificacion)
+        if len(archivo.variantes) > 1:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        if archivo.inmutable:
+            patch_cache_control(response, public=True, max_age=SEGUNDOS_INMUTABLE, immutable=True)
+        else:
+            patch_cache_control(response, public=True, max_age=SEGUNDOS_MUTABLE)
+        return response
@@ -0,0 +1,187 @@
+import csv
+import io
+import re
+import zipfile
+from datetime import datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+
+# Exportaciones de listas del admin en CSV o XLSX. Las filas se generan a
+# medida que se envían: con un iterador de la base de datos
+# (QuerySet.iterator()) la memoria no depende del número de filas.
+
+FORMATOS = ('csv', 'xlsx')
+
+# Bytes que se juntan antes de enviar un bloque de la respuesta
+TAMANO_BLOQUE = 64 * 1024
+
+_TIPOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Caracteres de control que XML no admite
+_CONTROL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _valor(valor):
+    if isinstance(valor, datetime):
+        return timezone.localtime(valor).strftime('%Y-%m-%d %H:%M')
+    return valor
+
+
+# Inicios de celda que Excel interpreta como fórmula
+_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _valor_csv(valor):
+    valor = _valor(valor)
+    # Los nombres de clientes y productos los escriben los usuarios: un texto
+    # como "=HYPERLINK(...)" se ejecutaría al abrir el CSV en Excel
+    if isinstance(valor, str) and valor.startswith(_FORMULA):
+        return "'" + valor
+    return valor
+
+
+class _Eco:
+    """Para csv.writer: regresa la línea en lugar de escribirla."""
+
+    def write(self, valor):
+        return valor
+
+
+def _csv(encabezados, filas):
+    escritor = csv.writer(_Eco())
+    # El BOM hace que Excel abra el archivo como UTF-8
+    bloque = ['\ufeff', escritor.writerow([_valor_csv(valor) for valor in encabezados])]
+    tamano = 0
+    for fila in filas:
+        linea = escritor.writerow([_valor_csv(valor) for valor in fila])
+        bloque.append(linea)
+        tamano += len(linea)
+        if tamano >= TAMANO_BLOQUE:
+            yield ''.join(bloque).encode()
+            bloque, tamano = [], 0
+    yield ''.join(bloque).encode()
+
+
+class _Flujo(io.RawIOBase):
+    """
+    Destino sin seek() para ZipFile: guarda lo que se escribe hasta que se
+    recoge. Sin seek(), ZipFile escribe cada archivo en un solo pase.
+    """
+
+    def __init__(self):
+        self._partes = []
+        self.tamano = 0
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        self.tamano += len(datos)
+        return len(datos)
+
+    def recoger(self):
+        datos = b''.join(self._partes)
+        self._partes, self.tamano = [], 0
+        return datos
+
+
+_ESPACIOS = (
+    'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+)
+_RELACIONES = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_ENCABEZADO_XML = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+
+def _partes_xlsx(titulo):
+    return {
+        '[Content_Types].xml': (
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            '</Types>'
+        ),
+        '_rels/.rels': (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{_RELACIONES}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'
+        ),
+        'xl/workbook.xml': (
+            f'<workbook {_ESPACIOS}><sheets>'
+            f'<sheet name="{escape(titulo[:31])}" sheetId="1" r:id="rId1"/>'
+            '</sheets></workbook>'
+        ),
+        'xl/_rels/workbook.xml.rels': (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{_RELACIONES}/worksheet" Target="worksheets/sheet1.xml"/>'
+            '</Relationships>'
+        ),
+    }
+
+
+def _celda(valor):
+    valor = _valor(valor)
+    if valor is None:
+        return '<c/>'
+    if isinstance(valor, bool):
+        return f'<c t="b"><v>{int(valor)}</v></c>'
+    if isinstance(valor, (int, float, Decimal)):
+        return f'<c><v>{valor}</v></c>'
+    texto = escape(_CONTROL.sub('', str(valor)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def _fila_xlsx(fila):
+    return ('<row>' + ''.join(_celda(valor) for valor in fila) + '</row>').encode()
+
+
+def _xlsx(titulo, encabezados, filas):
+    flujo = _Flujo()
+    with zipfile.ZipFile(flujo, 'w', zipfile.ZIP_DEFLATED) as libro:
+        for nombre, contenido in _partes_xlsx(titulo).items():
+            libro.writestr(nombre, _ENCABEZADO_XML + contenido)
+        with libro.open('xl/worksheets/sheet1.xml', 'w') as hoja:
+            hoja.write(f'{_ENCABEZADO_XML}<worksheet {_ESPACIOS}><sheetData>'.encode())
+            hoja.write(_fila_xlsx(encabezados))
+            for fila in filas:
+                hoja.write(_fila_xlsx(fila))
+                if flujo.tamano >= TAMANO_BLOQUE:
+                    yield flujo.recoger()
+            hoja.write(b'</sheetData></worksheet>')
+    yield flujo.recoger()
+
+
+def formato(request):
+    """Formato pedido en ?formato= (CSV por omisión)."""
+    valor = request.GET.get('formato')
+    return valor if valor in FORMATOS else 'csv'
+
+
+def respuesta(formato, nombre, encabezados, filas):
+    """
+    StreamingHttpResponse que descarga las filas como `nombre`.csv o .xlsx.
+    `filas` debe ser un iterador (no una lista) para que la respuesta empiece
+    de inmediato y la memoria no crezca.
+    """
+    if formato == 'xlsx':
+        contenido = _xlsx(nombre, encabezados, filas)
+    else:
+        contenido = _csv(encabezados, filas)
+    response = StreamingHttpResponse(contenido, content_type=_TIPOS[formato])
+    response['Content-Disposition'] = f'attachment; filename="{nombre}.{formato}"'
+    # Que nginx no junte la respuesta completa antes de enviarla
+    response['X-Accel-Buffering'] = 'no'
+    patch_cache_control(response, private=True, no_store=True)
+    return response
@@ -0,0 +1,117 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache.backends.filebased import FileBasedCache
+from django.test import TestCase, override_settings
+from django.test.runner import DiscoverRunner
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from productos.models import Categoria, Marca, Producto
+from productos import facetas, referencias
+from productos.autocompletar import indice as indice_prefijos
+from productos.trigramas import indice as indice_trigramas
+from usuarios.models import Usuario, Direccion
+from pedidos.models import Pedido, DetallePedido
+
+from .consultas import presupuesto_consultas
+
+
+class EjecutorPruebas(DiscoverRunner):
+    """
+    Las cachés en archivos (también CacheCarritos) las comparte el servidor de
+    desarrollo: las pruebas usan en su lugar una caché en memoria por alias,
+    que limpiar() puede vaciar sin tocar los datos reales.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._caches = override_settings(CACHES={
+            alias: (
+                {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': alias}
+                if issubclass(import_string(configuracion['BACKEND']), FileBasedCache) else configuracion
+            )
+            for alias, configuracion in settings.CACHES.items()
+        })
+        self._caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._caches.disable()
+        super().teardown_test_environment(**kwargs)
+
+
+def crear_productos(num_productos=15):
+    """
+    Tres categorías y tres marcas con los productos repartidos entre ellas.
+    La descripción es larga para que se note si una lista la lee completa.
+    """
+    categorias = [Categoria.objects.create(nombre=f'Categoría {i}') for i in range(3)]
+    marcas = [Marca.objects.create(nombre=f'Marca {i}') for i in range(3)]
+    productos = [
+        Producto.objects.create(
+            nombre=f'Tornillo {i}',
+            descripcion='Tornillo de acero ' * 20,
+            id_categoria=categorias[i % 3],
+            id_marca=marcas[i % 3],
+            precio=Decimal('10.50') + i,
+            stock=100,
+        )
+        for i in range(num_productos)
+    ]
+    return categorias, marcas, productos
+
+
+def crear_usuarios():
+    """Un cliente y un administrador, los dos con la contraseña 'secreta123'."""
+    cliente = Usuario.objects.create_user('cliente@ferreguly.mx', 'Ana', 'López', 'secreta123')
+    admin = Usuario.objects.create_user(
+        'admin@ferreguly.mx', 'Luis', 'Pérez', 'secreta123', tipo_usuario='administrador'
+    )
+    return cliente, admin
+
+
+def crear_direccion(usuario):
+    return Direccion.objects.create(
+        id_usuario=usuario, nombre=usuario.nombre, apellidos=usuario.apellidos, telefono='9611234567',
+        email=usuario.email, calle='Central', numero_ext='1', colonia='Centro',
+        ciudad='Tuxtla Gutiérrez', estado='Chiapas', codigo_postal='29000'
+    )
+
+
+def crear_pedido(usuario, direccion, productos):
+    """Un pedido pendiente con una unidad de cada producto."""
+    pedido = Pedido.objects.create(id_usuario=usuario, id_direccion_envio=direccion, subtotal=0, total=0)
+    for producto in productos:
+        DetallePedido.objects.create(
+            id_pedido=pedido, id_producto=producto, cantidad=1, precio_unitario=producto.precio
+        )
+    return pedido
+
+
+class PresupuestoConsultasTestCase(TestCase):
+    """
+    Base para las pruebas de presupuesto de consultas. Cada módulo crea sus
+    datos con suficientes filas (productos, carrito, detalles de pedido) para
+    que un N+1 se note.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # Los índices en memoria se construyen antes de medir, para que el
+        # presupuesto refleje una petición normal y no la primera del proceso
+        referencias.limpiar()
+        for activas in (True, False):
+            referencias.categorias(activas)
+            referencias.marcas(activas)
+        facetas.indice.calcular()
+        indice_prefijos.construir()
+        indice_trigramas.construir()
+
+    def assertPresupuesto(self, nombre_url, args=(), metodo='get', datos=None, usuario=None):
+        if usuario is not None:
+            self.client.force_login(usuario)
+        url = reverse(nombre_url, args=args)
+        with presupuesto_consultas(nombre_url):
+            response = getattr(self.client, metodo)(url, datos or {})
+        self.assertLess(response.status_code, 400, f'{nombre_url} respondió {response.status_code}')
+        return response
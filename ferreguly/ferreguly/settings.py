@@ -34,16 +34,65 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Archivos estáticos con hash y precomprimidos (ver ferreguly/estaticos.py)
+    'ferreguly.estaticos.EstaticosMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'productos.referencias.ReferenciasMiddleware',
+    'pedidos.carritos.CarritoMiddleware',
+    
+    # Detector de consultas N+1 (sólo actúa con DEBUG = True)
+    'ferreguly.consultas.DetectorNMasUnoMiddleware',
 ]
 
+# Veces que se debe repetir la misma consulta para reportarla como N+1
+DETECTOR_N_MAS_UNO_UMBRAL = 5
+
+# Recalcular en un hilo aparte las entradas vencidas de la caché del catálogo
+# (mientras tanto se sirve la versión anterior)
+CACHE_CATALOGO_SEGUNDO_PLANO = True
+
+# Las ventas y las reservas copian sus productos al catálogo de lectura al
+# confirmarse su transacción; con False, dentro de ella (ver
+# productos/catalogo.py)
+CATALOGO_AL_CONFIRMAR = True
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Páginas completas de inicio, catálogo y detalle para visitantes anónimos
+    # (ver productos/cache_paginas.py). Debe ser compartida por todos los
+    # procesos para que las purgas lleguen a todos; con varios servidores,
+    # Redis o Memcached
+    'paginas': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'paginas',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    # Carritos de compra (ver pedidos/carritos.py). Debe ser compartida por
+    # todos los procesos, sobrevivir a un reinicio y no descartar entradas
+    # para hacer espacio: los carritos sólo están aquí hasta que se escriben.
+    # CacheCarritos, al llegar a MAX_ENTRIES, sólo borra las vencidas. Los
+    # archivos sirven en un solo servidor; con varios, Redis (con
+    # maxmemory-policy noeviction), donde además add() es atómico
+    'carritos': {
+        'BACKEND': 'pedidos.carritos.CacheCarritos',
+        'LOCATION': BASE_DIR / 'cache' / 'carritos',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+CACHE_PAGINAS_SEGUNDOS = 600
+
 ROOT_URLCONF = 'ferreguly.urls'
 
+# Las pruebas usan cachés en memoria en lugar de las de archivos
+TEST_RUNNER = 'ferreguly.pruebas.EjecutorPruebas'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -110,10 +159,42 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static'),
 ]
 
+# collectstatic pone el hash del contenido en el nombre de cada archivo y
+# genera sus variantes .gz (y .br si está instalado el paquete brotli)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'ferreguly.estaticos.AlmacenamientoEstatico'},
+}
+
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Quién envía los archivos de MEDIA_URL: None los envía Django (con sendfile si
+# el servidor WSGI lo soporta); 'x-accel-redirect' delega en nginx, que debe
+# tener una location interna MEDIA_PREFIJO_INTERNO apuntando a MEDIA_ROOT;
+# 'x-sendfile' delega en Apache (mod_xsendfile) o lighttpd.
+MEDIA_DESCARGA = None
+MEDIA_PREFIJO_INTERNO = '/media-interna/'
+
+# Hilos que generan las miniaturas de las imágenes de productos
+MINIATURAS_HILOS = 2
+
+# Minutos que se apartan las unidades de un producto al agregarlo al carrito
+# (el comando liberar_reservas libera las vencidas)
+RESERVA_CARRITO_MINUTOS = 30
+
+# Los carritos viven en la caché 'carritos' y sus líneas se escriben en la
+# base de datos en un hilo aparte cada tantos segundos (ver
+# pedidos/carritos.py); los de visitantes sin sesión duran CARRITO_ANONIMO_DIAS
+CARRITO_ESCRITURA_SEGUNDO_PLANO = True
+CARRITO_ESCRITURA_SEGUNDOS = 5
+CARRITO_ANONIMO_DIAS = 7
+
+# Los archivos subidos se escriben en un temporal (nunca en memoria) y se
+# calcula su hash al recibirlos (ver productos/almacenamiento.py)
+FILE_UPLOAD_HANDLERS = ['productos.almacenamiento.SubidaConHash']
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -142,5 +223,9 @@ LOGGING = {
             'handlers': ['console'],
             'level': 'DEBUG',
         },
+        'ferreguly.consultas': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
     },
 }
\ No newline at end of file
@@ -1,8 +1,11 @@
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from productos.media import servir_media
 from productos.views import CatalogoView
 from .views import HomeView  # Importar la vista de inicio personalizada
 
@@ -16,9 +19,11 @@ urlpatterns = [
     path('usuarios/', include('usuarios.urls')),
     path('productos/', include('productos.urls')),
     path('pedidos/', include('pedidos.urls')),
+
+    # Archivos subidos, también en producción (ver MEDIA_DESCARGA en settings)
+    re_path(r'^%s(?P<nombre>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), servir_media, name='media'),
 ]
 
-# Configuración para servir archivos estáticos y media durante desarrollo
+# Configuración para servir archivos estáticos durante desarrollo
 if settings.DEBUG:
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
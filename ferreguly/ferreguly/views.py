@@ -1,16 +1,40 @@
 from django.views.generic import TemplateView
-from productos.models import Categoria, Producto
+from productos.models import CatalogoItem
+from productos import referencias
+from productos.cache_paginas import CachePaginaAnonimaMixin, etiquetas_listado, etiquetas_productos
+from pedidos.models import MasVendido
+from pedidos import mas_vendidos
 
-class HomeView(TemplateView):
+class HomeView(CachePaginaAnonimaMixin, TemplateView):
     template_name = 'home.html'
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
         # Obtener todas las categorías activas
-        context['categorias'] = Categoria.objects.filter(activo=True)
+        context['categorias'] = referencias.categorias()
         
         # Obtener productos destacados (los más recientes)
-        context['productos_destacados'] = Producto.objects.filter(activo=True).order_by('-fecha_creacion')[:6]
+        context['productos_destacados'] = CatalogoItem.objects.tarjetas().order_by('-fecha_creacion')[:6]
         
-        return context
\ No newline at end of file
+        # Más vendidos del periodo, en general o de una categoría
+        periodos = dict(MasVendido.PERIODOS)
+        periodo = self.request.GET.get('periodo', '')
+        periodo = int(periodo) if periodo.isdigit() and int(periodo) in periodos else MasVendido.PERIODOS[0][0]
+        categoria = next(
+            (c for c in context['categorias'] if str(c.id_categoria) == self.request.GET.get('categoria')), None
+        )
+        context['periodos'] = MasVendido.PERIODOS
+        context['periodo'] = periodo
+        context['categoria_mas_vendidos'] = categoria
+        context['mas_vendidos'] = mas_vendidos.top(periodo, categoria)
+        
+        return context
+    
+    def etiquetas_pagina(self, context):
+        return (
+            {'productos', 'categorias', mas_vendidos.CLAVE}
+            | etiquetas_listado()
+            | etiquetas_productos(context['productos_destacados'])
+            | etiquetas_productos(context['mas_vendidos'])
+        )
@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ferreguly.settings')
 
 application = get_wsgi_application()
+
+# Los índices de búsqueda en memoria se construyen en segundo plano al
+# arrancar, para que la primera búsqueda no tenga que esperarlos
+from productos.autocompletar import indice as indice_prefijos  # noqa: E402
+from productos.trigramas import indice as indice_trigramas  # noqa: E402
+
+indice_prefijos.precargar()
+indice_trigramas.precargar()
@@ -1,6 +1,8 @@
 from django.contrib import admin
-from .models import Pedido, DetallePedido, Carrito
+from .models import Pedido, DetallePedido, Carrito, MasVendido, Reserva
 
 admin.site.register(Pedido)
 admin.site.register(DetallePedido)
-admin.site.register(Carrito)
\ No newline at end of file
+admin.site.register(Carrito)
+admin.site.register(MasVendido)
+admin.site.register(Reserva)
\ No newline at end of file
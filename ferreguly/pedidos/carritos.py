@@ -0,0 +1,348 @@
+import atexit
+import logging
+import secrets
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from productos.inventario import StockInsuficiente
+from productos.models import Producto
+
+from .models import Carrito
+from . import reservas
+
+# Carrito de trabajo en la caché 'carritos': {id_producto: cantidad} por
+# usuario o, para los visitantes sin sesión, por la cookie COOKIE. Agregar,
+# cambiar o quitar un producto sólo escribe en la caché.
+#
+# Los carritos de los usuarios se escriben después en la tabla carrito
+# (write-behind): cada cambio anota al usuario en PENDIENTES, una clave de la
+# misma caché, y un hilo escribe todos los anotados por lotes a los
+# CARRITO_ESCRITURA_SEGUNDOS, con un upsert y un DELETE por lote. Como la
+# lista está en la caché compartida, cualquier proceso puede escribir los
+# cambios hechos en otro; al terminar, cada proceso escribe lo que quede.
+# Sólo se escriben así las líneas: las reservas de stock (pedidos/reservas.py)
+# se ajustan en la misma petición con apartar() y liberar(), antes de guardar
+# el carrito, y el cambio se rechaza si las unidades no alcanzan.
+#
+# Cambiar, escribir u olvidar el carrito de un usuario se hace con su
+# bloqueo (bloqueado(), un cache.add() con vencimiento), así una escritura no
+# puede mezclarse con la del pedido: colocar el pedido escribe antes el
+# carrito y lo olvida sin soltar el bloqueo. Los carritos anónimos no apartan
+# stock (las reservas son por usuario): al iniciar sesión se suman al del
+# usuario con un solo INSERT ... ON CONFLICT, después de apartar sus unidades.
+#
+# La caché no debe descartar carritos para hacer espacio: CacheCarritos sólo
+# borra los vencidos.
+
+# Alias de CACHES donde se guardan los carritos
+ALIAS = 'carritos'
+
+# Cookie con el identificador del carrito anónimo
+COOKIE = 'carrito'
+
+# Clave con los ids de los usuarios cuyo carrito falta escribir
+PENDIENTES = 'carritos:pendientes'
+
+# Segundos que dura un bloqueo si el proceso que lo tomó no lo suelta
+BLOQUEO_SEGUNDOS = 30
+
+_TABLA = Carrito._meta.db_table
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_temporizador = None
+# Bloqueos que tiene el hilo actual, para poder volver a pedirlos
+_local = threading.local()
+
+
+class CacheCarritos(FileBasedCache):
+    """
+    FileBasedCache que al llegar a MAX_ENTRIES sólo borra las entradas
+    vencidas, en lugar de un tercio de ellas al azar: un carrito que todavía
+    no se escribe (o uno anónimo) sólo está en la caché.
+    """
+
+    def _cull(self):
+        archivos = self._list_cache_files()
+        if len(archivos) < self._max_entries:
+            return
+        for nombre in archivos:
+            try:
+                with open(nombre, 'rb') as archivo:
+                    # Borra el archivo si ya venció
+                    self._is_expired(archivo)
+            except FileNotFoundError:
+                pass
+
+
+def _cache():
+    return caches[ALIAS]
+
+
+def _segundos_anonimo():
+    return getattr(settings, 'CARRITO_ANONIMO_DIAS', 7) * 24 * 60 * 60
+
+
+def _clave_usuario(id_usuario):
+    return f'carrito:u:{id_usuario}'
+
+
+def _clave_anonimo(token):
+    return f'carrito:a:{token}'
+
+
+def _token(request, crear=False):
+    token = getattr(request, '_carrito_token', None) or request.COOKIES.get(COOKIE)
+    if token is None and crear:
+        token = request._carrito_token = secrets.token_urlsafe(24)
+    return token
+
+
+@contextmanager
+def _bloqueo(clave, esperar=True):
+    """
+    Toma el bloqueo `clave` en la caché (compartido entre procesos) y regresa
+    si lo consiguió; sin `esperar`, no lo espera si otro lo tiene.
+    """
+    tomados = _local.__dict__.setdefault('bloqueos', set())
+    if clave in tomados:
+        yield True
+        return
+    while not _cache().add(clave, 1, BLOQUEO_SEGUNDOS):
+        if not esperar:
+            yield False
+            return
+        time.sleep(0.01)
+    tomados.add(clave)
+    try:
+        yield True
+    finally:
+        tomados.discard(clave)
+        _cache().delete(clave)
+
+
+def bloqueado(usuario):
+    """Bloqueo del carrito del usuario, para leerlo, cambiarlo y olvidarlo sin que otro lo escriba."""
+    return _bloqueo(f'carrito:bloqueo:{usuario.pk}')
+
+
+def _anotar(agregar=(), quitar=()):
+    with _bloqueo(f'{PENDIENTES}:bloqueo'):
+        pendientes = _cache().get(PENDIENTES, set())
+        pendientes = (pendientes | set(agregar)) - set(quitar)
+        _cache().set(PENDIENTES, pendientes, None)
+
+
+def _de_usuario(id_usuario):
+    lineas = _cache().get(_clave_usuario(id_usuario))
+    if lineas is None:
+        lineas = dict(
+            Carrito.objects.filter(id_usuario=id_usuario).order_by('id_carrito')
+            .values_list('id_producto', 'cantidad')
+        )
+        _cache().set(_clave_usuario(id_usuario), lineas, _segundos_anonimo())
+    return lineas
+
+
+def lineas(request):
+    """Carrito de la petición: {id_producto: cantidad} en el orden en que se agregaron."""
+    if request.user.is_authenticated:
+        return _de_usuario(request.user.pk)
+    token = _token(request)
+    return (_cache().get(_clave_anonimo(token)) or {}) if token else {}
+
+
+def guardar(request, lineas):
+    """Guarda el carrito en la caché; el de un usuario se escribe después en la base de datos."""
+    if request.user.is_authenticated:
+        with bloqueado(request.user):
+            _cache().set(_clave_usuario(request.user.pk), lineas, _segundos_anonimo())
+            _anotar(agregar=[request.user.pk])
+        _programar()
+    else:
+        _cache().set(_clave_anonimo(_token(request, crear=True)), lineas, _segundos_anonimo())
+
+
+def apartar(request, producto, cantidad):
+    """
+    Aparta `cantidad` unidades del producto (en total) para el carrito del
+    usuario de la petición, antes de guardar el cambio; lanza
+    StockInsuficiente si no alcanzan. Los carritos anónimos no apartan.
+    """
+    if request.user.is_authenticated:
+        # En su propio savepoint: si no alcanza, no deshace la transacción
+        # de quien llama
+        with transaction.atomic():
+            reservas.reservar(request.user, producto, cantidad)
+
+
+def liberar(request, id_producto):
+    """Libera lo apartado del producto para el carrito del usuario de la petición."""
+    if request.user.is_authenticated:
+        reservas.liberar(request.user, [id_producto])
+
+
+def _programar():
+    global _temporizador
+    if not getattr(settings, 'CARRITO_ESCRITURA_SEGUNDO_PLANO', True):
+        return
+    with _lock:
+        if _temporizador is not None:
+            return
+        _temporizador = threading.Timer(getattr(settings, 'CARRITO_ESCRITURA_SEGUNDOS', 5), _escribir_pendientes)
+        _temporizador.daemon = True
+        _temporizador.start()
+
+
+def _escribir_pendientes():
+    global _temporizador
+    with _lock:
+        _temporizador = None
+    try:
+        persistir()
+    except Exception:
+        logger.exception('No se pudieron escribir los carritos pendientes')
+    finally:
+        connection.close()
+
+
+atexit.register(_escribir_pendientes)
+
+
+def persistir(usuarios=None):
+    """
+    Escribe en la tabla carrito los carritos pendientes de cualquier proceso
+    (sólo los de `usuarios`, si se indican). Los que otro está escribiendo en
+    ese momento se dejan para la siguiente vez, salvo los de `usuarios`, que
+    se esperan. Regresa cuántos carritos escribió.
+    """
+    pendientes = _cache().get(PENDIENTES, set())
+    ids = sorted(pendientes if usuarios is None else pendientes & set(usuarios))
+    if not ids:
+        return 0
+    with ExitStack() as bloqueos:
+        carritos, olvidados = {}, []
+        for id_usuario in ids:
+            if not bloqueos.enter_context(_bloqueo(f'carrito:bloqueo:{id_usuario}', esperar=usuarios is not None)):
+                continue
+            # Con el bloqueo se vuelve a leer: otro proceso pudo escribirlo
+            if id_usuario not in _cache().get(PENDIENTES, set()):
+                continue
+            lineas = _cache().get(_clave_usuario(id_usuario))
+            if lineas is None:
+                # Ya no está en la caché: no hay nada nuevo que escribir
+                olvidados.append(id_usuario)
+            else:
+                carritos[id_usuario] = lineas
+        if carritos:
+            _escribir(carritos)
+        if carritos or olvidados:
+            _anotar(quitar=[*carritos, *olvidados])
+    return len(carritos)
+
+
+def _escribir(carritos):
+    ahora = timezone.now()
+    with transaction.atomic():
+        # Los productos que ya no existen no se escriben
+        productos = Producto.objects.only('id_producto').in_bulk(
+            {id_producto for lineas in carritos.values() for id_producto in lineas}
+        )
+        Carrito.objects.bulk_create(
+            [
+                Carrito(id_usuario_id=id_usuario, id_producto_id=id_producto, cantidad=cantidad, fecha_agregado=ahora)
+                for id_usuario, lineas in carritos.items()
+                for id_producto, cantidad in lineas.items() if id_producto in productos
+            ],
+            batch_size=500, update_conflicts=True,
+            unique_fields=['id_usuario', 'id_producto'], update_fields=['cantidad'],
+        )
+        quitados = [
+            pk for pk, id_usuario, id_producto in
+            Carrito.objects.filter(id_usuario__in=carritos).values_list('pk', 'id_usuario', 'id_producto')
+            if id_producto not in carritos[id_usuario]
+        ]
+        if quitados:
+            Carrito.objects.filter(pk__in=quitados).delete()
+
+
+def olvidar(usuario):
+    """
+    Borra de la caché el carrito del usuario, que se volverá a leer de la
+    tabla (por ejemplo, después de colocar el pedido).
+    """
+    with bloqueado(usuario):
+        _cache().delete(_clave_usuario(usuario.pk))
+        _anotar(quitar=[usuario.pk])
+
+
+def fusionar(request, usuario):
+    """
+    Suma el carrito anónimo de la petición al del usuario con un solo
+    INSERT ... ON CONFLICT y lo borra de la caché. Antes aparta las unidades
+    de cada línea sumada; si de un producto no alcanzan, su línea se queda
+    como estaba. Regresa los StockInsuficiente de esos productos, para
+    avisarle al usuario.
+    """
+    token = _token(request)
+    anonimo = _cache().get(_clave_anonimo(token)) if token else None
+    if not anonimo:
+        return []
+    productos = Producto.objects.filter(pk__in=anonimo, activo=True).only('id_producto', 'nombre').in_bulk()
+    faltantes, filas = [], []
+    ahora = connection.ops.adapt_datetimefield_value(timezone.now())
+    with bloqueado(usuario):
+        persistir([usuario.pk])
+        actuales = dict(
+            Carrito.objects.filter(id_usuario=usuario, id_producto__in=productos).values_list('id_producto', 'cantidad')
+        )
+        for id_producto, cantidad in anonimo.items():
+            if id_producto not in productos:
+                continue
+            total = actuales.get(id_producto, 0) + cantidad
+            try:
+                with transaction.atomic():
+                    reservas.reservar(usuario, productos[id_producto], total)
+            except StockInsuficiente as error:
+                faltantes.append(error)
+                continue
+            filas.append((usuario.pk, id_producto, total))
+        with transaction.atomic():
+            if filas:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"INSERT INTO {_TABLA} (id_usuario_id, id_producto_id, cantidad, fecha_agregado) VALUES "
+                        + ', '.join(['(%s, %s, %s, %s)'] * len(filas))
+                        + " ON CONFLICT (id_usuario_id, id_producto_id) DO UPDATE SET cantidad = excluded.cantidad",
+                        [valor for fila in filas for valor in (*fila, ahora)]
+                    )
+            _cache().delete(_clave_anonimo(token))
+            _cache().delete(_clave_usuario(usuario.pk))
+    return faltantes
+
+
+def limpiar():
+    """Olvida los carritos en caché y los pendientes (para las pruebas)."""
+    _cache().clear()
+
+
+class CarritoMiddleware:
+    """Envía la cookie del carrito anónimo cuando se crea."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        token = getattr(request, '_carrito_token', None)
+        if token:
+            response.set_cookie(COOKIE, token, max_age=_segundos_anonimo(), httponly=True, samesite='Lax')
+        return response
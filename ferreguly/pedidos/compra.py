@@ -0,0 +1,93 @@
+from django.db import transaction
+from django.db.models import Sum
+
+from productos import inventario
+from productos.models import MovimientoInventario
+
+from .models import Carrito, DetallePedido, Pedido
+from . import mas_vendidos, reservas
+
+# Escritura de un pedido a partir del carrito. Todo va en una transacción: la
+# venta se registra con movimientos de inventario de productos.inventario (que
+# lanza StockInsuficiente si otra compra ya se llevó las unidades), las
+# unidades que el comprador tenía apartadas (pedidos/reservas.py) dejan de
+# estar apartadas y los detalles se insertan en una sola sentencia.
+
+StockInsuficiente = inventario.StockInsuficiente
+
+
+def colocar(usuario, direccion, carrito_items):
+    """
+    Crea el pedido de los `carrito_items` (ya cargados, con sus productos),
+    descuenta el stock y vacía el carrito. Si alguna línea ya no tiene stock
+    lanza StockInsuficiente y no se guarda nada.
+    """
+    with transaction.atomic():
+        # Calcular totales
+        subtotal = sum(item.subtotal for item in carrito_items)
+        total = subtotal  # Aquí se podría agregar lógica para impuestos, envío, etc.
+        
+        pedido = Pedido.objects.create(
+            id_usuario=usuario,
+            id_direccion_envio=direccion,
+            subtotal=subtotal,
+            total=total,
+            estado='pendiente'
+        )
+        
+        # Registrar la venta de todas las líneas, contando lo que el comprador
+        # tenía apartado; si alguna ya no alcanza se deshace todo (y las
+        # reservas vuelven)
+        cantidades = {item.id_producto_id: item.cantidad for item in carrito_items}
+        reservas.tomar(usuario, cantidades)
+        inventario.descontar(cantidades, pedido)
+        
+        DetallePedido.objects.bulk_create([
+            DetallePedido(
+                id_pedido=pedido,
+                id_producto=item.id_producto,
+                cantidad=item.cantidad,
+                precio_unitario=item.id_producto.precio,
+                subtotal=item.subtotal
+            )
+            for item in carrito_items
+        ])
+        
+        # Sumar las cantidades al ranking de más vendidos
+        mas_vendidos.registrar(pedido)
+        
+        # Vaciar el carrito (sólo las líneas compradas)
+        Carrito.objects.filter(pk__in=[item.pk for item in carrito_items]).delete()
+    return pedido
+
+
+def cambiar_estado(pedido, nuevo_estado, usuario):
+    """
+    Cambia el estado del pedido. Al cancelarlo sus unidades vuelven al
+    inventario con movimientos de cancelación y dejan de contar en los más
+    vendidos; al reactivarlo se vuelven a vender, y si ya no hay stock lanza
+    StockInsuficiente sin cambiar nada.
+    """
+    with transaction.atomic():
+        # El estado se vuelve a leer con el pedido bloqueado: si dos
+        # administradores lo cancelan a la vez, el segundo ya lo ve cancelado
+        # y sus unidades no regresan dos veces
+        anterior = Pedido.objects.select_for_update().values_list('estado', flat=True).get(pk=pedido.pk)
+        if (anterior == 'cancelado') != (nuevo_estado == 'cancelado'):
+            cantidades = dict(
+                DetallePedido.objects.filter(id_pedido=pedido).values('id_producto')
+                .annotate(total=Sum('cantidad')).order_by().values_list('id_producto', 'total')
+            )
+            if nuevo_estado == 'cancelado':
+                inventario.registrar([
+                    MovimientoInventario(
+                        id_producto_id=id_producto, tipo='cancelacion', cantidad=cantidad,
+                        id_pedido=pedido, id_usuario=usuario
+                    )
+                    for id_producto, cantidad in cantidades.items()
+                ])
+            else:
+                inventario.descontar(cantidades, pedido=pedido)
+            mas_vendidos.registrar(pedido, -1 if nuevo_estado == 'cancelado' else 1)
+        pedido.estado = nuevo_estado
+        pedido.save()
@@ -1,5 +1,5 @@
 from django import forms
-from .models import Pedido, Carrito
+from .models import Pedido
 from usuarios.models import Direccion
 
 class PedidoForm(forms.ModelForm):
@@ -36,10 +36,10 @@ class CarritoAddForm(forms.Form):
     )
     id_producto = forms.IntegerField(widget=forms.HiddenInput())
 
-class CarritoUpdateForm(forms.ModelForm):
-    class Meta:
-        model = Carrito
-        fields = ['cantidad']
-        widgets = {
-            'cantidad': forms.NumberInput(attrs={'class': 'form-control', 'min': 1})
-        }
\ No newline at end of file
+class CarritoUpdateForm(forms.Form):
+    # El carrito vive en la caché (ver pedidos/carritos.py), así que el
+    # formulario no guarda un Carrito
+    cantidad = forms.IntegerField(
+        min_value=1,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'min': 1})
+    )
\ No newline at end of file
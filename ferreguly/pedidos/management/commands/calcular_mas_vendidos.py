@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from pedidos import mas_vendidos
+
+
+class Command(BaseCommand):
+    help = (
+        'Renueva el ranking de productos más vendidos para el día de hoy '
+        '(conviene programarlo poco después de medianoche)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reconstruir', action='store_true',
+            help='Vuelve a sumar las ventas diarias a partir de los pedidos (la primera vez, o si hubo cambios por fuera)'
+        )
+
+    def handle(self, *args, **options):
+        if options['reconstruir']:
+            mas_vendidos.reconstruir()
+        else:
+            mas_vendidos.renovar()
+        self.stdout.write(self.style.SUCCESS('Ranking de más vendidos actualizado'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from pedidos import reservas
+
+
+class Command(BaseCommand):
+    help = (
+        'Libera las reservas de stock de los carritos que ya vencieron '
+        '(conviene programarlo cada minuto)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Reservas que se liberan por transacción')
+        parser.add_argument(
+            '--recalcular', action='store_true',
+            help='Además corrige las unidades apartadas del catálogo que no coincidan con las reservas'
+        )
+
+    def handle(self, *args, **options):
+        liberadas = reservas.liberar_vencidas(lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(f'{liberadas} reservas vencidas liberadas'))
+        if options['recalcular']:
+            corregidos = reservas.recalcular()
+            self.stdout.write(self.style.SUCCESS(f'{corregidos} productos corregidos'))
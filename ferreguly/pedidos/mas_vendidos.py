@@ -0,0 +1,135 @@
+from datetime import datetime, time, timedelta
+
+from django.db import connection, transaction
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from productos.models import CatalogoItem, Generacion, Producto
+from productos import cache_paginas
+
+from .models import DetallePedido, MasVendido, VentaDiaria
+
+# Ranking de los productos más vendidos (general y por categoría) en los
+# últimos 7 y 30 días, guardado en mas_vendido para que la página de inicio lo
+# lea ya ordenado con un índice.
+#
+# Cada pedido que se coloca suma sus cantidades (y uno que se cancela las
+# resta) en venta_diaria y en mas_vendido, sólo con upserts. Una vez al día el
+# comando calcular_mas_vendidos llama a renovar(), que vuelve a sumar
+# mas_vendido a partir de venta_diaria para que los días que salen de la
+# ventana dejen de contar; la Generacion CLAVE guarda el día de la última
+# renovación. Colocar un pedido nunca renueva: sería un DELETE y un recálculo
+# completos dentro de la transacción del cliente.
+
+CLAVE = 'mas_vendidos'
+
+# Días que cubre venta_diaria
+DIAS = max(periodo for periodo, _ in MasVendido.PERIODOS)
+
+_DETALLE = DetallePedido._meta.db_table
+_PRODUCTO = Producto._meta.db_table
+_VENTA = VentaDiaria._meta.db_table
+_MAS_VENDIDO = MasVendido._meta.db_table
+
+_SUMAR_VENTA = (
+    f"INSERT INTO {_VENTA} (fecha, id_producto_id, cantidad) "
+    f"SELECT %s, id_producto_id, %s * SUM(cantidad) FROM {_DETALLE} "
+    f"WHERE id_pedido_id = %s GROUP BY id_producto_id "
+    f"ON CONFLICT (fecha, id_producto_id) DO UPDATE SET cantidad = {_VENTA}.cantidad + excluded.cantidad"
+)
+
+_SUMAR_RANKING = (
+    f"INSERT INTO {_MAS_VENDIDO} (periodo, id_producto_id, id_categoria_id, cantidad) "
+    f"SELECT %s, d.id_producto_id, p.id_categoria_id, %s * SUM(d.cantidad) "
+    f"FROM {_DETALLE} d JOIN {_PRODUCTO} p ON p.id_producto = d.id_producto_id "
+    f"WHERE d.id_pedido_id = %s GROUP BY d.id_producto_id, p.id_categoria_id "
+    f"ON CONFLICT (periodo, id_producto_id) DO UPDATE SET cantidad = {_MAS_VENDIDO}.cantidad + excluded.cantidad"
+)
+
+_CALCULAR_RANKING = (
+    f"INSERT INTO {_MAS_VENDIDO} (periodo, id_producto_id, id_categoria_id, cantidad) "
+    f"SELECT %s, v.id_producto_id, p.id_categoria_id, SUM(v.cantidad) "
+    f"FROM {_VENTA} v JOIN {_PRODUCTO} p ON p.id_producto = v.id_producto_id "
+    f"WHERE v.fecha > %s GROUP BY v.id_producto_id, p.id_categoria_id HAVING SUM(v.cantidad) > 0"
+)
+
+
+def _fecha(valor):
+    return connection.ops.adapt_datefield_value(valor)
+
+
+def renovar(hoy=None):
+    """
+    Vuelve a calcular mas_vendido con las ventas de los últimos días y borra
+    las ventas diarias que ya no cubre ningún periodo. También la categoría de
+    cada producto se actualiza aquí.
+    """
+    hoy = hoy or timezone.localdate()
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {_MAS_VENDIDO}")
+            for periodo, _ in MasVendido.PERIODOS:
+                cursor.execute(_CALCULAR_RANKING, [periodo, _fecha(hoy - timedelta(days=periodo))])
+        VentaDiaria.objects.filter(fecha__lte=hoy - timedelta(days=DIAS)).delete()
+        Generacion.objects.update_or_create(clave=CLAVE, defaults={'valor': hoy.toordinal(), 'fecha': timezone.now()})
+    transaction.on_commit(lambda: cache_paginas.purgar(CLAVE))
+
+
+def registrar(pedido, signo=1):
+    """
+    Suma las cantidades del pedido a las ventas de su día y a los rankings que
+    lo incluyen; con signo=-1 las resta (al cancelarlo). No renueva el
+    ranking: de eso se encarga el comando calcular_mas_vendidos.
+    """
+    dias = (timezone.localdate() - timezone.localdate(pedido.fecha_pedido)).days
+    if dias >= DIAS:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(_SUMAR_VENTA, [_fecha(timezone.localdate(pedido.fecha_pedido)), signo, pedido.pk])
+        for periodo, _ in MasVendido.PERIODOS:
+            if dias < periodo:
+                cursor.execute(_SUMAR_RANKING, [periodo, signo, pedido.pk])
+    transaction.on_commit(lambda: cache_paginas.purgar(CLAVE))
+
+
+def reconstruir():
+    """Vuelve a llenar venta_diaria a partir de los pedidos y renueva el ranking."""
+    hoy = timezone.localdate()
+    desde = timezone.make_aware(datetime.combine(hoy - timedelta(days=DIAS - 1), time.min))
+    ventas = (
+        DetallePedido.objects
+        .filter(id_pedido__fecha_pedido__gte=desde)
+        .exclude(id_pedido__estado='cancelado')
+        .annotate(fecha=TruncDate('id_pedido__fecha_pedido'))
+        .values('fecha', 'id_producto')
+        .annotate(total=Sum('cantidad'))
+        .order_by()
+    )
+    with transaction.atomic():
+        VentaDiaria.objects.all().delete()
+        # A lo más DIAS filas por producto
+        VentaDiaria.objects.bulk_create([
+            VentaDiaria(fecha=venta['fecha'], id_producto_id=venta['id_producto'], cantidad=venta['total'])
+            for venta in ventas
+        ], batch_size=1000)
+        renovar(hoy)
+
+
+def top(periodo=7, categoria=None, cantidad=6):
+    """
+    Productos más vendidos en el periodo (y la categoría), del catálogo de
+    lectura, en una consulta: el ranking va en una subconsulta por índice.
+    """
+    ranking = MasVendido.objects.filter(periodo=periodo, cantidad__gt=0)
+    if categoria:
+        ranking = ranking.filter(id_categoria=categoria)
+    # Se piden de más por si alguno de los primeros ya no está activo (y por
+    # lo tanto no está en el catálogo)
+    ids = ranking.order_by('-cantidad').values('id_producto')[:cantidad * 2]
+    return (
+        CatalogoItem.objects.tarjetas()
+        .filter(id_producto__in=ids)
+        .annotate(vendidos=Subquery(ranking.filter(id_producto=OuterRef('id_producto')).values('cantidad')))
+        .order_by('-vendidos', 'id_producto')[:cantidad]
+    )
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:55
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Carrito',
+            fields=[
+                ('id_carrito', models.AutoField(primary_key=True, serialize=False)),
+                ('cantidad', models.IntegerField(default=1)),
+                ('fecha_agregado', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Carrito',
+                'verbose_name_plural': 'Carritos',
+                'db_table': 'carrito',
+            },
+        ),
+        migrations.CreateModel(
+            name='DetallePedido',
+            fields=[
+                ('id_detalle', models.AutoField(primary_key=True, serialize=False)),
+                ('cantidad', models.IntegerField()),
+                ('precio_unitario', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('subtotal', models.DecimalField(decimal_places=2, max_digits=10)),
+            ],
+            options={
+                'verbose_name': 'Detalle de pedido',
+                'verbose_name_plural': 'Detalles de pedidos',
+                'db_table': 'detalle_pedido',
+            },
+        ),
+        migrations.CreateModel(
+            name='Pedido',
+            fields=[
+                ('id_pedido', models.AutoField(primary_key=True, serialize=False)),
+                ('fecha_pedido', models.DateTimeField(default=django.utils.timezone.now)),
+                ('subtotal', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('total', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('pagado', 'Pagado'), ('enviado', 'Enviado'), ('entregado', 'Entregado'), ('cancelado', 'Cancelado')], default='pendiente', max_length=15)),
+            ],
+            options={
+                'verbose_name': 'Pedido',
+                'verbose_name_plural': 'Pedidos',
+                'db_table': 'pedido',
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('productos', '0001_initial'),
+        ('usuarios', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('pedidos', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pedido',
+            name='id_direccion_envio',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pedidos', to='usuarios.direccion'),
+        ),
+        migrations.AddField(
+            model_name='pedido',
+            name='id_usuario',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='pedidos', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='detallepedido',
+            name='id_pedido',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='detalles', to='pedidos.pedido'),
+        ),
+        migrations.AddField(
+            model_name='detallepedido',
+            name='id_producto',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='detalles_pedido', to='productos.producto'),
+        ),
+        migrations.AddField(
+            model_name='carrito',
+            name='id_producto',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='carrito_items', to='productos.producto'),
+        ),
+        migrations.AddField(
+            model_name='carrito',
+            name='id_usuario',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='carrito', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['id_usuario'], name='idx_pedido_usuario'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['fecha_pedido'], name='idx_pedido_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='carrito',
+            index=models.Index(fields=['id_usuario'], name='idx_carrito_usuario'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='carrito',
+            unique_together={('id_usuario', 'id_producto')},
+        ),
+    ]
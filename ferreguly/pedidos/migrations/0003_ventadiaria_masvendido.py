@@ -0,0 +1,47 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0008_recomendaciones'),
+        ('pedidos', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VentaDiaria',
+            fields=[
+                ('id_venta_diaria', models.AutoField(primary_key=True, serialize=False)),
+                ('fecha', models.DateField()),
+                ('cantidad', models.IntegerField(default=0)),
+                ('id_producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='productos.producto')),
+            ],
+            options={
+                'verbose_name': 'Venta diaria',
+                'verbose_name_plural': 'Ventas diarias',
+                'db_table': 'venta_diaria',
+                'unique_together': {('fecha', 'id_producto')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MasVendido',
+            fields=[
+                ('id_mas_vendido', models.AutoField(primary_key=True, serialize=False)),
+                ('periodo', models.SmallIntegerField(choices=[(7, 'Últimos 7 días'), (30, 'Últimos 30 días')])),
+                ('cantidad', models.IntegerField(default=0)),
+                ('id_categoria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='productos.categoria')),
+                ('id_producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mas_vendido', to='productos.producto')),
+            ],
+            options={
+                'verbose_name': 'Más vendido',
+                'verbose_name_plural': 'Más vendidos',
+                'db_table': 'mas_vendido',
+                'indexes': [models.Index(fields=['periodo', 'cantidad'], name='idx_mas_vendido_periodo'), models.Index(fields=['periodo', 'id_categoria', 'cantidad'], name='idx_mas_vendido_categoria')],
+                'unique_together': {('periodo', 'id_producto')},
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0010_reservado'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('pedidos', '0003_ventadiaria_masvendido'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reserva',
+            fields=[
+                ('id_reserva', models.AutoField(primary_key=True, serialize=False)),
+                ('cantidad', models.IntegerField()),
+                ('expira', models.DateTimeField()),
+                ('id_producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='productos.producto')),
+                ('id_usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Reserva de stock',
+                'verbose_name_plural': 'Reservas de stock',
+                'db_table': 'reserva_stock',
+                'indexes': [models.Index(fields=['expira'], name='idx_reserva_expira')],
+                'unique_together': {('id_usuario', 'id_producto')},
+            },
+        ),
+    ]
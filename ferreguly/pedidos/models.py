@@ -1,7 +1,7 @@
 from django.db import models
 from django.utils import timezone
 from usuarios.models import Usuario, Direccion
-from productos.models import Producto
+from productos.models import Categoria, Producto
 
 class Pedido(models.Model):
     ESTADOS_CHOICES = [
@@ -38,6 +38,17 @@ class Pedido(models.Model):
             models.Index(fields=['fecha_pedido'], name='idx_pedido_fecha'),
         ]
 
+class ConProductosQuerySet(models.QuerySet):
+    def con_productos(self):
+        """
+        Une el producto con su categoría y marca (que muestran las listas del
+        carrito y de los pedidos) sin cargar la descripción completa.
+        """
+        return (
+            self.select_related('id_producto__id_categoria', 'id_producto__id_marca')
+            .defer('id_producto__descripcion')
+        )
+
 class DetallePedido(models.Model):
     id_detalle = models.AutoField(primary_key=True)
     id_pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE, related_name='detalles')
@@ -46,6 +57,8 @@ class DetallePedido(models.Model):
     precio_unitario = models.DecimalField(max_digits=10, decimal_places=2)
     subtotal = models.DecimalField(max_digits=10, decimal_places=2)
     
+    objects = ConProductosQuerySet.as_manager()
+    
     def __str__(self):
         return f"Detalle #{self.id_detalle} - Pedido #{self.id_pedido.id_pedido}"
     
@@ -65,6 +78,8 @@ class Carrito(models.Model):
     cantidad = models.IntegerField(default=1)
     fecha_agregado = models.DateTimeField(default=timezone.now)
     
+    objects = ConProductosQuerySet.as_manager()
+    
     class Meta:
         db_table = 'carrito'
         verbose_name = 'Carrito'
@@ -79,4 +94,79 @@ class Carrito(models.Model):
     
     @property
     def subtotal(self):
-        return self.cantidad * self.id_producto.precio
\ No newline at end of file
+        return self.cantidad * self.id_producto.precio
+
+class Reserva(models.Model):
+    """
+    Unidades de un producto apartadas para el carrito de un usuario hasta
+    `expira`. El stock disponible de un producto es su existencia menos la
+    suma de sus reservas (por el índice de id_producto); el índice por
+    `expira` es el que usa el barrido de reservas vencidas.
+    """
+    id_reserva = models.AutoField(primary_key=True)
+    id_usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='reservas')
+    id_producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='reservas')
+    cantidad = models.IntegerField()
+    expira = models.DateTimeField()
+    
+    def __str__(self):
+        return f"{self.id_usuario_id} - {self.id_producto_id}: {self.cantidad} hasta {self.expira}"
+    
+    class Meta:
+        db_table = 'reserva_stock'
+        verbose_name = 'Reserva de stock'
+        verbose_name_plural = 'Reservas de stock'
+        unique_together = ('id_usuario', 'id_producto')
+        indexes = [
+            models.Index(fields=['expira'], name='idx_reserva_expira'),
+        ]
+
+class VentaDiaria(models.Model):
+    """
+    Unidades vendidas de cada producto por día (según la fecha del pedido, sin
+    los cancelados). Sólo se guardan los días que cubre el periodo más largo
+    de MasVendido.
+    """
+    id_venta_diaria = models.AutoField(primary_key=True)
+    fecha = models.DateField()
+    id_producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='+')
+    cantidad = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.fecha} - {self.id_producto_id}: {self.cantidad}"
+    
+    class Meta:
+        db_table = 'venta_diaria'
+        verbose_name = 'Venta diaria'
+        verbose_name_plural = 'Ventas diarias'
+        unique_together = ('fecha', 'id_producto')
+
+class MasVendido(models.Model):
+    """
+    Unidades vendidas de cada producto en los últimos `periodo` días. Los
+    índices (periodo, cantidad) y (periodo, id_categoria, cantidad) dan el
+    ranking general y el de cada categoría ya ordenados.
+    """
+    PERIODOS = [
+        (7, 'Últimos 7 días'),
+        (30, 'Últimos 30 días'),
+    ]
+    
+    id_mas_vendido = models.AutoField(primary_key=True)
+    periodo = models.SmallIntegerField(choices=PERIODOS)
+    id_producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='mas_vendido')
+    id_categoria = models.ForeignKey(Categoria, on_delete=models.CASCADE, related_name='+')
+    cantidad = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.periodo} días - {self.id_producto_id}: {self.cantidad}"
+    
+    class Meta:
+        db_table = 'mas_vendido'
+        verbose_name = 'Más vendido'
+        verbose_name_plural = 'Más vendidos'
+        unique_together = ('periodo', 'id_producto')
+        indexes = [
+            models.Index(fields=['periodo', 'cantidad'], name='idx_mas_vendido_periodo'),
+            models.Index(fields=['periodo', 'id_categoria', 'cantidad'], name='idx_mas_vendido_categoria'),
+        ]
@@ -0,0 +1,164 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from productos.inventario import StockInsuficiente
+from productos.models import CatalogoItem, Producto
+from productos import cache_paginas, catalogo, inventario
+
+from .models import Reserva
+
+# Reservas de stock para los carritos: al escribirse el carrito de un usuario
+# en la base de datos (pedidos/carritos.py) sus productos apartan las
+# unidades por RESERVA_CARRITO_MINUTOS y otros clientes ya no pueden
+# apartarlas ni comprarlas. Lo apartado de un producto es la suma de sus
+# filas de reserva (ProductoQuerySet.con_existencia() la agrega como
+# `reservado`), así que el stock disponible es su existencia (stock más los
+# movimientos de inventario pendientes, ver productos/inventario.py) menos
+# esa suma. Ni apartar ni comprar escriben en la fila del producto; la copia
+# de catalogo_item se actualiza al confirmarse (catalogo.actualizar_despues()).
+#
+# Apartar más unidades es un INSERT ... ON CONFLICT condicional (WHERE
+# existencia - lo apartado por otros >= n): la base de datos compara y
+# escribe en la misma sentencia, así que dos carritos no apartan la misma
+# unidad (fuera de SQLite, después de inventario.bloquear() la fila del
+# producto, como una venta). Las reservas vencidas se liberan por lotes con liberar_vencidas()
+# (el comando liberar_reservas); desde que vencen ya no apartan nada, aunque
+# la copia de catalogo_item las muestra hasta que se liberan.
+
+_TABLA = Reserva._meta.db_table
+
+
+def _minutos():
+    return getattr(settings, 'RESERVA_CARRITO_MINUTOS', 30)
+
+
+def _cambiadas(ids):
+    """Copia al catálogo lo apartado de los productos `ids` y purga sus páginas."""
+    ids = sorted(ids)
+    if ids:
+        catalogo.actualizar_despues(ids, lambda: _purgar(ids))
+
+
+def _purgar(ids):
+    ids = sorted(ids)
+    for inicio in range(0, len(ids), 1000):
+        cache_paginas.purgar(*(f'producto:{id_producto}' for id_producto in ids[inicio:inicio + 1000]))
+
+
+def reservar(usuario, producto, cantidad):
+    """
+    Aparta `cantidad` unidades del producto (en total, no además de las que
+    ya tenía) para el carrito del usuario y renueva el plazo. Si no hay
+    suficientes disponibles lanza StockInsuficiente y la reserva anterior
+    queda igual.
+    """
+    ahora = timezone.now()
+    expira = ahora + timedelta(minutes=_minutos())
+    with transaction.atomic(savepoint=False):
+        reserva = Reserva.objects.select_for_update().filter(id_usuario=usuario, id_producto=producto).first()
+        # Una reserva vencida ya no aparta nada: renovarla es apartar de nuevo
+        actual = reserva.cantidad if reserva and reserva.expira > ahora else 0
+        if reserva is not None and cantidad <= actual:
+            # Apartar menos siempre se puede
+            Reserva.objects.filter(pk=reserva.pk).update(cantidad=cantidad, expira=expira)
+        else:
+            inventario.bloquear([producto.pk])
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {_TABLA} (id_usuario_id, id_producto_id, cantidad, expira) "
+                    f"SELECT %s, p.id_producto, %s, %s FROM {Producto._meta.db_table} p "
+                    f"WHERE p.id_producto = %s AND p.activo AND {catalogo.EXISTENCIA} - {catalogo.RESERVADO} "
+                    f"+ COALESCE((SELECT o.cantidad FROM {_TABLA} o "
+                    "WHERE o.id_producto_id = p.id_producto AND o.id_usuario_id = %s "
+                    "AND o.expira > CURRENT_TIMESTAMP), 0) >= %s "
+                    "ON CONFLICT (id_usuario_id, id_producto_id) "
+                    "DO UPDATE SET cantidad = excluded.cantidad, expira = excluded.expira",
+                    [
+                        usuario.pk, cantidad, connection.ops.adapt_datetimefield_value(expira),
+                        producto.pk, usuario.pk, cantidad,
+                    ]
+                )
+                apartados = cursor.rowcount
+            if not apartados:
+                fila = Producto.objects.filter(pk=producto.pk).con_existencia().values_list('existencia', 'reservado').first()
+                disponible = max(fila[0] - fila[1] + actual, 0) if fila else 0
+                raise StockInsuficiente(producto.pk, producto.nombre, disponible)
+        if cantidad != actual:
+            _cambiadas([producto.pk])
+
+
+def liberar(usuario, productos=None):
+    """Libera las reservas del usuario (sólo las de `productos`, si se indican)."""
+    with transaction.atomic(savepoint=False):
+        reservas = Reserva.objects.select_for_update().filter(id_usuario=usuario)
+        if productos is not None:
+            reservas = reservas.filter(id_producto__in=productos)
+        cantidades = dict(reservas.values_list('id_producto', 'cantidad'))
+        if cantidades:
+            Reserva.objects.filter(id_usuario=usuario, id_producto__in=cantidades).delete()
+            _cambiadas(cantidades)
+
+
+def tomar(usuario, productos):
+    """
+    Quita las reservas del usuario para `productos` y regresa
+    {id_producto: cantidad}, para que productos.inventario.descontar() pueda
+    vender esas unidades. Debe llamarse dentro de la transacción del pedido:
+    si la venta falla, las reservas vuelven.
+    """
+    reservas = Reserva.objects.select_for_update().filter(id_usuario=usuario, id_producto__in=productos)
+    cantidades = dict(reservas.values_list('id_producto', 'cantidad'))
+    if cantidades:
+        Reserva.objects.filter(id_usuario=usuario, id_producto__in=cantidades).delete()
+    return cantidades
+
+
+def liberar_vencidas(lote=1000, ahora=None):
+    """
+    Libera las reservas vencidas de `lote` en `lote`, cada lote en su propia
+    transacción. Regresa cuántas reservas liberó.
+    """
+    ahora = ahora or timezone.now()
+    liberadas = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                Reserva.objects.select_for_update(skip_locked=True)
+                .filter(expira__lte=ahora).order_by('expira')
+                .values_list('pk', flat=True)[:lote]
+            )
+            if not ids:
+                break
+            vencidas = Reserva.objects.filter(pk__in=ids)
+            productos = set(vencidas.values_list('id_producto', flat=True))
+            vencidas.delete()
+            _cambiadas(productos)
+        liberadas += len(ids)
+        if len(ids) < lote:
+            break
+    return liberadas
+
+
+def recalcular():
+    """
+    Corrige las copias de lo apartado en catalogo_item que no coincidan con
+    la suma de las reservas vigentes (por ejemplo, después de borrar usuarios, cuyas
+    reservas se borran en cascada). Regresa cuántos productos corrigió.
+    """
+    reales = dict(
+        Reserva.objects.filter(expira__gt=timezone.now()).values('id_producto').annotate(total=Sum('cantidad'))
+        .order_by().values_list('id_producto', 'total')
+    )
+    corregir = [
+        id_producto for id_producto, copia in CatalogoItem.objects.values_list('pk', 'reservado')
+        if reales.get(id_producto, 0) != copia
+    ]
+    for inicio in range(0, len(corregir), 1000):
+        with transaction.atomic():
+            catalogo.actualizar_productos(Producto.objects.filter(pk__in=corregir[inicio:inicio + 1000]))
+    _purgar(corregir)
+    return len(corregir)
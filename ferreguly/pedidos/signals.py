@@ -0,0 +1,15 @@
+from django.contrib import messages
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from . import carritos
+
+
+@receiver(user_logged_in)
+def sesion_iniciada(sender, request, user, **kwargs):
+    # El carrito armado sin sesión pasa al del usuario
+    if request is not None:
+        for error in carritos.fusionar(request, user):
+            messages.warning(
+                request, f'{error} No se sumó a tu carrito la cantidad que agregaste sin sesión.', fail_silently=True
+            )
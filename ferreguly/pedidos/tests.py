@@ -1,3 +1,660 @@
-from django.test import TestCase
+import csv
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+
+from ferreguly.consultas import PRESUPUESTOS, presupuesto_consultas
+from ferreguly.pruebas import (
+    PresupuestoConsultasTestCase, crear_direccion, crear_pedido, crear_productos, crear_usuarios
+)
+from pedidos.models import Carrito, DetallePedido, MasVendido, Pedido, Reserva, VentaDiaria
+from pedidos import carritos, compra, mas_vendidos, reservas
+from productos.models import CatalogoItem, Categoria, Marca, MovimientoInventario, Producto
+from productos import cache_paginas
+from usuarios.models import Direccion, Usuario
+
+
+# La transacción de la prueba no se confirma, así que el catálogo de lectura
+# se copia dentro de ella; un hilo en segundo plano no vería sus datos, así
+# que los carritos sólo se escriben al llamar a carritos.persistir()
+@override_settings(
+    CACHE_CATALOGO_SEGUNDO_PLANO=False, CATALOGO_AL_CONFIRMAR=False, CARRITO_ESCRITURA_SEGUNDO_PLANO=False
+)
+class PedidosTestCase(TestCase):
+    """
+    Un cliente con diez productos en el carrito y un pedido pendiente con esos
+    mismos diez; los otros cinco productos no están en ninguno.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categorias, _, cls.productos = crear_productos()
+        cls.cliente, cls.admin = crear_usuarios()
+        cls.direccion = crear_direccion(cls.cliente)
+        for producto in cls.productos[:10]:
+            Carrito.objects.create(id_usuario=cls.cliente, id_producto=producto, cantidad=1)
+        cls.pedido = crear_pedido(cls.cliente, cls.direccion, cls.productos[:10])
+
+    def setUp(self):
+        # Los carritos viven en una caché compartida por todas las pruebas
+        carritos.limpiar()
+
+
+class PresupuestoConsultasPedidosTests(PresupuestoConsultasTestCase, PedidosTestCase):
+    def test_carrito(self):
+        self.assertPresupuesto('carrito_lista', usuario=self.cliente)
+        self.assertPresupuesto('carrito_eliminar', args=[self.productos[0].pk])
+
+    # Lo apartado se copia al catálogo de lectura después de confirmar, fuera
+    # de la petición
+    @override_settings(CATALOGO_AL_CONFIRMAR=True)
+    def test_carrito_agregar(self):
+        producto = self.productos[-1]
+        self.assertPresupuesto(
+            'carrito_agregar', args=[producto.pk], metodo='post',
+            datos={'cantidad': 1, 'id_producto': producto.pk}, usuario=self.cliente
+        )
+
+    @override_settings(CATALOGO_AL_CONFIRMAR=True)
+    def test_carrito_actualizar(self):
+        self.assertPresupuesto(
+            'carrito_actualizar', args=[self.productos[0].pk], metodo='post',
+            datos={'cantidad': 2}, usuario=self.cliente
+        )
+
+    def test_colocar_pedido(self):
+        self.assertPresupuesto('colocar_pedido', usuario=self.cliente)
+
+    def test_pedidos_cliente(self):
+        self.assertPresupuesto('pedidos_lista', usuario=self.cliente)
+        self.assertPresupuesto('pedido_detalle', args=[self.pedido.pk])
+
+    def test_pedidos_admin(self):
+        self.assertPresupuesto('pedidos_admin_lista', usuario=self.admin)
+        self.assertPresupuesto('pedido_admin_detalle', args=[self.pedido.pk])
+        self.assertPresupuesto('pedido_actualizar_estado', args=[self.pedido.pk])
+
+
+class FiltrosPedidosAdminTests(PedidosTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.anterior = Pedido.objects.create(
+            id_usuario=cls.cliente, id_direccion_envio=cls.direccion, subtotal=50, total=50,
+            estado='entregado', fecha_pedido=timezone.now() - timedelta(days=10),
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def test_lista_aplica_estado_y_fechas(self):
+        url = reverse('pedidos_admin_lista')
+        self.assertEqual(list(self.client.get(url, {'estado': 'entregado'}).context['pedidos']), [self.anterior])
+        hoy = timezone.localdate().isoformat()
+        self.assertEqual(list(self.client.get(url, {'fecha_desde': hoy}).context['pedidos']), [self.pedido])
+        self.assertEqual(list(self.client.get(url, {'fecha_hasta': hoy}).context['pedidos']), [self.pedido, self.anterior])
+        # Valores que no son válidos se ignoran
+        self.assertEqual(len(self.client.get(url, {'estado': 'x', 'fecha_desde': '2024-02-31'}).context['pedidos']), 2)
+
+    def test_exportar_csv(self):
+        with presupuesto_consultas('pedidos_exportar'):
+            response = self.client.get(reverse('pedidos_exportar'), {'estado': 'entregado'})
+            contenido = b''.join(response.streaming_content).decode('utf-8-sig')
+        filas = list(csv.reader(StringIO(contenido)))
+        self.assertEqual(filas[0], ['Pedido', 'Fecha', 'Cliente', 'Correo', 'Estado', 'Subtotal', 'Total'])
+        self.assertEqual(filas[1:], [[
+            str(self.anterior.pk), timezone.localtime(self.anterior.fecha_pedido).strftime('%Y-%m-%d %H:%M'),
+            'Ana López', 'cliente@ferreguly.mx', 'Entregado', '50.00', '50.00',
+        ]])
+
+
+class MasVendidosTests(PresupuestoConsultasTestCase, PedidosTestCase):
+    def setUp(self):
+        super().setUp()
+        cache_paginas.limpiar()
+
+    def ranking(self, periodo):
+        return dict(
+            MasVendido.objects.filter(periodo=periodo, cantidad__gt=0).values_list('id_producto', 'cantidad')
+        )
+
+    def test_colocar_y_cancelar_pedido(self):
+        self.client.force_login(self.cliente)
+        self.client.post(reverse('colocar_pedido'), {'id_direccion_envio': self.direccion.pk})
+        pedido = Pedido.objects.latest('pk')
+        esperado = {producto.pk: 1 for producto in self.productos[:10]}
+        self.assertEqual(self.ranking(7), esperado)
+        self.assertEqual(self.ranking(30), esperado)
+
+        inicio = Client().get(reverse('inicio'))
+        self.assertEqual(len(inicio.context['mas_vendidos']), 6)
+
+        self.client.force_login(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('pedido_actualizar_estado', args=[pedido.pk]), {'estado': 'cancelado'})
+        self.assertEqual(self.ranking(7), {})
+        # La página guardada se purgó
+        inicio = Client().get(reverse('inicio'))
+        self.assertEqual(inicio['X-Cache'], 'MISS')
+        self.assertEqual(list(inicio.context['mas_vendidos']), [])
+
+        self.client.post(reverse('pedido_actualizar_estado', args=[pedido.pk]), {'estado': 'pagado'})
+        self.assertEqual(self.ranking(7), esperado)
+
+    def test_ventanas_y_categorias(self):
+        hoy = timezone.localdate()
+        VentaDiaria.objects.create(fecha=hoy, id_producto=self.productos[0], cantidad=2)
+        VentaDiaria.objects.create(fecha=hoy - timedelta(days=10), id_producto=self.productos[1], cantidad=5)
+        VentaDiaria.objects.create(fecha=hoy - timedelta(days=40), id_producto=self.productos[2], cantidad=9)
+        mas_vendidos.renovar()
+
+        self.assertEqual(self.ranking(7), {self.productos[0].pk: 2})
+        self.assertEqual(self.ranking(30), {self.productos[0].pk: 2, self.productos[1].pk: 5})
+        self.assertFalse(VentaDiaria.objects.filter(id_producto=self.productos[2]).exists())
+
+        response = self.assertPresupuesto('inicio', datos={'periodo': 30})
+        self.assertEqual(
+            [producto.pk for producto in response.context['mas_vendidos']], [self.productos[1].pk, self.productos[0].pk]
+        )
+        response = self.client.get(reverse('inicio'), {'periodo': 30, 'categoria': self.categorias[1].pk})
+        self.assertEqual([producto.pk for producto in response.context['mas_vendidos']], [self.productos[1].pk])
+
+    def test_colocar_pedido_no_renueva_el_ranking(self):
+        # Venta que salió de la ventana de 7 días, pero el comando no ha corrido hoy
+        producto = self.productos[12]
+        VentaDiaria.objects.create(fecha=timezone.localdate() - timedelta(days=10), id_producto=producto, cantidad=3)
+        MasVendido.objects.create(periodo=7, id_producto=producto, id_categoria=producto.id_categoria, cantidad=3)
+
+        self.client.force_login(self.cliente)
+        self.client.post(reverse('colocar_pedido'), {'id_direccion_envio': self.direccion.pk})
+        self.assertEqual(self.ranking(7)[producto.pk], 3)
+        self.assertEqual(self.ranking(7)[self.productos[0].pk], 1)
+
+        call_command('calcular_mas_vendidos', stdout=StringIO())
+        self.assertNotIn(producto.pk, self.ranking(7))
+        self.assertEqual(self.ranking(30)[producto.pk], 3)
+
+    def test_reconstruir(self):
+        call_command('calcular_mas_vendidos', '--reconstruir', stdout=StringIO())
+        self.assertEqual(self.ranking(7), {producto.pk: 1 for producto in self.productos[:10]})
+
+
+class ColocarPedidoTests(PedidosTestCase):
+    def test_descuenta_stock_y_crea_detalles(self):
+        self.client.force_login(self.cliente)
+        # Las consultas no dependen del número de líneas del carrito
+        with presupuesto_consultas(maximo=21):
+            response = self.client.post(reverse('colocar_pedido'), {'id_direccion_envio': self.direccion.pk})
+        pedido = Pedido.objects.latest('pk')
+        self.assertRedirects(response, reverse('pedido_detalle', args=[pedido.pk]))
+        self.assertEqual(pedido.subtotal, sum(producto.precio for producto in self.productos[:10]))
+        self.assertEqual(
+            list(pedido.detalles.order_by('id_producto').values_list('id_producto', 'cantidad', 'subtotal')),
+            [(producto.pk, 1, producto.precio) for producto in self.productos[:10]]
+        )
+        productos = Producto.objects.filter(pk__in=[p.pk for p in self.productos[:10]]).con_existencia()
+        self.assertEqual(set(productos.values_list('stock', 'existencia')), {(100, 99)})
+        self.assertEqual(CatalogoItem.objects.get(pk=self.productos[0].pk).stock, 99)
+        self.assertEqual(
+            set(MovimientoInventario.objects.filter(id_pedido=pedido).values_list('tipo', 'cantidad')),
+            {('venta', -1)}
+        )
+        self.assertEqual(Producto.objects.get(pk=self.productos[10].pk).stock, 100)
+        self.assertFalse(Carrito.objects.filter(id_usuario=self.cliente).exists())
+
+    @override_settings(CATALOGO_AL_CONFIRMAR=True)
+    def test_no_escribe_el_producto_ni_el_catalogo(self):
+        items = list(Carrito.objects.filter(id_usuario=self.cliente).con_productos())
+        with CaptureQueriesContext(connection) as consultas, self.captureOnCommitCallbacks() as avisos:
+            compra.colocar(self.cliente, self.direccion, items)
+        sentencias = [consulta['sql'] for consulta in consultas.captured_queries]
+        self.assertFalse([sql for sql in sentencias if 'FOR UPDATE' in sql or sql.startswith('UPDATE "producto"')])
+        self.assertFalse([sql for sql in sentencias if 'catalogo_item' in sql])
+        # El catálogo de lectura se copia después de confirmar
+        self.assertEqual(CatalogoItem.objects.get(pk=self.productos[0].pk).stock, 100)
+        for aviso in avisos:
+            aviso()
+        self.assertEqual(CatalogoItem.objects.get(pk=self.productos[0].pk).stock, 99)
+
+    def test_sin_stock_no_guarda_nada(self):
+        items = list(Carrito.objects.filter(id_usuario=self.cliente).con_productos())
+        # Otra compra se lleva el stock después de revisar el carrito
+        Producto.objects.filter(pk=self.productos[3].pk).update(stock=0)
+        pedidos = Pedido.objects.count()
+        with self.assertRaises(compra.StockInsuficiente) as error:
+            compra.colocar(self.cliente, self.direccion, items)
+        self.assertEqual((error.exception.id_producto, error.exception.disponible), (self.productos[3].pk, 0))
+        self.assertEqual(Pedido.objects.count(), pedidos)
+        self.assertEqual(Producto.objects.get(pk=self.productos[0].pk).stock, 100)
+        self.assertEqual(Carrito.objects.filter(id_usuario=self.cliente).count(), 10)
+
+    def test_vista_informa_el_producto_agotado(self):
+        self.client.force_login(self.cliente)
+        Producto.objects.filter(pk=self.productos[3].pk).update(activo=False)
+        response = self.client.post(
+            reverse('colocar_pedido'), {'id_direccion_envio': self.direccion.pk}, follow=True
+        )
+        self.assertRedirects(response, reverse('carrito_lista'))
+        self.assertContains(response, 'Tornillo 3')
+        self.assertEqual(Carrito.objects.filter(id_usuario=self.cliente).count(), 10)
+
+
+class ReservasTests(PedidosTestCase):
+    def setUp(self):
+        super().setUp()
+        self.producto = self.productos[14]
+        self.producto.stock = 3
+        self.producto.save()
+
+    def reservado(self):
+        return (
+            Producto.objects.con_existencia().get(pk=self.producto.pk).reservado,
+            CatalogoItem.objects.get(pk=self.producto.pk).reservado,
+        )
+
+    def agregar(self, usuario, cantidad):
+        self.client.force_login(usuario)
+        response = self.client.post(
+            reverse('carrito_agregar', args=[self.producto.pk]),
+            {'cantidad': cantidad, 'id_producto': self.producto.pk}, follow=True
+        )
+        # Las unidades se apartan en la misma petición; sólo las líneas se
+        # escriben después
+        carritos.persistir()
+        return response
+
+    def test_agregar_aparta_el_stock(self):
+        self.agregar(self.cliente, 2)
+        self.assertEqual(self.reservado(), (2, 2))
+        detalle = Client().get(reverse('producto_detalle', args=[self.producto.pk]))
+        self.assertContains(detalle, 'En stock (1 disponibles)')
+
+        # Otro cliente ya no puede apartar esas unidades
+        response = self.agregar(self.admin, 2)
+        self.assertContains(response, 'supera el stock disponible (1)')
+        self.assertFalse(Carrito.objects.filter(id_usuario=self.admin).exists())
+        self.agregar(self.admin, 1)
+        self.assertEqual(self.reservado(), (3, 3))
+
+        # Cambiar la cantidad en el carrito ajusta lo apartado
+        self.client.force_login(self.cliente)
+        self.client.post(reverse('carrito_actualizar', args=[self.producto.pk]), {'cantidad': 1})
+        carritos.persistir()
+        self.assertEqual(self.reservado(), (2, 2))
+        self.client.post(reverse('carrito_actualizar', args=[self.producto.pk]), {'cantidad': 3})
+        carritos.persistir()
+        self.assertEqual(Carrito.objects.get(id_usuario=self.cliente, id_producto=self.producto).cantidad, 1)
+
+        self.client.post(reverse('carrito_eliminar', args=[self.producto.pk]))
+        carritos.persistir()
+        self.assertEqual(self.reservado(), (1, 1))
+        self.assertFalse(Reserva.objects.filter(id_usuario=self.cliente, id_producto=self.producto).exists())
+
+    def test_aparta_antes_de_escribir_el_carrito(self):
+        self.client.force_login(self.cliente)
+        self.client.post(
+            reverse('carrito_agregar', args=[self.producto.pk]), {'cantidad': 2, 'id_producto': self.producto.pk}
+        )
+        self.assertEqual(self.reservado(), (2, 2))
+        self.assertFalse(Carrito.objects.filter(id_usuario=self.cliente, id_producto=self.producto).exists())
+        self.client.post(reverse('carrito_eliminar', args=[self.producto.pk]))
+        self.assertEqual(self.reservado(), (0, 0))
+
+    def test_al_iniciar_sesion_no_suma_lo_que_no_alcanza(self):
+        anonimo = Client()
+        for producto, cantidad in ((self.producto, 3), (self.productos[12], 1)):
+            anonimo.post(reverse('carrito_agregar', args=[producto.pk]), {'cantidad': cantidad, 'id_producto': producto.pk})
+        # Mientras tanto otro cliente aparta una de las tres unidades
+        self.agregar(self.admin, 1)
+
+        response = anonimo.post(
+            reverse('login'), {'username': 'cliente@ferreguly.mx', 'password': 'secreta123'}, follow=True
+        )
+        self.assertContains(response, 'sólo tiene 2 disponibles')
+        lineas = dict(Carrito.objects.filter(id_usuario=self.cliente).values_list('id_producto', 'cantidad'))
+        self.assertNotIn(self.producto.pk, lineas)
+        self.assertEqual(lineas[self.productos[12].pk], 1)
+        self.assertEqual(
+            dict(Reserva.objects.filter(id_usuario=self.cliente).values_list('id_producto', 'cantidad')),
+            {self.productos[12].pk: 1}
+        )
+
+    def test_guardar_una_copia_vieja_no_libera_lo_apartado(self):
+        producto = Producto.objects.get(pk=self.producto.pk)
+        reservas.reservar(self.cliente, producto, 2)
+        producto.nombre = 'Martillo'
+        producto.save()
+        self.assertEqual(self.reservado(), (2, 2))
+
+    def test_colocar_pedido_usa_lo_apartado(self):
+        Carrito.objects.filter(id_usuario=self.cliente).delete()
+        self.agregar(self.cliente, 2)
+        self.agregar(self.admin, 1)
+        self.client.force_login(self.cliente)
+        self.client.post(reverse('colocar_pedido'), {'id_direccion_envio': self.direccion.pk})
+        producto = Producto.objects.con_existencia().get(pk=self.producto.pk)
+        self.assertEqual((producto.existencia, producto.reservado), (1, 1))
+        self.assertEqual(list(Reserva.objects.values_list('id_usuario', flat=True)), [self.admin.pk])
+
+    def test_una_reserva_vencida_no_impide_vender(self):
+        Carrito.objects.filter(id_usuario=self.cliente).delete()
+        self.agregar(self.admin, 3)
+        Reserva.objects.filter(id_usuario=self.admin).update(expira=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(Producto.objects.con_existencia().get(pk=self.producto.pk).reservado, 0)
+
+        self.agregar(self.cliente, 3)
+        self.client.post(reverse('colocar_pedido'), {'id_direccion_envio': self.direccion.pk})
+        self.assertEqual(Producto.objects.con_existencia().get(pk=self.producto.pk).existencia, 0)
+        self.assertTrue(DetallePedido.objects.filter(id_producto=self.producto, cantidad=3).exists())
+        # Renovar la reserva vencida es apartar de nuevo
+        with self.assertRaises(compra.StockInsuficiente):
+            reservas.reservar(self.admin, self.producto, 1)
+
+    def test_liberar_vencidas(self):
+        self.agregar(self.cliente, 2)
+        self.agregar(self.admin, 1)
+        Reserva.objects.filter(id_usuario=self.cliente).update(expira=timezone.now() - timedelta(minutes=1))
+        salida = StringIO()
+        call_command('liberar_reservas', '--lote', '1', stdout=salida)
+        self.assertIn('1 reservas vencidas liberadas', salida.getvalue())
+        self.assertEqual(self.reservado(), (1, 1))
+
+        CatalogoItem.objects.filter(pk=self.producto.pk).update(reservado=5)
+        call_command('liberar_reservas', '--recalcular', stdout=salida)
+        self.assertEqual(self.reservado(), (1, 1))
+
+
+class CarritoCacheTests(PedidosTestCase):
+    def agregar(self, producto, cantidad):
+        return self.client.post(
+            reverse('carrito_agregar', args=[producto.pk]), {'cantidad': cantidad, 'id_producto': producto.pk}
+        )
+
+    def escrituras(self, consultas):
+        return [
+            consulta['sql'] for consulta in consultas.captured_queries
+            if consulta['sql'].split(None, 1)[0] in ('INSERT', 'UPDATE', 'DELETE')
+        ]
+
+    def test_los_cambios_se_escriben_despues(self):
+        self.client.force_login(self.cliente)
+        self.client.get(reverse('carrito_lista'))
+        with CaptureQueriesContext(connection) as consultas:
+            self.agregar(self.productos[12], 2)
+            self.client.post(reverse('carrito_actualizar', args=[self.productos[0].pk]), {'cantidad': 3})
+            self.client.post(reverse('carrito_eliminar', args=[self.productos[1].pk]))
+        # Sólo lo apartado se escribe en el momento
+        self.assertFalse([sql for sql in self.escrituras(consultas) if 'carrito' in sql.split('(', 1)[0]])
+        self.assertEqual(Carrito.objects.filter(id_usuario=self.cliente).count(), 10)
+        self.assertEqual(
+            dict(Reserva.objects.filter(id_usuario=self.cliente).values_list('id_producto', 'cantidad')),
+            {self.productos[12].pk: 2, self.productos[0].pk: 3}
+        )
+
+        response = self.client.get(reverse('carrito_lista'))
+        self.assertEqual(
+            [(item.id_producto_id, item.cantidad) for item in response.context['items']][:2],
+            [(self.productos[0].pk, 3), (self.productos[2].pk, 1)]
+        )
+
+        self.assertEqual(carritos.persistir(), 1)
+        lineas = dict(Carrito.objects.filter(id_usuario=self.cliente).values_list('id_producto', 'cantidad'))
+        self.assertEqual(len(lineas), 10)
+        self.assertEqual((lineas[self.productos[0].pk], lineas[self.productos[12].pk]), (3, 2))
+        self.assertNotIn(self.productos[1].pk, lineas)
+        self.assertEqual(Reserva.objects.get(id_usuario=self.cliente, id_producto=self.productos[12]).cantidad, 2)
+
+    def test_los_pendientes_se_comparten_y_respetan_el_bloqueo(self):
+        self.client.force_login(self.cliente)
+        self.agregar(self.productos[12], 2)
+        # La lista de pendientes está en la caché compartida, no en el proceso
+        self.assertEqual(caches[carritos.ALIAS].get(carritos.PENDIENTES), {self.cliente.pk})
+
+        # Mientras otro proceso tiene el carrito bloqueado no se escribe
+        tomado, soltar = threading.Event(), threading.Event()
+
+        def bloquear():
+            with carritos.bloqueado(self.cliente):
+                tomado.set()
+                soltar.wait()
+
+        hilo = threading.Thread(target=bloquear)
+        hilo.start()
+        tomado.wait()
+        try:
+            self.assertEqual(carritos.persistir(), 0)
+        finally:
+            soltar.set()
+            hilo.join()
+        self.assertEqual(caches[carritos.ALIAS].get(carritos.PENDIENTES), {self.cliente.pk})
+        self.assertEqual(carritos.persistir(), 1)
+        self.assertEqual(caches[carritos.ALIAS].get(carritos.PENDIENTES), set())
+
+    def test_carrito_anonimo_se_suma_al_iniciar_sesion(self):
+        with CaptureQueriesContext(connection) as consultas:
+            self.agregar(self.productos[0], 2)
+            self.agregar(self.productos[12], 1)
+        self.assertEqual(self.escrituras(consultas), [])
+        self.assertIn(carritos.COOKIE, self.client.cookies)
+        response = self.client.get(reverse('carrito_lista'))
+        self.assertEqual(len(response.context['items']), 2)
+
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.post(reverse('login'), {'username': 'cliente@ferreguly.mx', 'password': 'secreta123'})
+        self.assertEqual(len([sql for sql in self.escrituras(consultas) if 'INTO "carrito"' in sql or 'INTO carrito' in sql]), 1)
+        lineas = dict(Carrito.objects.filter(id_usuario=self.cliente).values_list('id_producto', 'cantidad'))
+        self.assertEqual((len(lineas), lineas[self.productos[0].pk], lineas[self.productos[12].pk]), (11, 3, 1))
+        self.assertEqual(len(self.client.get(reverse('carrito_lista')).context['items']), 11)
+
+        # El carrito anónimo ya se sumó
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('carrito_lista')).context['items'], [])
+
+    def test_colocar_pedido_escribe_el_carrito(self):
+        self.client.force_login(self.cliente)
+        self.agregar(self.productos[12], 2)
+        self.client.post(reverse('colocar_pedido'), {'id_direccion_envio': self.direccion.pk})
+        pedido = Pedido.objects.latest('pk')
+        self.assertEqual(pedido.detalles.count(), 11)
+        self.assertFalse(Carrito.objects.filter(id_usuario=self.cliente).exists())
+        # Una escritura posterior (el temporizador de otro proceso) no regresa
+        # las líneas compradas
+        self.assertEqual(carritos.persistir(), 0)
+        self.assertFalse(Carrito.objects.filter(id_usuario=self.cliente).exists())
+        self.assertEqual(self.client.get(reverse('carrito_lista')).context['items'], [])
+
+
+class CacheCarritosTests(TestCase):
+    def test_solo_descarta_los_vencidos(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        cache = carritos.CacheCarritos(directorio, {'OPTIONS': {'MAX_ENTRIES': 3}})
+        cache.set('vencido', {1: 1}, 0)
+        for i in range(5):
+            cache.set(f'carrito:{i}', {i: 1})
+        self.assertEqual(len(cache._list_cache_files()), 5)
+        self.assertEqual([cache.get(f'carrito:{i}') for i in range(5)], [{i: 1} for i in range(5)])
+
+
+class CancelarPedidoTests(PedidosTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+        self.url = reverse('pedido_actualizar_estado', args=[self.pedido.pk])
+
+    def existencias(self):
+        return set(
+            Producto.objects.filter(pk__in=[producto.pk for producto in self.productos[:10]])
+            .con_existencia().values_list('existencia', flat=True)
+        )
+
+    def test_cancelar_regresa_las_unidades_y_reactivar_las_vende(self):
+        self.client.post(self.url, {'estado': 'cancelado'})
+        self.assertEqual(self.existencias(), {101})
+        cancelaciones = MovimientoInventario.objects.filter(id_pedido=self.pedido, tipo='cancelacion')
+        self.assertEqual(cancelaciones.count(), 10)
+        self.assertEqual(set(cancelaciones.values_list('cantidad', 'id_usuario')), {(1, self.admin.pk)})
+
+        self.client.post(self.url, {'estado': 'pendiente'})
+        self.assertEqual(self.existencias(), {100})
+        self.assertEqual(MovimientoInventario.objects.filter(id_pedido=self.pedido, tipo='venta').count(), 10)
+
+    def test_cancelar_con_una_copia_vieja_no_regresa_dos_veces(self):
+        # Dos cancelaciones a la vez: las dos leyeron el pedido pendiente
+        copia = Pedido.objects.get(pk=self.pedido.pk)
+        compra.cambiar_estado(Pedido.objects.get(pk=self.pedido.pk), 'cancelado', self.admin)
+        compra.cambiar_estado(copia, 'cancelado', self.admin)
+        self.assertEqual(self.existencias(), {101})
+        self.assertEqual(MovimientoInventario.objects.filter(tipo='cancelacion').count(), 10)
+
+    def test_reactivar_sin_stock_no_cambia_nada(self):
+        self.client.post(self.url, {'estado': 'cancelado'})
+        Producto.objects.filter(pk=self.productos[0].pk).update(stock=-1)
+        response = self.client.post(self.url, {'estado': 'pendiente'}, follow=True)
+        self.assertContains(response, 'No se pudo reactivar el pedido')
+        self.pedido.refresh_from_db()
+        self.assertEqual(self.pedido.estado, 'cancelado')
+        self.assertFalse(MovimientoInventario.objects.filter(tipo='venta').exists())
+
+
+class ColocarPedidoConcurrenteTests(TransactionTestCase):
+    """
+    Varios clientes compran a la vez el mismo producto con poco stock: se
+    venden exactamente las unidades que había.
+    """
+    CLIENTES = 6
+    STOCK = 3
+
+    def setUp(self):
+        categoria = Categoria.objects.create(nombre='Herramientas')
+        marca = Marca.objects.create(nombre='Truper')
+        self.producto = Producto.objects.create(
+            nombre='Martillo', descripcion='Martillo', id_categoria=categoria, id_marca=marca,
+            precio=Decimal('150'), stock=self.STOCK,
+        )
+        self.clientes = []
+        for i in range(self.CLIENTES):
+            # Sin contraseña: calcular el hash de cada una es lo más lento
+            usuario = Usuario.objects.create_user(f'cliente{i}@ferreguly.mx', 'Ana', 'López')
+            direccion = Direccion.objects.create(
+                id_usuario=usuario, nombre='Ana', apellidos='López', telefono='9611234567',
+                email=usuario.email, calle='Central', numero_ext='1', colonia='Centro',
+                ciudad='Tuxtla Gutiérrez', estado='Chiapas', codigo_postal='29000'
+            )
+            Carrito.objects.create(id_usuario=usuario, id_producto=self.producto, cantidad=1)
+            self.clientes.append((usuario, direccion))
+
+    def comprar(self, usuario, direccion, resultados):
+        try:
+            for intento in range(1000):
+                try:
+                    # El carrito se revisa fuera de la transacción, como en la vista
+                    items = list(Carrito.objects.filter(id_usuario=usuario).con_productos())
+                    compra.colocar(usuario, direccion, items)
+                    resultados.append('vendido')
+                    return
+                except compra.StockInsuficiente:
+                    resultados.append('agotado')
+                    return
+                except OperationalError:
+                    # La base de datos en memoria de las pruebas no espera a
+                    # que se libere un bloqueo: se reintenta tras una espera al
+                    # azar, para que los hilos no choquen otra vez
+                    time.sleep(random.uniform(0.001, 0.01))
+            resultados.append('bloqueado')
+        finally:
+            connection.close()
+
+    def comprar_todos(self):
+        resultados = []
+        hilos = [
+            threading.Thread(target=self.comprar, args=(usuario, direccion, resultados))
+            for usuario, direccion in self.clientes
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        return resultados
+
+    def test_no_vende_de_mas(self):
+        resultados = self.comprar_todos()
+
+        self.assertEqual(resultados.count('vendido'), self.STOCK)
+        self.assertEqual(resultados.count('agotado'), self.CLIENTES - self.STOCK)
+        self.assertEqual(Producto.objects.con_existencia().get(pk=self.producto.pk).existencia, 0)
+        self.assertEqual(MovimientoInventario.objects.filter(tipo='venta').count(), self.STOCK)
+        self.assertEqual(Pedido.objects.count(), self.STOCK)
+        self.assertEqual(DetallePedido.objects.filter(id_producto=self.producto).count(), self.STOCK)
+
+
+@unittest.skipUnless(os.environ.get('FERREGULY_BENCHMARK'), 'Defina FERREGULY_BENCHMARK=1 para medir')
+class ColocarPedidoConcurrenteBenchmark(ColocarPedidoConcurrenteTests):
+    """
+    La misma compra simultánea con más clientes; informa cuántos pedidos por
+    segundo se colocaron. Sólo corre con FERREGULY_BENCHMARK=1.
+    """
+    CLIENTES = 30
+    STOCK = 12
+
+    def test_no_vende_de_mas(self):
+        inicio = time.monotonic()
+        super().test_no_vende_de_mas()
+        segundos = time.monotonic() - inicio
+        sys.stderr.write(
+            f'\n{self.CLIENTES} compras simultáneas en {segundos:.2f} s ({self.CLIENTES / segundos:.0f} pedidos/s)\n'
+        )
+
+
+class TablaPresupuestosTests(TestCase):
+    def test_todas_las_rutas_tienen_presupuesto(self):
+        nombres = set()
+        for patron in get_resolver().url_patterns:
+            modulo = getattr(patron, 'urlconf_name', None)
+            if getattr(modulo, '__name__', None) in ('usuarios.urls', 'productos.urls', 'pedidos.urls'):
+                nombres.update(p.name for p in patron.url_patterns)
+        self.assertTrue(nombres)
+        self.assertEqual(nombres - PRESUPUESTOS.keys(), set())
+
+
+class ConProductosTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        _, _, productos = crear_productos(10)
+        cls.cliente, _ = crear_usuarios()
+        for producto in productos:
+            Carrito.objects.create(id_usuario=cls.cliente, id_producto=producto, cantidad=1)
+        cls.pedido = crear_pedido(cls.cliente, crear_direccion(cls.cliente), productos)
+
+    def assertUnaConsulta(self, queryset):
+        with self.assertNumQueries(1):
+            filas = list(queryset.order_by('pk'))
+            self.assertEqual(
+                [(fila.id_producto.id_categoria.nombre, fila.id_producto.id_marca.nombre) for fila in filas[:2]],
+                [('Categoría 0', 'Marca 0'), ('Categoría 1', 'Marca 1')]
+            )
+        self.assertEqual(len(filas), 10)
+        self.assertIn('descripcion', filas[0].id_producto.get_deferred_fields())
+
+    def test_carrito(self):
+        self.assertUnaConsulta(Carrito.objects.filter(id_usuario=self.cliente).con_productos())
+
+    def test_detalles_del_pedido(self):
+        self.assertUnaConsulta(DetallePedido.objects.filter(id_pedido=self.pedido).con_productos())
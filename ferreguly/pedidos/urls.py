@@ -5,8 +5,8 @@ urlpatterns = [
     # URLs para carrito
     path('carrito/', views.carrito_lista, name='carrito_lista'),
     path('carrito/agregar/<int:producto_id>/', views.carrito_add, name='carrito_agregar'),
-    path('carrito/actualizar/<int:item_id>/', views.carrito_update, name='carrito_actualizar'),
-    path('carrito/eliminar/<int:item_id>/', views.carrito_remove, name='carrito_eliminar'),
+    path('carrito/actualizar/<int:producto_id>/', views.carrito_update, name='carrito_actualizar'),
+    path('carrito/eliminar/<int:producto_id>/', views.carrito_remove, name='carrito_eliminar'),
     
     # URL para colocar pedido
     path('colocar-pedido/', views.colocar_pedido, name='colocar_pedido'),
@@ -17,6 +17,7 @@ urlpatterns = [
     
     # URLs para pedidos (admin)
     path('admin/pedidos/', views.PedidoAdminListView.as_view(), name='pedidos_admin_lista'),
+    path('admin/pedidos/exportar/', views.exportar_pedidos, name='pedidos_exportar'),
     path('admin/pedidos/<int:pk>/', views.PedidoAdminDetailView.as_view(), name='pedido_admin_detalle'),
     path('admin/pedidos/<int:pk>/actualizar-estado/', views.actualizar_estado_pedido, name='pedido_actualizar_estado'),
 ]
\ No newline at end of file
@@ -1,22 +1,68 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import Http404
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
 from django.views.generic import ListView, DetailView
 from django.urls import reverse_lazy
 from django.contrib import messages
 from django.db import transaction
-from django.db.models import Sum, F
+from django.db.models import Sum, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import datetime, time, timedelta
 from decimal import Decimal
 
-from .models import Pedido, DetallePedido, Carrito
+from ferreguly import exportar
+
+from .models import Pedido, DetallePedido, Carrito, Reserva
 from usuarios.models import Direccion
-from productos.models import Producto
+from productos.models import Producto, pendiente_inventario
+from productos.inventario import StockInsuficiente
 from .forms import PedidoForm, CarritoAddForm, CarritoUpdateForm
+from . import carritos, compra
+
+# Vistas para el Carrito. El carrito se lee y se guarda en la caché (ver
+# pedidos/carritos.py); de la base de datos sólo escriben lo apartado en
+# reserva_stock, antes de guardar el cambio.
+def _productos_carrito(request, ids):
+    """
+    Productos del carrito con su existencia y, para un usuario, lo que tiene
+    apartado (que también puede llevarse).
+    """
+    productos = Producto.objects.filter(pk__in=ids).con_existencia()
+    if request.user.is_authenticated:
+        reserva = Reserva.objects.filter(id_usuario=request.user, id_producto=OuterRef('pk'))
+        productos = productos.annotate(
+            reserva_expira=Subquery(reserva.values('expira')),
+            apartado=Coalesce(Subquery(reserva.values('cantidad')), 0),
+        )
+    return productos
+
+
+def _maximo(producto):
+    # Lo que puede tener este carrito incluye lo que ya tiene apartado
+    return max(producto.existencia - producto.reservado + getattr(producto, 'apartado', 0), 0)
+
+
+def _item(producto, cantidad):
+    item = Carrito(id_producto=producto, cantidad=cantidad)
+    item.reserva_expira = getattr(producto, 'reserva_expira', None)
+    item.maximo = _maximo(producto)
+    return item
+
 
-# Vistas para el Carrito
-@login_required
 def carrito_lista(request):
-    items = Carrito.objects.filter(id_usuario=request.user).select_related('id_producto')
+    lineas = carritos.lineas(request)
+    productos = (
+        _productos_carrito(request, lineas)
+        .select_related('id_categoria', 'id_marca').defer('descripcion')
+        .in_bulk()
+    )
+    items = [
+        _item(productos[id_producto], cantidad)
+        for id_producto, cantidad in lineas.items() if id_producto in productos
+    ]
     total = sum(item.subtotal for item in items)
     
     return render(request, 'pedidos/carrito.html', {
@@ -24,12 +70,11 @@ def carrito_lista(request):
         'total': total
     })
 
-@login_required
 def carrito_add(request, producto_id):
-    producto = get_object_or_404(Producto, id_producto=producto_id, activo=True)
+    producto = get_object_or_404(_productos_carrito(request, [producto_id]), activo=True)
     
-    # Verificar stock
-    if producto.stock <= 0:
+    # Verificar stock (sin contar lo apartado en otros carritos)
+    if _maximo(producto) <= 0:
         messages.error(request, f'Lo sentimos, {producto.nombre} no tiene stock disponible.')
         return redirect('catalogo')
     
@@ -38,28 +83,27 @@ def carrito_add(request, producto_id):
         if form.is_valid():
             cantidad = form.cleaned_data['cantidad']
             
-            # Verificar que la cantidad no supere el stock
-            if cantidad > producto.stock:
-                messages.error(request, f'La cantidad solicitada supera el stock disponible ({producto.stock}).')
-                return redirect('producto_detalle', pk=producto_id)
+            lineas = carritos.lineas(request)
+            en_carrito = lineas.get(producto.pk, 0)
+            nueva_cantidad = cantidad + en_carrito
             
-            # Actualizar o crear el item en el carrito
-            carrito_item, created = Carrito.objects.get_or_create(
-                id_usuario=request.user,
-                id_producto=producto,
-                defaults={'cantidad': cantidad}
-            )
-            
-            if not created:
-                # Si ya existe, actualizar la cantidad
-                nueva_cantidad = carrito_item.cantidad + cantidad
-                if nueva_cantidad > producto.stock:
-                    messages.error(request, f'La cantidad total en el carrito supera el stock disponible ({producto.stock}).')
-                    return redirect('producto_detalle', pk=producto_id)
-                
-                carrito_item.cantidad = nueva_cantidad
-                carrito_item.save()
+            # Las unidades se apartan antes de guardar el carrito; si otro
+            # carrito se las llevó, el cambio se rechaza
+            disponible = _maximo(producto)
+            if nueva_cantidad <= disponible:
+                try:
+                    carritos.apartar(request, producto, nueva_cantidad)
+                except StockInsuficiente as e:
+                    disponible = e.disponible
+            if nueva_cantidad > disponible:
+                if en_carrito:
+                    messages.error(request, f'La cantidad total en el carrito supera el stock disponible ({disponible}).')
+                else:
+                    messages.error(request, f'La cantidad solicitada supera el stock disponible ({disponible}).')
+                return redirect('producto_detalle', pk=producto_id)
             
+            lineas[producto.pk] = nueva_cantidad
+            carritos.guardar(request, lineas)
             messages.success(request, f'{producto.nombre} agregado al carrito.')
             return redirect('carrito_lista')
     else:
@@ -70,59 +114,79 @@ def carrito_add(request, producto_id):
         'producto': producto
     })
 
-@login_required
-def carrito_update(request, item_id):
-    item = get_object_or_404(Carrito, id_carrito=item_id, id_usuario=request.user)
-    producto = item.id_producto
+def carrito_update(request, producto_id):
+    lineas = carritos.lineas(request)
+    if producto_id not in lineas:
+        raise Http404('El producto no está en el carrito')
+    producto = get_object_or_404(_productos_carrito(request, [producto_id]))
+    item = _item(producto, lineas[producto_id])
     
     if request.method == 'POST':
-        form = CarritoUpdateForm(request.POST, instance=item)
+        form = CarritoUpdateForm(request.POST)
         if form.is_valid():
             cantidad = form.cleaned_data['cantidad']
             
-            # Verificar stock
-            if cantidad > producto.stock:
-                messages.error(request, f'La cantidad solicitada supera el stock disponible ({producto.stock}).')
+            disponible = item.maximo
+            if cantidad <= disponible:
+                try:
+                    carritos.apartar(request, producto, cantidad)
+                except StockInsuficiente as e:
+                    disponible = e.disponible
+            if cantidad > disponible:
+                messages.error(request, f'La cantidad solicitada supera el stock disponible ({disponible}).')
             else:
-                form.save()
+                lineas[producto_id] = cantidad
+                carritos.guardar(request, lineas)
                 messages.success(request, 'Carrito actualizado correctamente.')
             
             return redirect('carrito_lista')
     else:
-        form = CarritoUpdateForm(instance=item)
+        form = CarritoUpdateForm(initial={'cantidad': item.cantidad})
     
     return render(request, 'pedidos/actualizar_carrito.html', {
         'form': form,
         'item': item
     })
 
-@login_required
-def carrito_remove(request, item_id):
-    item = get_object_or_404(Carrito, id_carrito=item_id, id_usuario=request.user)
+def carrito_remove(request, producto_id):
+    lineas = carritos.lineas(request)
+    if producto_id not in lineas:
+        raise Http404('El producto no está en el carrito')
     
     if request.method == 'POST':
-        item.delete()
+        carritos.liberar(request, producto_id)
+        del lineas[producto_id]
+        carritos.guardar(request, lineas)
         messages.success(request, 'Producto eliminado del carrito.')
         return redirect('carrito_lista')
     
-    return render(request, 'pedidos/eliminar_carrito.html', {'item': item})
+    producto = get_object_or_404(
+        Producto.objects.select_related('id_categoria', 'id_marca').defer('descripcion'), pk=producto_id
+    )
+    return render(request, 'pedidos/eliminar_carrito.html', {'item': Carrito(id_producto=producto, cantidad=lineas[producto_id])})
 
 # Vista para colocar pedido
 @login_required
 def colocar_pedido(request):
+    # El carrito pendiente de escribir se escribe ahora
+    carritos.persistir([request.user.pk])
+    
     # Verificar que el carrito no esté vacío
-    carrito_items = Carrito.objects.filter(id_usuario=request.user).select_related('id_producto')
+    carrito_items = (
+        Carrito.objects.filter(id_usuario=request.user).con_productos()
+        .annotate(existencia=F('id_producto__stock') + pendiente_inventario('id_producto'))
+    )
     
-    if not carrito_items.exists():
+    if not carrito_items:
         messages.error(request, 'Tu carrito está vacío.')
         return redirect('carrito_lista')
     
     # Verificar que todos los productos tengan stock suficiente
     for item in carrito_items:
-        if item.cantidad > item.id_producto.stock:
+        if item.cantidad > item.existencia:
             messages.error(
                 request, 
-                f'La cantidad de "{item.id_producto.nombre}" supera el stock disponible ({item.id_producto.stock}).'
+                f'La cantidad de "{item.id_producto.nombre}" supera el stock disponible ({item.existencia}).'
             )
             return redirect('carrito_lista')
     
@@ -139,41 +203,17 @@ def colocar_pedido(request):
         form = PedidoForm(request.user, request.POST)
         if form.is_valid():
             try:
-                with transaction.atomic():
-                    # Calcular totales
-                    subtotal = sum(item.subtotal for item in carrito_items)
-                    total = subtotal  # Aquí se podría agregar lógica para impuestos, envío, etc.
-                    
-                    # Crear pedido
-                    pedido = Pedido(
-                        id_usuario=request.user,
-                        id_direccion_envio=form.cleaned_data['id_direccion_envio'],
-                        subtotal=subtotal,
-                        total=total,
-                        estado='pendiente'
-                    )
-                    pedido.save()
-                    
-                    # Crear detalles del pedido
-                    for item in carrito_items:
-                        DetallePedido.objects.create(
-                            id_pedido=pedido,
-                            id_producto=item.id_producto,
-                            cantidad=item.cantidad,
-                            precio_unitario=item.id_producto.precio,
-                            subtotal=item.subtotal
-                        )
-                        
-                        # Actualizar stock del producto
-                        producto = item.id_producto
-                        producto.stock -= item.cantidad
-                        producto.save()
-                    
-                    # Vaciar el carrito
-                    carrito_items.delete()
-                    
-                    messages.success(request, f'¡Pedido #{pedido.id_pedido} creado correctamente!')
-                    return redirect('pedido_detalle', pk=pedido.id_pedido)
+                # Con el carrito bloqueado, otro proceso no puede escribir una
+                # copia con las líneas ya compradas antes de olvidarlo
+                with carritos.bloqueado(request.user):
+                    pedido = compra.colocar(request.user, form.cleaned_data['id_direccion_envio'], carrito_items)
+                    carritos.olvidar(request.user)
+                messages.success(request, f'¡Pedido #{pedido.id_pedido} creado correctamente!')
+                return redirect('pedido_detalle', pk=pedido.id_pedido)
+            except StockInsuficiente as e:
+                # Otra compra se llevó el stock después de revisar el carrito
+                messages.error(request, f'No se pudo colocar el pedido: {e}')
+                return redirect('carrito_lista')
             except Exception as e:
                 messages.error(request, f'Error al procesar el pedido: {str(e)}')
     else:
@@ -205,14 +245,40 @@ class PedidoDetailView(LoginRequiredMixin, DetailView):
     context_object_name = 'pedido'
     
     def get_queryset(self):
-        return Pedido.objects.filter(id_usuario=self.request.user)
+        return Pedido.objects.filter(id_usuario=self.request.user).select_related('id_direccion_envio')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['detalles'] = self.object.detalles.all()
+        context['detalles'] = self.object.detalles.con_productos()
         return context
 
 # Vistas CRUD para Pedidos (Admin)
+def _inicio_del_dia(texto):
+    try:
+        fecha = parse_date(texto) if texto else None
+    except ValueError:
+        fecha = None
+    return timezone.make_aware(datetime.combine(fecha, time.min)) if fecha else None
+
+def filtrar_pedidos(queryset, parametros):
+    """
+    Filtros de la lista de pedidos del admin (también los usa la exportación).
+    Las fechas se comparan como rangos sobre fecha_pedido para que se use su
+    índice; las que no son válidas se ignoran.
+    """
+    estado = parametros.get('estado')
+    if estado in dict(Pedido.ESTADOS_CHOICES):
+        queryset = queryset.filter(estado=estado)
+    
+    desde = _inicio_del_dia(parametros.get('fecha_desde'))
+    hasta = _inicio_del_dia(parametros.get('fecha_hasta'))
+    if desde:
+        queryset = queryset.filter(fecha_pedido__gte=desde)
+    if hasta:
+        # Incluye todo el día indicado
+        queryset = queryset.filter(fecha_pedido__lt=hasta + timedelta(days=1))
+    return queryset
+
 class PedidoAdminListView(LoginRequiredMixin, ListView):
     model = Pedido
     template_name = 'pedidos/admin/lista.html'
@@ -225,7 +291,9 @@ class PedidoAdminListView(LoginRequiredMixin, ListView):
         return super().dispatch(request, *args, **kwargs)
     
     def get_queryset(self):
-        return Pedido.objects.all().order_by('-fecha_pedido')
+        return filtrar_pedidos(
+            Pedido.objects.select_related('id_usuario').order_by('-fecha_pedido'), self.request.GET
+        )
 
 class PedidoAdminDetailView(LoginRequiredMixin, DetailView):
     model = Pedido
@@ -238,9 +306,12 @@ class PedidoAdminDetailView(LoginRequiredMixin, DetailView):
             return redirect('inicio')
         return super().dispatch(request, *args, **kwargs)
     
+    def get_queryset(self):
+        return Pedido.objects.select_related('id_usuario', 'id_direccion_envio')
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['detalles'] = self.object.detalles.all()
+        context['detalles'] = self.object.detalles.con_productos()
         return context
 
 @login_required
@@ -254,12 +325,36 @@ def actualizar_estado_pedido(request, pk):
     if request.method == 'POST':
         nuevo_estado = request.POST.get('estado')
         if nuevo_estado in dict(Pedido.ESTADOS_CHOICES).keys():
-            pedido.estado = nuevo_estado
-            pedido.save()
-            messages.success(request, f'Estado del pedido actualizado a: {nuevo_estado}')
+            # Un pedido cancelado regresa sus unidades al inventario y deja de
+            # contar en los más vendidos (y al reactivarse se vuelven a vender)
+            try:
+                compra.cambiar_estado(pedido, nuevo_estado, request.user)
+                messages.success(request, f'Estado del pedido actualizado a: {nuevo_estado}')
+            except StockInsuficiente as e:
+                messages.error(request, f'No se pudo reactivar el pedido: {e}')
         else:
             messages.error(request, 'Estado no válido')
         
         return redirect('pedido_admin_detalle', pk=pk)
     
-    return render(request, 'pedidos/admin/actualizar_estado.html', {'pedido': pedido})
\ No newline at end of file
+    return render(request, 'pedidos/admin/actualizar_estado.html', {'pedido': pedido})
+
+@login_required
+def exportar_pedidos(request):
+    """Pedidos de la lista del admin (con sus filtros) en CSV o XLSX."""
+    if not request.user.tipo_usuario == 'administrador':
+        messages.error(request, 'No tienes permisos para acceder a esta función')
+        return redirect('inicio')
+    estados = dict(Pedido.ESTADOS_CHOICES)
+    queryset = filtrar_pedidos(Pedido.objects.order_by('-fecha_pedido'), request.GET)
+    # Datos del cliente con JOIN; el iterador lee por bloques
+    filas = (
+        (id_pedido, fecha, f'{nombre} {apellidos}'.strip(), email, estados.get(estado, estado), subtotal, total)
+        for id_pedido, fecha, nombre, apellidos, email, estado, subtotal, total in queryset.values_list(
+            'id_pedido', 'fecha_pedido', 'id_usuario__nombre', 'id_usuario__apellidos',
+            'id_usuario__email', 'estado', 'subtotal', 'total',
+        ).iterator(chunk_size=2000)
+    )
+    return exportar.respuesta(exportar.formato(request), 'pedidos', (
+        'Pedido', 'Fecha', 'Cliente', 'Correo', 'Estado', 'Subtotal', 'Total',
+    ), filas)
@@ -1,6 +1,9 @@
 from django.contrib import admin
-from .models import Categoria, Marca, Producto
+from .models import AjusteMasivo, Categoria, Marca, MovimientoInventario, Producto, ProductoRelacionado
 
 admin.site.register(Categoria)
 admin.site.register(Marca)
-admin.site.register(Producto)
\ No newline at end of file
+admin.site.register(Producto)
+admin.site.register(AjusteMasivo)
+admin.site.register(ProductoRelacionado)
+admin.site.register(MovimientoInventario)
@@ -0,0 +1,128 @@
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, F, Max, Min, Q, Value
+from django.db.models.functions import Greatest, Round
+from django.utils import timezone
+
+from .models import AjusteMasivo, MovimientoInventario, Producto
+from . import busqueda, cache_paginas, catalogo, facetas, resultados
+
+# Ajustes masivos de precio y stock: se aplican a todos los productos de un
+# filtro sin cargar ni guardar cada producto, el precio con un solo UPDATE
+# (precio = precio * factor) y el stock con un solo INSERT ... SELECT de
+# movimientos de inventario (existencia + delta, ver inventario.py). Un
+# ajuste sólo de stock no reescribe los productos y del catálogo de lectura
+# sólo actualiza la existencia.
+
+_CAMPO_PRECIO = Producto._meta.get_field('precio')
+PRECIO_MAXIMO = Decimal(10) ** (_CAMPO_PRECIO.max_digits - _CAMPO_PRECIO.decimal_places)
+
+
+def productos(categoria=None, marca=None, busqueda_texto=''):
+    """Productos (activos o no) a los que se aplica el ajuste."""
+    queryset = Producto.objects.all()
+    if categoria:
+        queryset = queryset.filter(id_categoria=categoria)
+    if marca:
+        queryset = queryset.filter(id_marca=marca)
+    if busqueda_texto:
+        queryset = busqueda.filtrar(queryset, busqueda_texto)
+    return queryset
+
+
+def _nuevo_precio(tipo_precio, valor_precio):
+    if tipo_precio == 'porcentaje':
+        factor = Value(1 + valor_precio / 100, output_field=DecimalField())
+        return Round(F('precio') * factor, 2, output_field=_CAMPO_PRECIO)
+    if tipo_precio == 'monto':
+        return Greatest(F('precio') + Value(valor_precio, output_field=DecimalField()), Value(Decimal('0.00')))
+    return None
+
+
+def _nuevo_stock(delta_stock):
+    # El stock nunca queda negativo; se calcula sobre la existencia (ver
+    # ProductoQuerySet.con_existencia)
+    return Greatest(F('existencia') + delta_stock, 0) if delta_stock else None
+
+
+def _registrar_ajuste(queryset, delta_stock, usuario, fecha):
+    # Un movimiento por producto con la diferencia entre el stock nuevo y la
+    # existencia; los que no cambian (ya en cero) no dejan movimiento
+    sql, params = (
+        queryset.con_existencia().annotate(ajuste=_nuevo_stock(delta_stock) - F('existencia'))
+        .exclude(ajuste=0).order_by().values('pk', 'ajuste').query.sql_with_params()
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {MovimientoInventario._meta.db_table} "
+            "(id_producto_id, tipo, cantidad, id_usuario_id, fecha, compactado) "
+            f"SELECT movimiento.id_producto, 'ajuste', movimiento.ajuste, %s, %s, %s FROM ({sql}) movimiento",
+            [usuario.pk, connection.ops.adapt_datetimefield_value(fecha), False, *params]
+        )
+        return cursor.rowcount
+
+
+def vista_previa(queryset, tipo_precio='', valor_precio=None, delta_stock=0, muestra=10):
+    """
+    Lo que haría el ajuste, sin aplicarlo: número de productos, precios
+    mínimo y máximo antes y después, cuántos se quedarían sin stock y algunos
+    productos de ejemplo.
+    """
+    queryset = queryset.con_existencia()
+    precio = _nuevo_precio(tipo_precio, valor_precio) or F('precio')
+    stock = _nuevo_stock(delta_stock) or F('existencia')
+    resumen = queryset.aggregate(
+        productos=Count('pk'),
+        precio_minimo=Min('precio'),
+        precio_maximo=Max('precio'),
+        nuevo_minimo=Min(precio),
+        nuevo_maximo=Max(precio),
+        quedan_sin_stock=Count('pk', filter=Q(existencia__gt=0, existencia__lte=-delta_stock)),
+    )
+    resumen['ejemplos'] = list(
+        queryset.order_by('id_producto')
+        .annotate(nuevo_precio=precio, nuevo_stock=stock)
+        .values('id_producto', 'nombre', 'precio', 'nuevo_precio', 'existencia', 'nuevo_stock')[:muestra]
+    )
+    return resumen
+
+
+def aplicar(queryset, usuario, categoria=None, marca=None, busqueda_texto='',
+            tipo_precio='', valor_precio=None, delta_stock=0):
+    """
+    Aplica el ajuste y lo registra en AjusteMasivo. Ni QuerySet.update() ni
+    los movimientos de inventario disparan las señales de Producto, así que
+    aquí mismo se vencen las cachés que dependen de precios y stock.
+    """
+    ahora = timezone.now()
+
+    with transaction.atomic():
+        # Los listados se purgan por categoría y marca, y las páginas de
+        # detalle por categoría (ver etiquetas_pagina)
+        pares = list(queryset.order_by().values_list('id_categoria_id', 'id_marca_id').distinct())
+        ajustados = _registrar_ajuste(queryset, delta_stock, usuario, ahora) if delta_stock else 0
+        if tipo_precio:
+            afectados = queryset.update(precio=_nuevo_precio(tipo_precio, valor_precio), fecha_actualizacion=ahora)
+            catalogo.actualizar_productos(queryset)
+        else:
+            # Sólo stock: los productos no cambian (como en una venta) y los
+            # afectados son los que recibieron un movimiento
+            afectados = ajustados
+            catalogo.actualizar_existencias(queryset, ahora)
+        ajuste = AjusteMasivo.objects.create(
+            id_usuario=usuario, id_categoria=categoria, id_marca=marca, busqueda=busqueda_texto,
+            tipo_precio=tipo_precio, valor_precio=valor_precio if tipo_precio else None,
+            delta_stock=delta_stock, productos_afectados=afectados,
+        )
+
+    resultados.cache.invalidar_filtro(
+        categoria.pk if categoria else None, marca.pk if marca else None
+    )
+    if delta_stock:
+        facetas.indice.calcular()
+    etiquetas = cache_paginas.etiquetas_listado()
+    for id_categoria, id_marca in pares:
+        etiquetas |= cache_paginas.etiquetas_listado(id_categoria, id_marca) | {f'categoria:{id_categoria}'}
+    cache_paginas.purgar(*etiquetas)
+    return ajuste
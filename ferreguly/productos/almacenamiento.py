@@ -0,0 +1,149 @@
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+TAMANO_BLOQUE = 64 * 1024
+
+
+class SubidaConHash(TemporaryFileUploadHandler):
+    """
+    Escribe cada archivo subido directo a un archivo temporal (nunca en
+    memoria) y calcula su SHA-256 mientras llegan los bloques, para que el
+    almacenamiento no tenga que volver a leerlo.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.resumen = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.resumen.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        archivo = super().file_complete(file_size)
+        archivo.sha256 = self.resumen.hexdigest()
+        return archivo
+
+
+def nombre_por_contenido(nombre, resumen):
+    """productos/foto.PNG -> productos/3f/3fa9...c1.png"""
+    directorio = posixpath.dirname(nombre)
+    extension = os.path.splitext(nombre)[1].lower()
+    return posixpath.join(directorio, resumen[:2], f'{resumen}{extension}')
+
+
+# Archivo guardado por contenido, o una de sus miniaturas (foto_200w.webp)
+_NOMBRE_POR_CONTENIDO = re.compile(r'(?:^|/)([0-9a-f]{2})/\1[0-9a-f]{62}(?:_\d+w)?\.[a-z0-9]+$')
+
+
+def es_por_contenido(nombre):
+    """True si el nombre sale del hash del archivo: su contenido nunca cambia."""
+    return bool(_NOMBRE_POR_CONTENIDO.search(nombre))
+
+
+class AlmacenamientoContenido(FileSystemStorage):
+    """
+    Guarda cada archivo bajo el hash de su contenido: subir dos veces la misma
+    foto deja un solo archivo. El nombre que se pide (upload_to + nombre
+    original) sólo aporta el directorio y la extensión.
+
+    Las filas de ArchivoImagen cuentan cuántos productos usan cada archivo; el
+    comando recolectar_imagenes borra los que ya nadie usa.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # El nombre final lo decide _save(); un archivo con el mismo nombre
+        # tiene el mismo contenido y se reutiliza
+        return name
+
+    def _temporal_con_resumen(self, content):
+        """
+        Regresa (ruta temporal, sha256, es_propia). Si la subida ya trae su
+        resumen se usa su archivo temporal; si no, se copia por bloques a uno
+        nuevo calculando el resumen.
+        """
+        resumen = getattr(content, 'sha256', None)
+        if resumen and hasattr(content, 'temporary_file_path'):
+            return content.temporary_file_path(), resumen, False
+
+        calculo = hashlib.sha256()
+        descriptor, ruta = tempfile.mkstemp(suffix='.subida', dir=settings.FILE_UPLOAD_TEMP_DIR)
+        try:
+            with os.fdopen(descriptor, 'wb') as temporal:
+                for bloque in content.chunks(TAMANO_BLOQUE):
+                    if isinstance(bloque, str):
+                        bloque = bloque.encode()
+                    calculo.update(bloque)
+                    temporal.write(bloque)
+        except BaseException:
+            os.remove(ruta)
+            raise
+        return ruta, calculo.hexdigest(), True
+
+    def _save(self, name, content):
+        temporal, resumen, es_propia = self._temporal_con_resumen(content)
+        nombre = nombre_por_contenido(name, resumen)
+        ruta = self.path(nombre)
+        if os.path.exists(ruta):
+            if es_propia:
+                os.remove(temporal)
+            return nombre
+
+        directorio = os.path.dirname(ruta)
+        if self.directory_permissions_mode is not None:
+            umask_anterior = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(directorio, self.directory_permissions_mode, exist_ok=True)
+            finally:
+                os.umask(umask_anterior)
+        else:
+            os.makedirs(directorio, exist_ok=True)
+
+        # Si otra petición guardó el mismo contenido al mismo tiempo, se
+        # reemplaza por un archivo idéntico
+        file_move_safe(temporal, ruta, allow_overwrite=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(ruta, self.file_permissions_mode)
+        return nombre
+
+    def guardar_derivado(self, nombre, contenido):
+        """
+        Guarda los bytes de un archivo derivado de otro (una miniatura) con el
+        nombre dado, sin renombrarlo por su contenido; si ya existe se
+        reemplaza.
+        """
+        ruta = self.path(nombre)
+        directorio = os.path.dirname(ruta)
+        os.makedirs(directorio, exist_ok=True)
+        descriptor, temporal = tempfile.mkstemp(suffix='.derivado', dir=directorio)
+        try:
+            with os.fdopen(descriptor, 'wb') as archivo:
+                archivo.write(contenido)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporal, self.file_permissions_mode)
+            # Quien lea el archivo ve el anterior o el nuevo, nunca uno a medias
+            os.replace(temporal, ruta)
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        return nombre
+
+    def archivos(self, directorio):
+        """Nombres de todos los archivos bajo `directorio`, recursivamente."""
+        subdirectorios, archivos = self.listdir(directorio)
+        for archivo in archivos:
+            yield posixpath.join(directorio, archivo)
+        for subdirectorio in subdirectorios:
+            yield from self.archivos(posixpath.join(directorio, subdirectorio))
+
+
+imagenes = AlmacenamientoContenido()
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ProductosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'productos'
+
+    def ready(self):
+        from . import signals
+        post_migrate.connect(signals.preparar_indice_busqueda, sender=self)
+        post_migrate.connect(signals.preparar_catalogo, sender=self)
@@ -0,0 +1,100 @@
+from bisect import bisect_left, insort
+
+from .indices import IndiceEnMemoria
+from .models import Categoria, Marca, Producto
+from .trigramas import normalizar
+
+# Orden en que se muestran los tipos de sugerencia con la misma clave
+PRIORIDAD = {'categoria': 0, 'marca': 1, 'producto': 2}
+
+
+def _claves(nombre):
+    """
+    Claves de un nombre: el nombre normalizado a partir de cada palabra, para
+    que "phil" sugiera "Desarmador Phillips".
+    """
+    palabras = normalizar(nombre).split()
+    return [' '.join(palabras[i:]) for i in range(len(palabras))]
+
+
+class IndicePrefijos(IndiceEnMemoria):
+    """
+    Lista ordenada de (clave, prioridad, id, nombre) sobre los nombres de
+    productos, categorías y marcas activos. Una búsqueda por prefijo es una
+    búsqueda binaria más un recorrido de los siguientes elementos.
+    """
+    _CAMPOS = ('_entradas', '_claves_por_objeto')
+
+    def __init__(self):
+        super().__init__()
+        self._entradas = []
+        self._claves_por_objeto = {}
+
+    def _agregar(self, tipo, id_objeto, nombre):
+        claves = _claves(nombre)
+        self._claves_por_objeto[(tipo, id_objeto)] = (claves, nombre)
+        for clave in claves:
+            insort(self._entradas, (clave, PRIORIDAD[tipo], id_objeto, nombre))
+
+    def _quitar(self, tipo, id_objeto):
+        claves, nombre = self._claves_por_objeto.pop((tipo, id_objeto), ((), None))
+        for clave in claves:
+            entrada = (clave, PRIORIDAD[tipo], id_objeto, nombre)
+            i = bisect_left(self._entradas, entrada)
+            if i < len(self._entradas) and self._entradas[i] == entrada:
+                del self._entradas[i]
+
+    def _cargar(self):
+        for tipo, modelo, campo_id in (
+            ('categoria', Categoria, 'id_categoria'),
+            ('marca', Marca, 'id_marca'),
+            ('producto', Producto, 'id_producto'),
+        ):
+            for id_objeto, nombre in modelo.objects.filter(activo=True).values_list(campo_id, 'nombre').iterator():
+                claves = _claves(nombre)
+                self._claves_por_objeto[(tipo, id_objeto)] = (claves, nombre)
+                self._entradas.extend((clave, PRIORIDAD[tipo], id_objeto, nombre) for clave in claves)
+        self._entradas.sort()
+
+    def _aplicar(self, tipo, id_objeto, nombre):
+        # nombre es None si el objeto ya no debe aparecer
+        self._quitar(tipo, id_objeto)
+        if nombre is not None:
+            self._agregar(tipo, id_objeto, nombre)
+
+    def actualizar(self, tipo, id_objeto, nombre, activo):
+        """Refleja en el índice el cambio de un producto, categoría o marca."""
+        self._cambiar(tipo, id_objeto, nombre if activo else None)
+
+    def eliminar(self, tipo, id_objeto):
+        self._cambiar(tipo, id_objeto, None)
+
+    def sugerencias(self, texto, limite=8):
+        """Regresa hasta `limite` tuplas (tipo, id, nombre) que empiezan con el texto."""
+        prefijo = normalizar(texto)
+        if not prefijo:
+            return []
+
+        self._asegurar_construido()
+
+        tipos = {prioridad: tipo for tipo, prioridad in PRIORIDAD.items()}
+        resultados = []
+        vistos = set()
+        with self._lock:
+            i = bisect_left(self._entradas, (prefijo,))
+            while i < len(self._entradas) and len(resultados) < limite:
+                clave, prioridad, id_objeto, nombre = self._entradas[i]
+                i += 1
+                if not clave.startswith(prefijo):
+                    break
+                if (prioridad, id_objeto) in vistos:
+                    continue
+                vistos.add((prioridad, id_objeto))
+                resultados.append((tipos[prioridad], id_objeto, nombre))
+
+        # Primero categorías y marcas, luego productos
+        resultados.sort(key=lambda r: PRIORIDAD[r[0]])
+        return resultados
+
+
+indice = IndicePrefijos()
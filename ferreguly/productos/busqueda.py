@@ -0,0 +1,176 @@
+import re
+from functools import lru_cache
+
+from django.db import connection
+from django.db.models import Q, Case, When, IntegerField
+from django.db.models.expressions import RawSQL
+
+from .trigramas import indice as indice_trigramas
+
+# Tabla virtual FTS5 que funciona como índice "sombra" de la tabla producto.
+# El rowid de cada fila es el id_producto, así que se puede unir directamente.
+TABLA_FTS = 'producto_fts'
+
+# Pesos de bm25 por columna: nombre, descripcion, categoria, marca
+PESOS_BM25 = (10.0, 1.0, 4.0, 4.0)
+
+_PALABRAS = re.compile(r'\w+', re.UNICODE)
+
+
+@lru_cache(maxsize=None)
+def fts_disponible():
+    """
+    Indica si la base de datos actual soporta el índice FTS5.
+    En otros motores se usa la búsqueda con icontains.
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pragma_compile_options WHERE compile_options = 'ENABLE_FTS5'")
+        return cursor.fetchone() is not None
+
+
+def crear_indice():
+    """Crea la tabla virtual si todavía no existe."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} USING fts5("
+            "nombre, descripcion, categoria, marca, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+
+
+def _insertar(cursor, condicion='', params=()):
+    cursor.execute(
+        f"INSERT INTO {TABLA_FTS} (rowid, nombre, descripcion, categoria, marca) "
+        "SELECT p.id_producto, p.nombre, p.descripcion, c.nombre, m.nombre "
+        "FROM producto p "
+        "JOIN categoria c ON c.id_categoria = p.id_categoria_id "
+        "JOIN marca m ON m.id_marca = p.id_marca_id " + condicion,
+        params
+    )
+
+
+def reconstruir_indice():
+    """Vuelve a llenar el índice completo a partir de la tabla producto."""
+    crear_indice()
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA_FTS}")
+        _insertar(cursor)
+
+
+def indexar_producto(id_producto):
+    """Actualiza en el índice la fila de un producto."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA_FTS} WHERE rowid = %s", [id_producto])
+        _insertar(cursor, 'WHERE p.id_producto = %s', [id_producto])
+
+
+def indexar_productos(ids):
+    """Actualiza en el índice las filas de varios productos (por ejemplo, los importados)."""
+    marcadores = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA_FTS} WHERE rowid IN ({marcadores})", list(ids))
+        _insertar(cursor, f'WHERE p.id_producto IN ({marcadores})', list(ids))
+
+
+def indexar_por_categoria(id_categoria):
+    """Reindexa los productos de una categoría (por ejemplo, si cambió su nombre)."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {TABLA_FTS} WHERE rowid IN "
+            "(SELECT id_producto FROM producto WHERE id_categoria_id = %s)",
+            [id_categoria]
+        )
+        _insertar(cursor, 'WHERE p.id_categoria_id = %s', [id_categoria])
+
+
+def indexar_por_marca(id_marca):
+    """Reindexa los productos de una marca."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {TABLA_FTS} WHERE rowid IN "
+            "(SELECT id_producto FROM producto WHERE id_marca_id = %s)",
+            [id_marca]
+        )
+        _insertar(cursor, 'WHERE p.id_marca_id = %s', [id_marca])
+
+
+def eliminar_producto(id_producto):
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA_FTS} WHERE rowid = %s", [id_producto])
+
+
+def consulta_fts(texto):
+    """
+    Convierte el texto capturado por el usuario en una consulta FTS5 segura.
+    Cada palabra se busca como prefijo y todas deben aparecer ("tornillo hex"
+    encuentra "Tornillo hexagonal"). Regresa None si no hay palabras útiles.
+    """
+    palabras = _PALABRAS.findall(texto)
+    if not palabras:
+        return None
+    return ' '.join(f'"{palabra}"*' for palabra in palabras)
+
+
+def buscar(queryset, texto):
+    """
+    Filtra el queryset de productos con el índice FTS5 y lo ordena por
+    relevancia (bm25). Se puede combinar con otros filtros y con la paginación
+    porque el índice se une a la consulta principal.
+    """
+    if not fts_disponible():
+        return queryset.filter(
+            Q(nombre__icontains=texto) |
+            Q(descripcion__icontains=texto)
+        )
+
+    consulta = consulta_fts(texto)
+    if consulta is None:
+        return queryset.none()
+
+    pesos = ', '.join(str(peso) for peso in PESOS_BM25)
+    # Sirve para Producto y para CatalogoItem (los dos tienen id_producto)
+    tabla = queryset.model._meta.db_table
+    return queryset.extra(
+        tables=[TABLA_FTS],
+        where=[
+            f'{TABLA_FTS}.rowid = {tabla}.id_producto',
+            f'{TABLA_FTS} MATCH %s',
+        ],
+        params=[consulta],
+        select={'relevancia': f'bm25({TABLA_FTS}, {pesos})'},
+        order_by=['relevancia', '-fecha_creacion'],
+    )
+
+
+def filtrar(queryset, texto):
+    """
+    Como buscar(), pero sin unir el índice ni ordenar por relevancia: el
+    índice queda en una subconsulta, así el queryset sirve también para
+    update() y aggregate().
+    """
+    if not fts_disponible():
+        return queryset.filter(Q(nombre__icontains=texto) | Q(descripcion__icontains=texto))
+    consulta = consulta_fts(texto)
+    if consulta is None:
+        return queryset.none()
+    return queryset.filter(
+        id_producto__in=RawSQL(f'SELECT rowid FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH %s', [consulta])
+    )
+
+
+def buscar_aproximado(queryset, texto, limite=100):
+    """
+    Búsqueda tolerante a errores de escritura ("tornilo", "desarmador philips")
+    con el índice de trigramas. Conserva los filtros del queryset y lo ordena
+    por similitud.
+    """
+    ids = indice_trigramas.buscar(texto, limite=limite)
+    if not ids:
+        return queryset.none()
+    orden = Case(
+        *[When(id_producto=id_producto, then=posicion) for posicion, id_producto in enumerate(ids)],
+        output_field=IntegerField()
+    )
+    return queryset.filter(id_producto__in=ids).order_by(orden)
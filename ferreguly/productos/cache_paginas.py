@@ -0,0 +1,156 @@
+import hashlib
+import re
+import time
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+# Alias de CACHES donde se guardan las páginas y las versiones de las etiquetas
+ALIAS = 'paginas'
+
+_PREFIJO_PAGINA = 'pagina:'
+_PREFIJO_ETIQUETA = 'etiqueta:'
+
+# La versión de cada etiqueta es el momento (en nanosegundos) de su última
+# purga. Una página no se guarda si alguna de sus etiquetas se purgó mientras
+# se generaba, porque podría no incluir el cambio; el margen cubre la
+# diferencia entre los relojes de los procesos que comparten la caché.
+_MARGEN_NS = 1_000_000_000
+
+# El token CSRF de cada formulario se reemplaza por uno de la petición actual
+_TOKEN_CSRF = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+
+def _cache():
+    return caches[ALIAS]
+
+
+def _versiones(cache, etiquetas):
+    claves = {_PREFIJO_ETIQUETA + etiqueta: etiqueta for etiqueta in etiquetas}
+    return {claves[clave]: version for clave, version in cache.get_many(claves).items()}
+
+
+def etiquetas_productos(productos):
+    """Etiquetas de una lista de productos: el id de cada uno."""
+    return {f'producto:{producto.pk}' for producto in productos}
+
+
+def etiquetas_listado(categoria=None, marca=None):
+    """
+    Etiquetas de un listado de productos filtrado por categoría y marca (None
+    es sin filtro). Los listados donde puede aparecer un producto son los de
+    su categoría, los de su marca y los que no tienen filtro:
+    etiquetas_listado(c, m) | etiquetas_listado().
+    """
+    etiquetas = set()
+    if categoria:
+        etiquetas.add(f'listado:categoria:{categoria}')
+    if marca:
+        etiquetas.add(f'listado:marca:{marca}')
+    return etiquetas or {'listado'}
+
+
+def se_puede_guardar(request):
+    """
+    Sólo se guardan las páginas de visitantes sin sesión ni mensajes
+    pendientes: son iguales para todos salvo por el token CSRF.
+    """
+    return (
+        request.method in ('GET', 'HEAD') and
+        settings.SESSION_COOKIE_NAME not in request.COOKIES and
+        not request.user.is_authenticated and
+        not get_messages(request)
+    )
+
+
+def obtener(clave, request):
+    """Respuesta guardada para `clave`, o None si no hay o si alguna etiqueta se purgó."""
+    cache = _cache()
+    guardada = cache.get(_PREFIJO_PAGINA + clave)
+    if guardada is None:
+        return None
+    contenido, tipo, versiones = guardada
+    if _versiones(cache, versiones) != versiones:
+        return None
+    contenido = _TOKEN_CSRF.sub(
+        lambda coincidencia: coincidencia.group(1) + get_token(request).encode() + coincidencia.group(2),
+        contenido
+    )
+    return HttpResponse(contenido, content_type=tipo)
+
+
+def guardar(clave, response, etiquetas, inicio):
+    """Guarda la página generada a partir de `inicio` (time.time_ns())."""
+    cache = _cache()
+    versiones = _versiones(cache, etiquetas)
+    if any(version > inicio - _MARGEN_NS for version in versiones.values()):
+        return
+    faltantes = [etiqueta for etiqueta in etiquetas if etiqueta not in versiones]
+    if faltantes:
+        # Etiquetas que nunca se han purgado
+        for etiqueta in faltantes:
+            cache.add(_PREFIJO_ETIQUETA + etiqueta, 0, timeout=None)
+        versiones = _versiones(cache, etiquetas)
+    cache.set(
+        _PREFIJO_PAGINA + clave,
+        (response.content, response['Content-Type'], versiones),
+        getattr(settings, 'CACHE_PAGINAS_SEGUNDOS', 600)
+    )
+
+
+def purgar(*etiquetas):
+    """Invalida todas las páginas marcadas con alguna de las etiquetas."""
+    ahora = time.time_ns()
+    _cache().set_many({_PREFIJO_ETIQUETA + etiqueta: ahora for etiqueta in etiquetas}, timeout=None)
+
+
+def limpiar():
+    _cache().clear()
+
+
+class CachePaginaAnonimaMixin:
+    """
+    Guarda la página completa para visitantes anónimos, marcada con las
+    etiquetas de `etiquetas_pagina` (productos, categorías y marcas que
+    aparecen). Al guardar un Producto, Categoria o Marca sólo se purgan las
+    páginas con sus etiquetas (ver signals.py).
+
+    Etiquetas usadas:
+        producto:<id>, categoria:<id>, marca:<id>  la página muestra el objeto
+        productos        lista productos con los conteos por categoría y
+                         marca (cambia si uno aparece, desaparece o cambia de
+                         categoría o marca)
+        listado, listado:categoria:<id>, listado:marca:<id>
+                         listado con esos filtros (ver etiquetas_listado);
+                         cambia también con el precio, nombre, descripción o
+                         imagen de sus productos, que pueden moverlos de página
+        categorias, marcas   lista todas las categorías o marcas
+        mas_vendidos     muestra el ranking de más vendidos (se purga con
+                         cada pedido; ver pedidos/mas_vendidos.py)
+    """
+
+    def etiquetas_pagina(self, context):
+        return set()
+
+    def dispatch(self, request, *args, **kwargs):
+        if not se_puede_guardar(request):
+            return super().dispatch(request, *args, **kwargs)
+
+        clave = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+        response = obtener(clave, request)
+        if response is not None:
+            response['X-Cache'] = 'HIT'
+            return response
+
+        inicio = time.time_ns()
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and hasattr(response, 'add_post_render_callback'):
+            context = response.context_data
+            response.add_post_render_callback(
+                lambda response: guardar(clave, response, self.etiquetas_pagina(context), inicio)
+            )
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,169 @@
+import logging
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from pedidos.models import Reserva
+
+from .models import CatalogoItem, Categoria, Marca, MovimientoInventario, Producto, ProductoQuerySet
+
+# Mantenimiento de catalogo_item, el modelo de lectura del catálogo público.
+# Las filas se copian con INSERT ... SELECT desde producto, categoria y marca
+# (como el índice de búsqueda en busqueda.py), así reconstruir todo el
+# catálogo es una sola sentencia y actualizar un producto son dos.
+#
+# Los cambios de existencia y de reservas (ventas, cancelaciones, carritos)
+# no copian sus productos dentro de su transacción: actualizar_despues() los
+# copia en cuanto ésta se confirma (transaction.on_commit()), así una venta no
+# borra ni inserta filas del catálogo mientras tiene el bloqueo de escritura.
+# Si la copia falla, reconstruir_catalogo la corrige.
+
+TABLA = CatalogoItem._meta.db_table
+
+logger = logging.getLogger(__name__)
+
+# Límites de los rangos de precio: rango_precio es cuántos límites alcanza el
+# precio (0 para menos de 100, 1 para 100 a 249.99, ...)
+RANGOS_PRECIO = (100, 250, 500, 1000, 2500)
+
+# Ancho de la miniatura cuya URL se guarda
+TAMANO_MINIATURA = 200
+
+_RANGO = 'CASE ' + ' '.join(
+    f'WHEN p.precio < {limite} THEN {indice}' for indice, limite in enumerate(RANGOS_PRECIO)
+) + f' ELSE {len(RANGOS_PRECIO)} END'
+
+
+def _prefijo_miniatura():
+    # La vista de miniaturas sirve la miniatura (y la genera si falta), así
+    # que su URL vale aunque el archivo todavía no exista
+    return reverse('miniatura', args=[TAMANO_MINIATURA, 'jpeg', 'x'])[:-1]
+
+
+# Expresiones SQL sobre el producto `p`. EXISTENCIA es el stock real: el
+# saldo compactado más los movimientos pendientes; RESERVADO, la suma de sus
+# reservas de stock vigentes (las vencidas ya no apartan nada aunque
+# liberar_reservas no las haya borrado)
+EXISTENCIA = (
+    f"(p.stock + COALESCE((SELECT SUM(mi.cantidad) FROM {MovimientoInventario._meta.db_table} mi "
+    "WHERE mi.id_producto_id = p.id_producto AND NOT mi.compactado), 0))"
+)
+RESERVADO = (
+    f"COALESCE((SELECT SUM(r.cantidad) FROM {Reserva._meta.db_table} r "
+    "WHERE r.id_producto_id = p.id_producto AND r.expira > CURRENT_TIMESTAMP), 0)"
+)
+
+
+def _insertar(cursor, condicion='', params=(), fecha=None):
+    # `fecha` reemplaza la fecha de actualización del producto, para los
+    # cambios que no la escriben (los movimientos de inventario)
+    cursor.execute(
+        f"INSERT INTO {TABLA} ("
+        "id_producto, nombre, descripcion, descripcion_corta, precio, rango_precio, stock, en_stock, reservado, "
+        "imagen, miniatura, id_categoria_id, categoria_nombre, categoria_activa, "
+        "id_marca_id, marca_nombre, marca_activa, fecha_creacion, fecha_actualizacion) "
+        "SELECT p.id_producto, p.nombre, p.descripcion, "
+        f"SUBSTR(p.descripcion, 1, {ProductoQuerySet.LARGO_DESCRIPCION_CORTA}), p.precio, {_RANGO}, "
+        f"{EXISTENCIA}, {EXISTENCIA} > 0, {RESERVADO}, p.imagen, "
+        "CASE WHEN p.imagen IS NULL OR p.imagen = '' THEN '' ELSE %s || p.imagen END, "
+        "p.id_categoria_id, c.nombre, c.activo, p.id_marca_id, m.nombre, m.activo, "
+        "p.fecha_creacion, COALESCE(%s, p.fecha_actualizacion) "
+        f"FROM {Producto._meta.db_table} p "
+        f"JOIN {Categoria._meta.db_table} c ON c.id_categoria = p.id_categoria_id "
+        f"JOIN {Marca._meta.db_table} m ON m.id_marca = p.id_marca_id "
+        "WHERE p.activo " + condicion,
+        [_prefijo_miniatura(), fecha, *params]
+    )
+
+
+def reconstruir():
+    """Vuelve a llenar el catálogo completo a partir de los productos activos."""
+    with transaction.atomic(savepoint=False), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA}")
+        _insertar(cursor)
+
+
+def actualizar_producto(id_producto):
+    """Copia de nuevo un producto (o lo quita, si ya no está activo)."""
+    with transaction.atomic(savepoint=False), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA} WHERE id_producto = %s", [id_producto])
+        _insertar(cursor, 'AND p.id_producto = %s', [id_producto])
+
+
+def actualizar_productos(queryset, fecha=None):
+    """
+    Copia de nuevo los productos de un queryset de Producto, para cambios
+    hechos con QuerySet.update() o con movimientos de inventario (que no
+    disparan las señales).
+    """
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with transaction.atomic(savepoint=False), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA} WHERE id_producto IN ({sql})", params)
+        _insertar(cursor, f'AND p.id_producto IN ({sql})', params, fecha)
+
+
+def actualizar_existencias(queryset, fecha):
+    """
+    Copia sólo la existencia de los productos de un queryset, para los
+    movimientos de inventario en bloque (ajustes masivos): una sentencia
+    UPDATE sobre las filas que ya están, en lugar de borrarlas y copiarlas.
+    """
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    existencia = f"(SELECT {EXISTENCIA} FROM {Producto._meta.db_table} p WHERE p.id_producto = {TABLA}.id_producto)"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {TABLA} SET stock = {existencia}, en_stock = {existencia} > 0, fecha_actualizacion = %s "
+            f"WHERE id_producto IN ({sql})",
+            [connection.ops.adapt_datetimefield_value(fecha), *params]
+        )
+
+
+def actualizar_despues(ids, aviso=None):
+    """
+    Copia de nuevo los productos `ids` cuando se confirme la transacción y
+    después llama a `aviso()` (que vence las cachés calculadas a partir del
+    catálogo). Con CATALOGO_AL_CONFIRMAR = False los copia en el momento,
+    dentro de la transacción.
+    """
+    ids = sorted(set(ids))
+    if not getattr(settings, 'CATALOGO_AL_CONFIRMAR', True):
+        _copiar(ids)
+        if aviso is not None:
+            transaction.on_commit(aviso)
+        return
+
+    def copiar():
+        try:
+            _copiar(ids)
+        except Exception:
+            # La transacción ya se confirmó: el error no debe llegar a quien
+            # vendió o apartó
+            logger.exception('No se pudo actualizar el catálogo de lectura')
+        if aviso is not None:
+            aviso()
+
+    transaction.on_commit(copiar)
+
+
+def _copiar(ids):
+    fecha = timezone.now()
+    for inicio in range(0, len(ids), 1000):
+        actualizar_productos(Producto.objects.filter(pk__in=ids[inicio:inicio + 1000]), fecha=fecha)
+
+
+def eliminar_producto(id_producto):
+    CatalogoItem.objects.filter(pk=id_producto).delete()
+
+
+def actualizar_categoria(categoria):
+    CatalogoItem.objects.filter(id_categoria_id=categoria.pk).update(
+        categoria_nombre=categoria.nombre, categoria_activa=categoria.activo
+    )
+
+
+def actualizar_marca(marca):
+    CatalogoItem.objects.filter(id_marca_id=marca.pk).update(
+        marca_nombre=marca.nombre, marca_activa=marca.activo
+    )
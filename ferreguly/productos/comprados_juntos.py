@@ -0,0 +1,114 @@
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from pedidos.models import DetallePedido, Pedido
+
+from .models import CoocurrenciaProducto, Generacion, ProductoRelacionado
+from . import cache_paginas
+
+# "Comprados juntos frecuentemente": a partir de los detalles de pedido se
+# cuenta cuántos pedidos incluyen cada par de productos (la matriz de
+# coocurrencia, que es el producto de la matriz pedido x producto por su
+# transpuesta) y se guardan los TOP más frecuentes de cada producto en
+# producto_relacionado. Todo se calcula en la base de datos con un JOIN y un
+# GROUP BY; en Python no se recorre ningún pedido.
+#
+# El proceso es incremental: la Generacion CLAVE guarda el último id_pedido
+# incluido y cada corrida sólo suma los pedidos nuevos. Los pedidos cancelados
+# no cuentan, pero uno que se cancela después de contarse sigue sumado hasta
+# la siguiente reconstrucción completa.
+
+CLAVE = 'comprados_juntos'
+
+# Relacionados que se guardan por producto (el detalle muestra los primeros
+# que estén activos)
+TOP = 10
+
+# Las tablas que usa el SQL
+_DETALLE = DetallePedido._meta.db_table
+_PEDIDO = Pedido._meta.db_table
+_COOCURRENCIA = CoocurrenciaProducto._meta.db_table
+_RELACIONADO = ProductoRelacionado._meta.db_table
+
+# Productos distintos de cada pedido no cancelado del rango (desde, hasta]
+_LINEAS = (
+    f"WITH lineas AS ("
+    f"SELECT DISTINCT d.id_pedido_id AS pedido, d.id_producto_id AS producto "
+    f"FROM {_DETALLE} d JOIN {_PEDIDO} p ON p.id_pedido = d.id_pedido_id "
+    f"WHERE d.id_pedido_id > %s AND d.id_pedido_id <= %s AND p.estado <> 'cancelado') "
+)
+
+_SUMAR = (
+    _LINEAS +
+    f"INSERT INTO {_COOCURRENCIA} (id_producto_id, id_relacionado_id, veces) "
+    f"SELECT a.producto, b.producto, COUNT(*) "
+    f"FROM lineas a JOIN lineas b ON b.pedido = a.pedido AND b.producto <> a.producto "
+    f"GROUP BY a.producto, b.producto "
+    f"ON CONFLICT (id_producto_id, id_relacionado_id) "
+    f"DO UPDATE SET veces = {_COOCURRENCIA}.veces + excluded.veces"
+)
+
+# Productos cuyos contadores pudieron cambiar en el rango
+_TOCADOS = (
+    f"SELECT DISTINCT id_producto_id FROM {_DETALLE} "
+    f"WHERE id_pedido_id > %s AND id_pedido_id <= %s"
+)
+
+_BORRAR_TOP = f"DELETE FROM {_RELACIONADO} WHERE id_producto_id IN ({_TOCADOS})"
+
+_CALCULAR_TOP = (
+    f"INSERT INTO {_RELACIONADO} (id_producto_id, id_relacionado_id, posicion, veces) "
+    f"SELECT id_producto_id, id_relacionado_id, posicion, veces FROM ("
+    f"SELECT id_producto_id, id_relacionado_id, veces, ROW_NUMBER() OVER ("
+    f"PARTITION BY id_producto_id ORDER BY veces DESC, id_relacionado_id) AS posicion "
+    f"FROM {_COOCURRENCIA} WHERE id_producto_id IN ({_TOCADOS})) AS orden "
+    f"WHERE posicion <= %s"
+)
+
+
+def ultimo_pedido():
+    """Último id_pedido incluido en los contadores (0 si nunca se han calculado)."""
+    return Generacion.objects.filter(clave=CLAVE).values_list('valor', flat=True).first() or 0
+
+
+def _procesar(desde, hasta, top):
+    """Suma los pedidos de (desde, hasta] y recalcula el top de sus productos."""
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(_SUMAR, [desde, hasta])
+            cursor.execute(_BORRAR_TOP, [desde, hasta])
+            cursor.execute(_CALCULAR_TOP, [desde, hasta, top])
+            cursor.execute(_TOCADOS, [desde, hasta])
+            tocados = [fila[0] for fila in cursor.fetchall()]
+        Generacion.objects.update_or_create(clave=CLAVE, defaults={'valor': hasta, 'fecha': timezone.now()})
+    return tocados
+
+
+def actualizar(completo=False, lote=50000, top=TOP):
+    """
+    Incluye los pedidos nuevos desde la última corrida (o todos, con
+    `completo`), de `lote` en `lote` pedidos: cada lote se guarda en su propia
+    transacción junto con el avance, así que una corrida interrumpida sigue
+    donde se quedó. Regresa cuántos productos cambiaron.
+    """
+    hasta = Pedido.objects.aggregate(maximo=Max('id_pedido'))['maximo'] or 0
+    if completo:
+        with transaction.atomic():
+            CoocurrenciaProducto.objects.all().delete()
+            ProductoRelacionado.objects.all().delete()
+            Generacion.objects.filter(clave=CLAVE).delete()
+    desde = ultimo_pedido()
+
+    tocados = set()
+    while desde < hasta:
+        fin = min(desde + lote, hasta)
+        tocados.update(_procesar(desde, fin, top))
+        desde = fin
+
+    # El ETag del detalle incluye la fecha de la última Generacion, y las
+    # páginas guardadas de los productos tocados se purgan
+    tocados = sorted(tocados)
+    for inicio in range(0, len(tocados), 1000):
+        cache_paginas.purgar(*(f'producto:{id_producto}' for id_producto in tocados[inicio:inicio + 1000]))
+    return len(tocados)
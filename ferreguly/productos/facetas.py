@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import defaultdict
+
+from django.db.models import Count, Q
+
+from .models import CatalogoItem
+
+# Segundos después de los cuales los conteos se vuelven a calcular desde la
+# base de datos, para recoger cambios hechos por otros procesos
+REFRESCO_SEGUNDOS = 300
+
+
+def contar_pares(queryset):
+    """
+    Cuenta los productos de un queryset por (categoría, marca) con una sola
+    consulta agrupada. Regresa {(id_categoria, id_marca): [activos, con_stock]}.
+    """
+    filas = (
+        queryset.order_by()
+        .values_list('id_categoria_id', 'id_marca_id')
+        .annotate(total=Count('id_producto'), con_stock=Count('id_producto', filter=Q(stock__gt=0)))
+    )
+    return {(categoria, marca): [total, con_stock] for categoria, marca, total, con_stock in filas}
+
+
+def conteos(pares, categoria_id=None, marca_id=None, solo_con_stock=False):
+    """
+    A partir de los conteos por (categoría, marca) calcula los conteos de cada
+    filtro. Cada faceta respeta el filtro de la otra pero no el suyo, así el
+    usuario ve cuántos productos tendría al cambiar de categoría o de marca.
+    Regresa (por_categoria, por_marca).
+    """
+    columna = 1 if solo_con_stock else 0
+    por_categoria = defaultdict(int)
+    por_marca = defaultdict(int)
+    for (categoria, marca), valores in pares.items():
+        if marca_id is None or marca == marca_id:
+            por_categoria[categoria] += valores[columna]
+        if categoria_id is None or categoria == categoria_id:
+            por_marca[marca] += valores[columna]
+    return por_categoria, por_marca
+
+
+def total(pares, categoria_id=None, marca_id=None, solo_con_stock=False):
+    """Número de productos que cumplen ambos filtros."""
+    columna = 1 if solo_con_stock else 0
+    return sum(
+        valores[columna] for (categoria, marca), valores in pares.items()
+        if (categoria_id is None or categoria == categoria_id) and (marca_id is None or marca == marca_id)
+    )
+
+
+class ConteoFacetas:
+    """
+    Conteos precalculados de productos activos (y con stock) por categoría y
+    marca. Se calculan una vez y después se ajustan con cada alta, cambio o
+    baja de un Producto, sin volver a consultar la base de datos.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pares = {}
+        self._calculado_en = None
+
+    def calcular(self):
+        # El catálogo de lectura sólo tiene los productos activos, con su
+        # stock real
+        pares = contar_pares(CatalogoItem.objects.all())
+        with self._lock:
+            self._pares = pares
+            self._calculado_en = time.monotonic()
+
+    def pares(self):
+        if self._calculado_en is None or time.monotonic() - self._calculado_en > REFRESCO_SEGUNDOS:
+            self.calcular()
+        with self._lock:
+            return {par: list(valores) for par, valores in self._pares.items()}
+
+    def _sumar(self, estado, signo):
+        categoria, marca, activo, stock = estado
+        if not activo:
+            return
+        valores = self._pares.setdefault((categoria, marca), [0, 0])
+        valores[0] += signo
+        if stock > 0:
+            valores[1] += signo
+        if valores[0] <= 0:
+            del self._pares[(categoria, marca)]
+
+    def actualizar(self, anterior, actual):
+        """
+        Ajusta los conteos con el estado (id_categoria, id_marca, activo, stock)
+        anterior y actual de un producto; cualquiera de los dos puede ser None.
+        """
+        with self._lock:
+            if self._calculado_en is None:
+                return
+            if anterior:
+                self._sumar(anterior, -1)
+            if actual:
+                self._sumar(actual, 1)
+
+
+def estado_producto(producto):
+    # La existencia incluye los movimientos de inventario pendientes, si el
+    # producto se cargó con con_existencia()
+    return (producto.id_categoria_id, producto.id_marca_id, producto.activo, getattr(producto, 'existencia', producto.stock))
+
+
+indice = ConteoFacetas()
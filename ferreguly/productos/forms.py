@@ -1,5 +1,52 @@
 from django import forms
-from .models import Categoria, Marca, Producto
+from django.core.exceptions import ValidationError
+from .models import AjusteMasivo, Categoria, Marca, Producto
+from . import referencias
+
+
+class _OpcionesReferencia:
+    """
+    Opciones de un ReferenciaChoiceField. Como ModelChoiceIterator, se leen al
+    recorrerlas (al mostrar el formulario) y no al crear el campo, así los
+    formularios que lo declaran en la clase no leen la base de datos al
+    importarse.
+    """
+    def __init__(self, campo):
+        self.campo = campo
+    
+    def __iter__(self):
+        if self.campo.empty_label is not None:
+            yield ('', self.campo.empty_label)
+        for obj in self.campo.obtener():
+            yield (obj.pk, self.campo.label_from_instance(obj))
+    
+    def __len__(self):
+        return len(self.campo.obtener()) + (self.campo.empty_label is not None)
+    
+    def __bool__(self):
+        return self.campo.empty_label is not None or bool(self.campo.obtener())
+
+class ReferenciaChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField que toma las opciones de la caché de referencias en lugar
+    de consultar la base de datos al mostrar o validar el formulario.
+    """
+    def __init__(self, obtener, *args, **kwargs):
+        self.obtener = obtener
+        super().__init__(*args, **kwargs)
+    
+    def _get_choices(self):
+        return _OpcionesReferencia(self)
+    
+    choices = property(_get_choices, forms.ChoiceField._set_choices)
+    
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        for obj in self.obtener():
+            if str(obj.pk) == str(value):
+                return obj
+        raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
 
 class CategoriaForm(forms.ModelForm):
     class Meta:
@@ -33,11 +80,80 @@ class ProductoForm(forms.ModelForm):
         
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['id_categoria'].queryset = Categoria.objects.filter(activo=True)
-        self.fields['id_marca'].queryset = Marca.objects.filter(activo=True)
+        # Categorías y marcas activas desde la caché de referencias
+        for nombre, modelo, obtener in (
+            ('id_categoria', Categoria, referencias.categorias),
+            ('id_marca', Marca, referencias.marcas),
+        ):
+            original = self.fields[nombre]
+            self.fields[nombre] = ReferenciaChoiceField(
+                obtener,
+                queryset=modelo.objects.none(),
+                label=original.label,
+                required=original.required,
+                initial=original.initial,
+            )
         
         for field in self.fields:
             self.fields[field].widget.attrs.update({'class': 'form-control'})
         
         self.fields['descripcion'].widget = forms.Textarea(attrs={'class': 'form-control', 'rows': 3})
-        self.fields['activo'].widget.attrs.update({'class': 'form-check-input'})
\ No newline at end of file
+        self.fields['activo'].widget.attrs.update({'class': 'form-check-input'})
+
+
+class AjusteMasivoForm(forms.Form):
+    """Filtro de productos y cambio de precio y/o stock a aplicarles."""
+    categoria = ReferenciaChoiceField(
+        lambda: referencias.categorias(activas=False), queryset=Categoria.objects.none(),
+        required=False, empty_label='Todas las categorías', label='Categoría'
+    )
+    marca = ReferenciaChoiceField(
+        lambda: referencias.marcas(activas=False), queryset=Marca.objects.none(),
+        required=False, empty_label='Todas las marcas', label='Marca'
+    )
+    busqueda = forms.CharField(max_length=100, required=False, label='Búsqueda')
+    tipo_precio = forms.ChoiceField(
+        choices=[('', 'Sin cambio')] + AjusteMasivo.TIPOS_PRECIO, required=False, label='Cambio de precio'
+    )
+    valor_precio = forms.DecimalField(
+        max_digits=10, decimal_places=2, required=False, label='Valor',
+        help_text='Porcentaje (10 sube 10 %, -5 baja 5 %) o monto a sumar al precio'
+    )
+    delta_stock = forms.IntegerField(
+        required=False, initial=0, label='Cambio de stock', help_text='Unidades a sumar (o restar, con signo -)'
+    )
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for field in self.fields:
+            self.fields[field].widget.attrs.update({'class': 'form-control'})
+        for field in ('categoria', 'marca', 'tipo_precio'):
+            self.fields[field].widget.attrs.update({'class': 'form-select'})
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        tipo_precio = cleaned_data.get('tipo_precio')
+        valor_precio = cleaned_data.get('valor_precio')
+        cleaned_data['delta_stock'] = cleaned_data.get('delta_stock') or 0
+        if tipo_precio and valor_precio is None:
+            self.add_error('valor_precio', 'Indica el porcentaje o el monto')
+        elif tipo_precio == 'porcentaje' and valor_precio <= -100:
+            self.add_error('valor_precio', 'El porcentaje debe ser mayor que -100')
+        elif not tipo_precio and not cleaned_data['delta_stock']:
+            raise ValidationError('Indica un cambio de precio o de stock')
+        return cleaned_data
+    
+    def filtros(self):
+        return {
+            'categoria': self.cleaned_data['categoria'],
+            'marca': self.cleaned_data['marca'],
+            'busqueda_texto': self.cleaned_data['busqueda'].strip(),
+        }
+    
+    def cambio(self):
+        tipo_precio = self.cleaned_data['tipo_precio']
+        return {
+            'tipo_precio': tipo_precio,
+            'valor_precio': self.cleaned_data['valor_precio'] if tipo_precio else None,
+            'delta_stock': self.cleaned_data['delta_stock'],
+        }
@@ -0,0 +1,104 @@
+import abc
+import logging
+import threading
+import time
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Segundos después de los cuales un índice se vuelve a construir desde la base
+# de datos, para recoger cambios hechos por otros procesos
+REFRESCO_SEGUNDOS = 300
+
+
+class IndiceEnMemoria(abc.ABC):
+    """
+    Base de los índices de búsqueda en memoria (trigramas.py, autocompletar.py).
+
+    El índice se construye en un hilo al arrancar el proceso (precargar()) y
+    se reconstruye en otro hilo cuando tiene más de REFRESCO_SEGUNDOS; mientras
+    tanto las búsquedas siguen usando el anterior, que se reemplaza completo
+    cuando el nuevo está listo. Sólo si todavía no hay índice la búsqueda
+    espera a que se construya, y una sola construcción a la vez.
+
+    Las subclases definen _CAMPOS (los atributos con los datos), _cargar()
+    (llena los datos de una instancia nueva desde la base de datos) y
+    _aplicar(*cambio), que refleja el cambio de un objeto.
+    """
+    _CAMPOS = ()
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._construccion = threading.Lock()
+        self._construido_en = None
+        self._refrescando = False
+        # Cambios que llegan mientras se construye, para aplicarlos al nuevo
+        self._cambios = None
+
+    @abc.abstractmethod
+    def _cargar(self):
+        """Llena los campos de esta instancia desde la base de datos."""
+
+    @abc.abstractmethod
+    def _aplicar(self, *cambio):
+        """Refleja en los campos el cambio de un objeto."""
+
+    def _cambiar(self, *cambio):
+        with self._lock:
+            if self._cambios is not None:
+                self._cambios.append(cambio)
+            if self._construido_en is not None:
+                self._aplicar(*cambio)
+
+    def construir(self):
+        """Vuelve a cargar el índice completo desde la base de datos."""
+        with self._construccion:
+            self._construir()
+
+    def _construir(self):
+        with self._lock:
+            self._cambios = []
+        nuevo = type(self)()
+        try:
+            nuevo._cargar()
+        except BaseException:
+            with self._lock:
+                self._cambios = None
+            raise
+        with self._lock:
+            # Lo que cambió mientras se leía la base de datos puede no estar
+            # en la lectura; aplicarlo dos veces no cambia el resultado
+            for cambio in self._cambios:
+                nuevo._aplicar(*cambio)
+            self._cambios = None
+            for campo in self._CAMPOS:
+                setattr(self, campo, getattr(nuevo, campo))
+            self._construido_en = time.monotonic()
+
+    def precargar(self):
+        """Construye o refresca el índice en un hilo, si no se está haciendo ya."""
+        with self._lock:
+            if self._refrescando:
+                return
+            self._refrescando = True
+        threading.Thread(target=self._refrescar, daemon=True).start()
+
+    def _refrescar(self):
+        try:
+            self.construir()
+        except Exception:
+            logger.exception('No se pudo construir el índice %s', type(self).__name__)
+        finally:
+            with self._lock:
+                self._refrescando = False
+            connections.close_all()
+
+    def _asegurar_construido(self):
+        if self._construido_en is None:
+            # Si ya se está construyendo (la precarga), se espera a que termine
+            with self._construccion:
+                if self._construido_en is None:
+                    self._construir()
+        elif time.monotonic() - self._construido_en > REFRESCO_SEGUNDOS:
+            self.precargar()
@@ -0,0 +1,126 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from .models import Producto
+
+# Columnas de los archivos de productos (CSV o JSONL), en el orden en que se
+# exportan. Al importar basta con sku (o id_producto, para los productos sin
+# sku) y las columnas que se quieren cambiar; los productos nuevos necesitan
+# sku, nombre, categoria, marca y precio.
+COLUMNAS = ('id_producto', 'sku', 'nombre', 'descripcion', 'categoria', 'marca', 'precio', 'stock', 'activo')
+FORMATOS = ('csv', 'jsonl')
+
+# Campos del modelo que deben venir en la fila para crear un producto
+REQUERIDOS = ('nombre', 'id_categoria_id', 'id_marca_id', 'precio')
+
+_VERDADEROS = {'1', 'true', 'si', 'sí', 'verdadero', 'yes'}
+_FALSOS = {'0', 'false', 'no', 'falso'}
+
+_MAXIMO_PRECIO = Decimal(10) ** (
+    Producto._meta.get_field('precio').max_digits - Producto._meta.get_field('precio').decimal_places
+)
+
+
+def formato_de(ruta, formato=None):
+    """Formato indicado, o el que corresponde a la extensión (CSV por omisión)."""
+    if formato:
+        return formato
+    return 'jsonl' if ruta.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def leer(archivo, formato):
+    """Genera (número de línea, fila como dict) de un archivo abierto en modo texto."""
+    if formato == 'csv':
+        lector = csv.DictReader(archivo)
+        for fila in lector:
+            yield lector.line_num, fila
+        return
+    for numero, linea in enumerate(archivo, start=1):
+        if not linea.strip():
+            continue
+        try:
+            fila = json.loads(linea)
+        except ValueError:
+            raise ValueError(f'línea {numero}: JSON no válido')
+        if not isinstance(fila, dict):
+            raise ValueError(f'línea {numero}: se esperaba un objeto JSON')
+        yield numero, fila
+
+
+def _texto(valor):
+    return '' if valor is None else str(valor).strip()
+
+
+def _largo(campo, valor):
+    maximo = Producto._meta.get_field(campo).max_length
+    if len(valor) > maximo:
+        raise ValueError(f'{campo} tiene más de {maximo} caracteres')
+    return valor
+
+
+def convertir(fila, categoria, marca):
+    """
+    Valores de Producto de una fila, sólo de las columnas presentes, más el
+    'id_producto' si la fila lo trae (no se asigna: identifica al producto
+    cuando no hay sku). `categoria` y `marca` convierten un nombre en su id.
+    Lanza ValueError con el motivo si la fila no es válida.
+    """
+    valores = {}
+    id_producto = _texto(fila.get('id_producto'))
+    if id_producto:
+        try:
+            valores['id_producto'] = int(id_producto)
+        except ValueError:
+            raise ValueError(f'id_producto no válido: {fila["id_producto"]!r}')
+    sku = _largo('sku', _texto(fila.get('sku')))
+    if sku:
+        valores['sku'] = sku
+    elif not id_producto:
+        raise ValueError('falta el sku o el id_producto')
+
+    if 'nombre' in fila:
+        valores['nombre'] = _largo('nombre', _texto(fila['nombre']))
+        if not valores['nombre']:
+            raise ValueError('el nombre está vacío')
+    if 'descripcion' in fila:
+        valores['descripcion'] = _texto(fila['descripcion'])
+    if 'categoria' in fila:
+        valores['id_categoria_id'] = categoria(_texto(fila['categoria']))
+    if 'marca' in fila:
+        valores['id_marca_id'] = marca(_texto(fila['marca']))
+
+    if 'precio' in fila:
+        try:
+            precio = Decimal(_texto(fila['precio']))
+        except InvalidOperation:
+            raise ValueError(f'precio no válido: {fila["precio"]!r}')
+        if not precio.is_finite() or precio < 0 or precio >= _MAXIMO_PRECIO:
+            raise ValueError(f'precio fuera de rango: {fila["precio"]!r}')
+        valores['precio'] = precio.quantize(Decimal('0.01'))
+
+    if 'stock' in fila:
+        if isinstance(fila['stock'], bool):
+            raise ValueError(f'stock no válido: {fila["stock"]!r}')
+        try:
+            valores['stock'] = int(_texto(fila['stock']) or 0)
+        except ValueError:
+            raise ValueError(f'stock no válido: {fila["stock"]!r}')
+
+    if 'activo' in fila:
+        activo = fila['activo']
+        if not isinstance(activo, bool):
+            texto = _texto(activo).lower()
+            if texto not in _VERDADEROS | _FALSOS:
+                raise ValueError(f'activo no válido: {activo!r}')
+            activo = texto in _VERDADEROS
+        valores['activo'] = activo
+    return valores
+
+
+def exportables(queryset):
+    """Tuplas con las COLUMNAS de cada producto del queryset; el stock es la existencia."""
+    return queryset.con_existencia().values_list(
+        'id_producto', 'sku', 'nombre', 'descripcion', 'id_categoria__nombre', 'id_marca__nombre',
+        'precio', 'existencia', 'activo'
+    )
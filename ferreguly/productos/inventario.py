@@ -0,0 +1,162 @@
+from django.db import connection, transaction
+from django.db.models import Case, F, Sum, When
+from django.utils import timezone
+
+from .models import MovimientoInventario, Producto
+from . import cache_paginas, catalogo, facetas, resultados
+
+# Inventario como libro de movimientos (movimiento_inventario). Vender,
+# reabastecer, ajustar o cancelar un pedido sólo inserta movimientos: la fila
+# del producto no se reescribe con cada venta, así que las compras de un
+# producto muy vendido no compiten por actualizarla y cada cambio de stock
+# queda registrado con su pedido o usuario. El stock real es Producto.stock
+# (el saldo compactado) más los movimientos pendientes; compactar() (el
+# comando compactar_inventario) los suma al saldo por lotes.
+#
+# Para no vender de más, descontar() revisa y registra la venta en una sola
+# sentencia, INSERT ... SELECT ... WHERE existencia - reservado >= cantidad,
+# sin escribir la fila del producto: la base de datos evalúa la condición con
+# el libro ya actualizado por las ventas anteriores. En SQLite las
+# transacciones de escritura van una después de otra; en una base con
+# escrituras simultáneas bloquear() toma antes las filas de los productos con
+# SELECT ... FOR UPDATE, así dos ventas del mismo producto no evalúan la
+# condición con el mismo libro.
+# Si alguna línea no alcanza, StockInsuficiente deshace la transacción
+# completa. El catálogo de lectura se copia al confirmarse (ver
+# catalogo.actualizar_despues()).
+
+_TABLA = MovimientoInventario._meta.db_table
+
+
+class StockInsuficiente(Exception):
+    def __init__(self, id_producto, nombre, disponible):
+        super().__init__(f'"{nombre}" sólo tiene {disponible} disponibles.')
+        self.id_producto = id_producto
+        self.nombre = nombre
+        self.disponible = disponible
+
+
+def registrar(movimientos):
+    """
+    Inserta los MovimientoInventario (sin guardar) y actualiza el catálogo de
+    lectura, los conteos de facetas y las cachés de sus productos. Debe
+    llamarse dentro de transaction.atomic().
+    """
+    movimientos = [movimiento for movimiento in movimientos if movimiento.cantidad]
+    if not movimientos:
+        return
+    MovimientoInventario.objects.bulk_create(movimientos, batch_size=1000)
+    deltas = {}
+    for movimiento in movimientos:
+        deltas[movimiento.id_producto_id] = deltas.get(movimiento.id_producto_id, 0) + movimiento.cantidad
+    _existencia_cambiada(deltas)
+
+
+def _existencia_cambiada(deltas):
+    # Los movimientos no disparan las señales de Producto. El estado se lee
+    # dentro de la transacción, para que cada cambio compare el suyo
+    estados = list(
+        Producto.objects.filter(pk__in=deltas).con_existencia()
+        .values_list('pk', 'id_categoria_id', 'id_marca_id', 'activo', 'existencia')
+    )
+    catalogo.actualizar_despues(deltas, lambda: _existencia_actualizada(estados, deltas))
+
+
+def _existencia_actualizada(estados, deltas):
+    for id_producto, *actual in estados:
+        actual = tuple(actual)
+        anterior = actual[:3] + (actual[3] - deltas[id_producto],)
+        facetas.indice.actualizar(anterior, actual)
+        if (anterior[3] > 0) == (actual[3] > 0):
+            # No entró ni salió de "con stock": sólo cambian las entradas que
+            # lo muestran
+            resultados.cache.invalidar(id_producto, None, None)
+        else:
+            resultados.cache.invalidar(id_producto, anterior, actual)
+    ids = sorted(deltas)
+    for inicio in range(0, len(ids), 1000):
+        cache_paginas.purgar(*(f'producto:{id_producto}' for id_producto in ids[inicio:inicio + 1000]))
+
+
+def bloquear(ids):
+    """
+    Bloquea hasta el final de la transacción las filas de los productos `ids`
+    (en orden, para que dos transacciones no se esperen entre sí), sin
+    escribirlas. En SQLite no hace nada: la transacción ya tiene el único
+    bloqueo de escritura.
+    """
+    if connection.features.has_select_for_update:
+        list(Producto.objects.select_for_update().filter(pk__in=ids).order_by('pk').values_list('pk', flat=True))
+
+
+def descontar(cantidades, pedido=None):
+    """
+    Registra la venta de {id_producto: cantidad} de productos activos, o lanza
+    StockInsuficiente. Las unidades apartadas en carritos no se pueden vender
+    (las del comprador se quitan antes con pedidos.reservas.tomar()). Debe
+    llamarse dentro de transaction.atomic() para que el error deshaga también
+    lo demás.
+    """
+    if not cantidades:
+        return
+    ids = sorted(cantidades)
+    bloquear(ids)
+    cantidad = 'CASE p.id_producto ' + ' '.join(['WHEN %s THEN %s'] * len(ids)) + ' END'
+    casos = [valor for id_producto in ids for valor in (id_producto, cantidades[id_producto])]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {_TABLA} (id_producto_id, tipo, cantidad, id_pedido_id, fecha, compactado) "
+            f"SELECT p.id_producto, 'venta', -({cantidad}), %s, %s, %s FROM {Producto._meta.db_table} p "
+            f"WHERE p.id_producto IN ({', '.join(['%s'] * len(ids))}) AND p.activo "
+            f"AND {catalogo.EXISTENCIA} - {catalogo.RESERVADO} >= {cantidad} "
+            "RETURNING id_producto_id",
+            [
+                *casos, pedido.pk if pedido else None,
+                connection.ops.adapt_datetimefield_value(timezone.now()), False, *ids, *casos,
+            ]
+        )
+        vendidos = {fila[0] for fila in cursor.fetchall()}
+    faltantes = [id_producto for id_producto in ids if id_producto not in vendidos]
+    if faltantes:
+        fila = (
+            Producto.objects.filter(pk=faltantes[0]).con_existencia()
+            .values_list('nombre', 'existencia', 'reservado', 'activo').first()
+        )
+        if fila is None:
+            raise StockInsuficiente(None, 'Un producto', 0)
+        nombre, existencia, reservado, activo = fila
+        raise StockInsuficiente(faltantes[0], nombre, max(existencia - reservado, 0) if activo else 0)
+    _existencia_cambiada({id_producto: -cantidad for id_producto, cantidad in cantidades.items()})
+
+
+def compactar(lote=1000):
+    """
+    Suma los movimientos pendientes a Producto.stock y los marca como
+    compactados, de `lote` en `lote` movimientos, cada lote en su propia
+    transacción. El stock real no cambia, así que no se vence ninguna caché.
+    Regresa cuántos movimientos compactó.
+    """
+    compactados = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                MovimientoInventario.objects.select_for_update(skip_locked=True)
+                .filter(compactado=False).order_by('id_movimiento')
+                .values_list('pk', flat=True)[:lote]
+            )
+            if not ids:
+                break
+            movimientos = MovimientoInventario.objects.filter(pk__in=ids)
+            sumas = dict(
+                movimientos.values('id_producto').annotate(total=Sum('cantidad'))
+                .order_by().values_list('id_producto', 'total')
+            )
+            Producto.objects.filter(pk__in=sumas).update(stock=Case(
+                *(When(pk=id_producto, then=F('stock') + total) for id_producto, total in sumas.items()),
+                default=F('stock')
+            ))
+            movimientos.update(compactado=True)
+        compactados += len(ids)
+        if len(ids) < lote:
+            break
+    return compactados
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from productos import comprados_juntos
+
+
+class Command(BaseCommand):
+    help = (
+        'Actualiza los productos "comprados juntos frecuentemente" con los pedidos '
+        'nuevos desde la última corrida'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--completo', action='store_true',
+            help='Vuelve a contar todos los pedidos (descuenta los que se cancelaron después)'
+        )
+        parser.add_argument('--lote', type=int, default=50000, help='Pedidos por transacción (50000)')
+        parser.add_argument(
+            '--top', type=int, default=comprados_juntos.TOP,
+            help=f'Relacionados que se guardan por producto ({comprados_juntos.TOP})'
+        )
+
+    def handle(self, *args, **options):
+        if options['lote'] < 1 or options['top'] < 1:
+            raise CommandError('--lote y --top deben ser mayores que cero')
+        desde = 0 if options['completo'] else comprados_juntos.ultimo_pedido()
+        inicio = time.monotonic()
+        productos = comprados_juntos.actualizar(options['completo'], options['lote'], options['top'])
+        hasta = comprados_juntos.ultimo_pedido()
+        self.stdout.write(self.style.SUCCESS(
+            f'Pedidos {desde + 1} a {hasta}: {productos} productos actualizados '
+            f'en {time.monotonic() - inicio:.1f} s'
+            if hasta > desde else 'No hay pedidos nuevos'
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from productos import inventario
+
+
+class Command(BaseCommand):
+    help = (
+        'Suma los movimientos de inventario pendientes al stock de cada producto '
+        '(conviene programarlo cada pocos minutos)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Movimientos que se compactan por transacción')
+
+    def handle(self, *args, **options):
+        if options['lote'] < 1:
+            raise CommandError('--lote debe ser mayor que cero')
+        compactados = inventario.compactar(lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(f'{compactados} movimientos compactados'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from PIL import UnidentifiedImageError
+
+from productos import miniaturas
+from productos.models import Producto
+
+
+class Command(BaseCommand):
+    help = 'Genera las miniaturas (WebP y JPEG) que falten de las imágenes de productos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reemplazar', action='store_true',
+            help='Vuelve a generar también las miniaturas que ya existen'
+        )
+
+    def handle(self, *args, **options):
+        nombres = (
+            Producto.objects.exclude(imagen='').exclude(imagen__isnull=True)
+            .values_list('imagen', flat=True).distinct().iterator()
+        )
+        generadas = 0
+        for nombre in nombres:
+            try:
+                generadas += miniaturas.generar(nombre, reemplazar=options['reemplazar'])
+            except (OSError, UnidentifiedImageError) as error:
+                self.stderr.write(f'{nombre}: {error}')
+        self.stdout.write(self.style.SUCCESS(f'{generadas} miniaturas generadas'))
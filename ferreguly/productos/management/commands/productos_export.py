@@ -0,0 +1,49 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand
+
+from productos import intercambio
+from productos.models import Producto
+
+
+class Command(BaseCommand):
+    help = (
+        'Exporta los productos a CSV o JSONL, leyéndolos por bloques para que la '
+        'memoria no crezca con el tamaño del catálogo'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--salida', default='-', help="Archivo de salida ('-' para la salida estándar)")
+        parser.add_argument('--formato', choices=intercambio.FORMATOS, help='Por omisión, según la extensión')
+        parser.add_argument('--lote', type=int, default=2000, help='Filas que se leen por bloque (2000)')
+
+    def handle(self, *args, **options):
+        ruta = options['salida']
+        formato = intercambio.formato_de(ruta, options['formato'])
+        filas = intercambio.exportables(Producto.objects.order_by('id_producto')).iterator(
+            chunk_size=options['lote']
+        )
+        if ruta == '-':
+            self.escribir(self.stdout, formato, filas)
+            return
+        with open(ruta, 'w', newline='', encoding='utf-8') as archivo:
+            total = self.escribir(archivo, formato, filas)
+        self.stderr.write(f'{total} productos exportados a {ruta}')
+
+    def escribir(self, archivo, formato, filas):
+        total = 0
+        if formato == 'csv':
+            escritor = csv.writer(archivo, lineterminator='\n')
+            escritor.writerow(intercambio.COLUMNAS)
+            for fila in filas:
+                id_producto, sku, nombre, descripcion, categoria, marca, precio, stock, activo = fila
+                escritor.writerow((id_producto, sku or '', nombre, descripcion, categoria, marca, precio, stock, int(activo)))
+                total += 1
+        else:
+            for fila in filas:
+                valores = dict(zip(intercambio.COLUMNAS, fila))
+                valores['precio'] = str(valores['precio'])
+                archivo.write(json.dumps(valores, ensure_ascii=False) + '\n')
+                total += 1
+        return total
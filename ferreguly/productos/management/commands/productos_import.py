@@ -0,0 +1,197 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from productos import busqueda, cache_paginas, catalogo, intercambio, referencias
+from productos.models import Categoria, Marca, MovimientoInventario, Producto
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa productos desde un archivo CSV o JSONL; los que ya existen (por sku, '
+        'o por id_producto si no tienen sku) se actualizan. Cada lote se guarda en su '
+        'propia transacción.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help="Archivo CSV o JSONL ('-' para la entrada estándar)")
+        parser.add_argument('--formato', choices=intercambio.FORMATOS, help='Por omisión, según la extensión')
+        parser.add_argument('--lote', type=int, default=1000, help='Filas por transacción (1000)')
+        parser.add_argument(
+            '--crear-faltantes', action='store_true',
+            help='Crea las categorías y marcas que no existan (si no, la fila se rechaza)'
+        )
+
+    def handle(self, *args, **options):
+        if options['lote'] < 1:
+            raise CommandError('--lote debe ser mayor que cero')
+        self.verbosity = options['verbosity']
+        self.crear_faltantes = options['crear_faltantes']
+        # Nombre (sin distinguir mayúsculas) -> id, para no consultar por fila
+        self.categorias = {nombre.casefold(): pk for pk, nombre in Categoria.objects.values_list('pk', 'nombre')}
+        self.marcas = {nombre.casefold(): pk for pk, nombre in Marca.objects.values_list('pk', 'nombre')}
+        self.conteo = dict.fromkeys(('filas', 'nuevos', 'actualizados', 'sin_cambios', 'errores'), 0)
+        # Etiquetas de las páginas guardadas que muestran los productos creados
+        # o actualizados: su detalle y los de su categoría (relacionados)
+        self.etiquetas = set()
+        # Productos creados o cambiados, los únicos que se copian de nuevo al
+        # catálogo y al índice de búsqueda
+        self.tocados = set()
+        self.inicio = time.monotonic()
+
+        ruta = options['archivo']
+        formato = intercambio.formato_de(ruta, options['formato'])
+        archivo = sys.stdin if ruta == '-' else open(ruta, newline='', encoding='utf-8-sig')
+        try:
+            lote = {}
+            for numero, fila in intercambio.leer(archivo, formato):
+                self.conteo['filas'] += 1
+                try:
+                    valores = intercambio.convertir(fila, self.categoria, self.marca)
+                except ValueError as error:
+                    self.rechazar(numero, error)
+                    continue
+                # Si un producto se repite en el lote, gana la última fila
+                lote[valores.get('sku') or ('id', valores['id_producto'])] = (numero, valores)
+                if len(lote) >= options['lote']:
+                    self.guardar(lote)
+                    lote = {}
+            if lote:
+                self.guardar(lote)
+        except ValueError as error:
+            raise CommandError(f'{error} (los lotes anteriores ya se guardaron)')
+        finally:
+            if archivo is not sys.stdin:
+                archivo.close()
+
+        if self.conteo['nuevos'] or self.conteo['actualizados']:
+            self.actualizar_derivados()
+
+        segundos = time.monotonic() - self.inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'{self.conteo["filas"]} filas en {segundos:.1f} s ({self.velocidad()} filas/s): '
+            f'{self.conteo["nuevos"]} nuevos, {self.conteo["actualizados"]} actualizados, '
+            f'{self.conteo["sin_cambios"]} sin cambios, {self.conteo["errores"]} con errores'
+        ))
+
+    def velocidad(self):
+        segundos = time.monotonic() - self.inicio
+        return round(self.conteo['filas'] / segundos) if segundos else self.conteo['filas']
+
+    def rechazar(self, numero, error):
+        self.conteo['errores'] += 1
+        self.stderr.write(f'Línea {numero}: {error}')
+
+    def _resolver(self, modelo, nombres, nombre):
+        if not nombre:
+            raise ValueError(f'falta la {modelo._meta.verbose_name.lower()}')
+        pk = nombres.get(nombre.casefold())
+        if pk is None:
+            if not self.crear_faltantes:
+                raise ValueError(f'no existe la {modelo._meta.verbose_name.lower()} "{nombre}"')
+            if len(nombre) > modelo._meta.get_field('nombre').max_length:
+                raise ValueError(f'el nombre "{nombre}" es demasiado largo')
+            pk = nombres[nombre.casefold()] = modelo.objects.create(nombre=nombre).pk
+        return pk
+
+    def categoria(self, nombre):
+        return self._resolver(Categoria, self.categorias, nombre)
+
+    def marca(self, nombre):
+        return self._resolver(Marca, self.marcas, nombre)
+
+    def guardar(self, lote):
+        filas = list(lote.values())
+        existentes = Producto.objects.con_existencia().in_bulk(
+            [valores['sku'] for _, valores in filas if 'sku' in valores], field_name='sku'
+        )
+        # Las filas sin sku, o con uno que todavía no existe, se buscan por id
+        por_id = Producto.objects.con_existencia().in_bulk([
+            valores['id_producto'] for _, valores in filas
+            if 'id_producto' in valores and valores.get('sku') not in existentes
+        ])
+        ahora = timezone.now()
+        nuevos, cambiados, campos, ajustes = [], [], set(), []
+        for numero, valores in filas:
+            id_producto = valores.pop('id_producto', None)
+            producto = existentes.get(valores.get('sku'))
+            if producto is None and id_producto is not None:
+                producto = por_id.get(id_producto)
+                # Un id sólo identifica al producto si éste no tiene otro sku:
+                # un archivo de otra base con skus nuevos no debe pisar productos
+                if producto is not None and producto.sku and 'sku' in valores:
+                    producto = None
+            if producto is None:
+                if 'sku' not in valores:
+                    self.rechazar(numero, f'no existe el producto {id_producto}')
+                    continue
+                faltantes = [campo for campo in intercambio.REQUERIDOS if campo not in valores]
+                if faltantes:
+                    self.rechazar(numero, f'producto nuevo sin {", ".join(faltantes)}')
+                    continue
+                nuevos.append(Producto(**valores))
+                continue
+
+            # El stock del archivo es el real: la diferencia con la existencia
+            # se registra como un ajuste de inventario
+            stock = valores.pop('stock', producto.existencia)
+            if stock != producto.existencia:
+                ajustes.append(MovimientoInventario(
+                    id_producto=producto, tipo='ajuste', cantidad=stock - producto.existencia, fecha=ahora
+                ))
+            distintos = {campo: valor for campo, valor in valores.items() if getattr(producto, campo) != valor}
+            if stock != producto.existencia or distintos:
+                self.etiquetas.update((f'producto:{producto.pk}', f'categoria:{producto.id_categoria_id}'))
+                self.tocados.add(producto.pk)
+            if not distintos:
+                if stock != producto.existencia:
+                    self.conteo['actualizados'] += 1
+                else:
+                    self.conteo['sin_cambios'] += 1
+                continue
+            for campo, valor in distintos.items():
+                setattr(producto, campo, valor)
+            # bulk_update() no actualiza los campos auto_now
+            producto.fecha_actualizacion = ahora
+            campos.update(distintos)
+            cambiados.append(producto)
+
+        with transaction.atomic():
+            Producto.objects.bulk_create(nuevos)
+            if cambiados:
+                Producto.objects.bulk_update(cambiados, [*campos, 'fecha_actualizacion'])
+            MovimientoInventario.objects.bulk_create(ajustes)
+        for producto in nuevos + cambiados:
+            self.etiquetas.update((f'producto:{producto.pk}', f'categoria:{producto.id_categoria_id}'))
+            self.tocados.add(producto.pk)
+        self.conteo['nuevos'] += len(nuevos)
+        self.conteo['actualizados'] += len(cambiados)
+        if self.verbosity >= 2:
+            self.stdout.write(f'{self.conteo["filas"]} filas ({self.velocidad()} filas/s)')
+
+    def actualizar_derivados(self):
+        """
+        bulk_create() y bulk_update() no disparan las señales de Producto (ni
+        los ajustes de inventario se registran con productos.inventario): se
+        copian de nuevo al catálogo de lectura y al índice de búsqueda sólo los
+        productos creados o actualizados, se avanza la generación de productos
+        (los resultados guardados de cada proceso vencen) y se purgan las
+        páginas guardadas de los listados y de esos productos.
+        Los índices en memoria de otros procesos (facetas, autocompletar,
+        trigramas) se renuevan solos en unos minutos.
+        """
+        ids = sorted(self.tocados)
+        indexar = busqueda.fts_disponible()
+        for inicio in range(0, len(ids), 500):
+            bloque = ids[inicio:inicio + 500]
+            catalogo.actualizar_productos(Producto.objects.filter(pk__in=bloque))
+            if indexar:
+                busqueda.indexar_productos(bloque)
+        referencias.incrementar('producto')
+        etiquetas = sorted(self.etiquetas)
+        cache_paginas.purgar('productos', 'categorias', 'marcas', *etiquetas[:1000])
+        for inicio in range(1000, len(etiquetas), 1000):
+            cache_paginas.purgar(*etiquetas[inicio:inicio + 1000])
@@ -0,0 +1,73 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+
+from productos import miniaturas
+from productos.almacenamiento import imagenes
+from productos.models import ArchivoImagen, Producto
+
+
+class Command(BaseCommand):
+    help = (
+        'Borra las imágenes de productos que ya ningún producto usa (por bajas o '
+        'reemplazos de imagen), junto con sus miniaturas'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--gracia', type=int, default=24,
+            help='Horas que se conserva un archivo sin usar, por si su producto aún no se guarda (24)'
+        )
+        parser.add_argument(
+            '--recontar', action='store_true',
+            help='Vuelve a calcular las referencias a partir de los productos antes de borrar'
+        )
+        parser.add_argument('--simular', action='store_true', help='Sólo muestra lo que se borraría')
+
+    def recontar(self):
+        conteos = dict(
+            Producto.objects.exclude(imagen='').exclude(imagen__isnull=True)
+            .values_list('imagen').annotate(total=Count('id_producto')).order_by()
+        )
+        ArchivoImagen.objects.exclude(nombre__in=conteos).update(referencias=0)
+        ArchivoImagen.objects.bulk_create(
+            [ArchivoImagen(nombre=nombre, referencias=total) for nombre, total in conteos.items()],
+            update_conflicts=True, unique_fields=['nombre'], update_fields=['referencias']
+        )
+
+    def handle(self, *args, **options):
+        if options['recontar'] and not options['simular']:
+            self.recontar()
+
+        directorio = Producto._meta.get_field('imagen').upload_to.rstrip('/')
+        limite = timezone.now() - timedelta(hours=options['gracia'])
+        referencias = dict(ArchivoImagen.objects.filter(referencias__gt=0).values_list('nombre', 'referencias'))
+
+        archivos = set(imagenes.archivos(directorio))
+        borrados = liberados = 0
+        for nombre in sorted(archivos):
+            if miniaturas.es_miniatura(nombre) or nombre in referencias:
+                continue
+            if imagenes.get_modified_time(nombre) > limite:
+                continue
+            # Por si el conteo se desfasó (por ejemplo, con QuerySet.update())
+            if Producto.objects.filter(imagen=nombre).exists():
+                continue
+
+            for archivo in [nombre] + [m for m in miniaturas.miniaturas_de(nombre) if m in archivos]:
+                liberados += imagenes.size(archivo)
+                borrados += 1
+                self.stdout.write(f'{"Se borraría" if options["simular"] else "Borrando"} {archivo}')
+                if not options['simular']:
+                    imagenes.delete(archivo)
+            if not options['simular']:
+                ArchivoImagen.objects.filter(nombre=nombre).delete()
+
+        if not options['simular']:
+            miniaturas.limpiar()
+        self.stdout.write(self.style.SUCCESS(
+            f'{borrados} archivos {"por borrar" if options["simular"] else "borrados"} '
+            f'({liberados / 1024:.1f} KB)'
+        ))
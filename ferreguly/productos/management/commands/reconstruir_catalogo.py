@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from productos import catalogo
+from productos.models import CatalogoItem
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el catálogo de lectura (catalogo_item) a partir de los productos activos'
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        catalogo.reconstruir()
+        self.stdout.write(self.style.SUCCESS(
+            f'Catálogo reconstruido: {CatalogoItem.objects.count()} productos '
+            f'en {time.monotonic() - inicio:.1f} s'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from productos import busqueda
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de búsqueda de texto completo de los productos'
+
+    def handle(self, *args, **options):
+        if not busqueda.fts_disponible():
+            raise CommandError('La base de datos no soporta FTS5; la búsqueda usa icontains.')
+
+        busqueda.reconstruir_indice()
+        self.stdout.write(self.style.SUCCESS('Índice de búsqueda reconstruido correctamente'))
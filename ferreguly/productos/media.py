@@ -0,0 +1,159 @@
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_http_methods
+
+from .almacenamiento import es_por_contenido
+
+# Los archivos guardados por contenido (y sus miniaturas) nunca cambian: el
+# navegador los guarda un año sin volver a preguntar. El resto se revalida con
+# el ETag después de una hora.
+SEGUNDOS_INMUTABLE = 365 * 24 * 60 * 60
+SEGUNDOS_MUTABLE = 60 * 60
+
+_RANGO = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangoNoSatisfacible(Exception):
+    pass
+
+
+class ArchivoAcotado:
+    """
+    Lee sólo `longitud` bytes de un archivo desde su posición actual. Conserva
+    fileno() para que el servidor WSGI (gunicorn, uWSGI) lo envíe con
+    os.sendfile() a través de wsgi.file_wrapper, usando Content-Length como
+    límite; si el servidor no lo hace, Django lo lee por bloques.
+    """
+
+    def __init__(self, archivo, longitud):
+        self.archivo = archivo
+        self.restante = longitud
+
+    def fileno(self):
+        return self.archivo.fileno()
+
+    def read(self, tamano=-1):
+        if tamano is None or tamano < 0 or tamano > self.restante:
+            tamano = self.restante
+        datos = self.archivo.read(tamano)
+        self.restante -= len(datos)
+        return datos
+
+    def close(self):
+        self.archivo.close()
+
+
+def rango(request, tamano, etag, ultima_modificacion):
+    """
+    Rango (inicio, fin) pedido en la cabecera Range, con fin inclusivo. None
+    si hay que enviar el archivo completo: sin Range, con varios rangos, o si
+    If-Range ya no coincide con la versión del archivo.
+    """
+    cabecera = request.META.get('HTTP_RANGE')
+    if not cabecera:
+        return None
+    condicion = request.META.get('HTTP_IF_RANGE')
+    if condicion and condicion != etag and parse_http_date_safe(condicion) != ultima_modificacion:
+        return None
+    coincidencia = _RANGO.match(cabecera.strip())
+    if not coincidencia or coincidencia.groups() == ('', ''):
+        return None
+
+    inicio, fin = coincidencia.groups()
+    if not inicio:
+        # bytes=-500: los últimos 500 bytes
+        sufijo = int(fin)
+        if not sufijo or not tamano:
+            raise RangoNoSatisfacible
+        return max(tamano - sufijo, 0), tamano - 1
+    inicio = int(inicio)
+    fin = min(int(fin), tamano - 1) if fin else tamano - 1
+    if inicio >= tamano:
+        raise RangoNoSatisfacible
+    if fin < inicio:
+        return None
+    return inicio, fin
+
+
+def _delegar(response, nombre, ruta):
+    """
+    Con MEDIA_DESCARGA, el envío del archivo lo hace el proxy de enfrente
+    (nginx con X-Accel-Redirect, Apache o lighttpd con X-Sendfile).
+    """
+    modo = getattr(settings, 'MEDIA_DESCARGA', None)
+    if modo == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = getattr(settings, 'MEDIA_PREFIJO_INTERNO', '/media-interna/') + quote(nombre)
+    elif modo == 'x-sendfile':
+        response['X-Sendfile'] = ruta
+    else:
+        return False
+    return True
+
+
+def servir(request, nombre):
+    """
+    Respuesta con el archivo `nombre` de MEDIA_ROOT: 304 si el cliente ya lo
+    tiene (ETag o fecha), 206 si pide un rango y 200 con el archivo completo.
+    """
+    try:
+        ruta = safe_join(settings.MEDIA_ROOT, nombre)
+        estado = os.stat(ruta)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404('Archivo no encontrado')
+    if not stat.S_ISREG(estado.st_mode):
+        raise Http404('Archivo no encontrado')
+
+    etag = quote_etag(f'{estado.st_mtime_ns:x}-{estado.st_size:x}')
+    ultima_modificacion = int(estado.st_mtime)
+    tipo = mimetypes.guess_type(ruta)[0] or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=ultima_modificacion)
+    if response is None:
+        response = HttpResponse(content_type=tipo)
+        if not _delegar(response, nombre, ruta):
+            response = _contenido(request, ruta, tipo, estado.st_size, etag, ultima_modificacion)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(ultima_modificacion)
+    response['Accept-Ranges'] = 'bytes'
+    if es_por_contenido(nombre):
+        patch_cache_control(response, public=True, max_age=SEGUNDOS_INMUTABLE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=SEGUNDOS_MUTABLE)
+    return response
+
+
+def _contenido(request, ruta, tipo, tamano, etag, ultima_modificacion):
+    try:
+        pedido = rango(request, tamano, etag, ultima_modificacion)
+    except RangoNoSatisfacible:
+        response = HttpResponse(status=416, content_type=tipo)
+        response['Content-Range'] = f'bytes */{tamano}'
+        return response
+
+    archivo = open(ruta, 'rb')
+    if pedido is None:
+        return FileResponse(archivo, content_type=tipo)
+
+    inicio, fin = pedido
+    archivo.seek(inicio)
+    response = FileResponse(ArchivoAcotado(archivo, fin - inicio + 1), status=206, content_type=tipo)
+    response['Content-Length'] = fin - inicio + 1
+    response['Content-Range'] = f'bytes {inicio}-{fin}/{tamano}'
+    return response
+
+
+@require_http_methods(['GET', 'HEAD'])
+def servir_media(request, nombre):
+    """Archivos subidos (imágenes de productos y sus miniaturas)."""
+    return servir(request, nombre)
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Categoria',
+            fields=[
+                ('id_categoria', models.AutoField(primary_key=True, serialize=False)),
+                ('nombre', models.CharField(max_length=35)),
+                ('descripcion', models.TextField(blank=True, null=True)),
+                ('activo', models.BooleanField(default=True)),
+            ],
+            options={
+                'verbose_name': 'Categoría',
+                'verbose_name_plural': 'Categorías',
+                'db_table': 'categoria',
+            },
+        ),
+        migrations.CreateModel(
+            name='Marca',
+            fields=[
+                ('id_marca', models.AutoField(primary_key=True, serialize=False)),
+                ('nombre', models.CharField(max_length=35)),
+                ('activo', models.BooleanField(default=True)),
+            ],
+            options={
+                'verbose_name': 'Marca',
+                'verbose_name_plural': 'Marcas',
+                'db_table': 'marca',
+            },
+        ),
+        migrations.CreateModel(
+            name='Producto',
+            fields=[
+                ('id_producto', models.AutoField(primary_key=True, serialize=False)),
+                ('nombre', models.CharField(max_length=100)),
+                ('descripcion', models.TextField()),
+                ('precio', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('stock', models.IntegerField(default=0)),
+                ('imagen', models.ImageField(blank=True, max_length=200, null=True, upload_to='productos/')),
+                ('activo', models.BooleanField(default=True)),
+                ('fecha_creacion', models.DateTimeField(default=django.utils.timezone.now)),
+                ('id_categoria', models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='productos', to='productos.categoria')),
+                ('id_marca', models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='productos', to='productos.marca')),
+            ],
+            options={
+                'verbose_name': 'Producto',
+                'verbose_name_plural': 'Productos',
+                'db_table': 'producto',
+                'indexes': [models.Index(fields=['id_categoria'], name='idx_producto_categoria'), models.Index(fields=['id_marca'], name='idx_producto_marca')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0002_producto_indices_paginacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Generacion',
+            fields=[
+                ('clave', models.CharField(max_length=30, primary_key=True, serialize=False)),
+                ('valor', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Generación',
+                'verbose_name_plural': 'Generaciones',
+                'db_table': 'generacion',
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:08
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0003_generacion'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='producto',
+            name='idx_producto_categoria',
+        ),
+        migrations.AddField(
+            model_name='generacion',
+            name='fecha',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='fecha_actualizacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['id_categoria', 'fecha_actualizacion'], name='idx_producto_cat_actualizacion'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['fecha_actualizacion'], name='idx_producto_actualizacion'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:09
+
+from django.db import migrations, models
+import django.utils.timezone
+import productos.almacenamiento
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0004_producto_fecha_actualizacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivoImagen',
+            fields=[
+                ('nombre', models.CharField(max_length=200, primary_key=True, serialize=False)),
+                ('referencias', models.IntegerField(default=0)),
+                ('fecha_creacion', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Archivo de imagen',
+                'verbose_name_plural': 'Archivos de imagen',
+                'db_table': 'archivo_imagen',
+            },
+        ),
+        migrations.AlterField(
+            model_name='producto',
+            name='imagen',
+            field=models.ImageField(blank=True, max_length=200, null=True, storage=productos.almacenamiento.AlmacenamientoContenido(), upload_to='productos/'),
+        ),
+    ]
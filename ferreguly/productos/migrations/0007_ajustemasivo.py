@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('productos', '0006_producto_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AjusteMasivo',
+            fields=[
+                ('id_ajuste', models.AutoField(primary_key=True, serialize=False)),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+                ('busqueda', models.CharField(blank=True, max_length=100)),
+                ('tipo_precio', models.CharField(blank=True, choices=[('porcentaje', 'Porcentaje'), ('monto', 'Monto fijo')], max_length=10)),
+                ('valor_precio', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('delta_stock', models.IntegerField(default=0)),
+                ('productos_afectados', models.IntegerField()),
+                ('id_categoria', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='productos.categoria')),
+                ('id_marca', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='productos.marca')),
+                ('id_usuario', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ajustes_masivos', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Ajuste masivo',
+                'verbose_name_plural': 'Ajustes masivos',
+                'db_table': 'ajuste_masivo',
+            },
+        ),
+    ]
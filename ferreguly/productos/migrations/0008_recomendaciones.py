@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0007_ajustemasivo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductoRelacionado',
+            fields=[
+                ('id_producto_relacionado', models.AutoField(primary_key=True, serialize=False)),
+                ('posicion', models.SmallIntegerField()),
+                ('veces', models.IntegerField()),
+                ('id_producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='comprados_juntos', to='productos.producto')),
+                ('id_relacionado', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='comprado_con', to='productos.producto')),
+            ],
+            options={
+                'verbose_name': 'Producto comprado junto',
+                'verbose_name_plural': 'Productos comprados juntos',
+                'db_table': 'producto_relacionado',
+                'unique_together': {('id_producto', 'posicion')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CoocurrenciaProducto',
+            fields=[
+                ('id_coocurrencia', models.AutoField(primary_key=True, serialize=False)),
+                ('veces', models.IntegerField(default=0)),
+                ('id_producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='productos.producto')),
+                ('id_relacionado', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='productos.producto')),
+            ],
+            options={
+                'verbose_name': 'Coocurrencia de productos',
+                'verbose_name_plural': 'Coocurrencias de productos',
+                'db_table': 'coocurrencia_producto',
+                'unique_together': {('id_producto', 'id_relacionado')},
+            },
+        ),
+    ]
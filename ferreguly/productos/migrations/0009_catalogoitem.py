@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+import productos.almacenamiento
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0008_recomendaciones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogoItem',
+            fields=[
+                ('id_producto', models.IntegerField(primary_key=True, serialize=False)),
+                ('nombre', models.CharField(max_length=100)),
+                ('descripcion', models.TextField()),
+                ('descripcion_corta', models.CharField(max_length=81)),
+                ('precio', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('rango_precio', models.SmallIntegerField()),
+                ('stock', models.IntegerField()),
+                ('en_stock', models.BooleanField()),
+                ('imagen', models.ImageField(blank=True, max_length=200, null=True, storage=productos.almacenamiento.AlmacenamientoContenido(), upload_to='productos/')),
+                ('miniatura', models.CharField(blank=True, max_length=300)),
+                ('categoria_nombre', models.CharField(max_length=35)),
+                ('categoria_activa', models.BooleanField()),
+                ('marca_nombre', models.CharField(max_length=35)),
+                ('marca_activa', models.BooleanField()),
+                ('fecha_creacion', models.DateTimeField()),
+                ('fecha_actualizacion', models.DateTimeField()),
+                ('id_categoria', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='productos.categoria')),
+                ('id_marca', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='productos.marca')),
+            ],
+            options={
+                'verbose_name': 'Producto del catálogo',
+                'verbose_name_plural': 'Productos del catálogo',
+                'db_table': 'catalogo_item',
+                'indexes': [models.Index(fields=['fecha_creacion', 'id_producto'], name='idx_catalogo_fecha'), models.Index(fields=['precio', 'id_producto'], name='idx_catalogo_precio'), models.Index(fields=['id_categoria', 'fecha_creacion', 'id_producto'], name='idx_catalogo_categoria'), models.Index(fields=['id_marca', 'fecha_creacion', 'id_producto'], name='idx_catalogo_marca')],
+            },
+        ),
+    ]
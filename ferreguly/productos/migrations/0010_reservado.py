@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0009_catalogoitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogoitem',
+            name='reservado',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='reservado',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0004_reserva'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('productos', '0010_reservado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimientoInventario',
+            fields=[
+                ('id_movimiento', models.BigAutoField(primary_key=True, serialize=False)),
+                ('tipo', models.CharField(choices=[('venta', 'Venta'), ('reabasto', 'Reabasto'), ('ajuste', 'Ajuste'), ('cancelacion', 'Cancelación')], max_length=12)),
+                ('cantidad', models.IntegerField()),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+                ('compactado', models.BooleanField(default=False)),
+            ],
+            options={
+                'verbose_name': 'Movimiento de inventario',
+                'verbose_name_plural': 'Movimientos de inventario',
+                'db_table': 'movimiento_inventario',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='catalogoitem',
+            index=models.Index(fields=['fecha_actualizacion'], name='idx_catalogo_actualizacion'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogoitem',
+            index=models.Index(fields=['id_categoria', 'fecha_actualizacion'], name='idx_catalogo_cat_actualizacion'),
+        ),
+        migrations.AddField(
+            model_name='movimientoinventario',
+            name='id_pedido',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos_inventario', to='pedidos.pedido'),
+        ),
+        migrations.AddField(
+            model_name='movimientoinventario',
+            name='id_producto',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimientos', to='productos.producto'),
+        ),
+        migrations.AddField(
+            model_name='movimientoinventario',
+            name='id_usuario',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='movimientoinventario',
+            index=models.Index(condition=models.Q(('compactado', False)), fields=['id_producto'], name='idx_movimiento_pendiente'),
+        ),
+        migrations.AddIndex(
+            model_name='movimientoinventario',
+            index=models.Index(fields=['id_producto', 'fecha'], name='idx_movimiento_producto'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:19
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0011_movimientoinventario'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='producto',
+            name='reservado',
+        ),
+    ]
@@ -0,0 +1,188 @@
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.urls import reverse
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .almacenamiento import imagenes
+
+logger = logging.getLogger(__name__)
+
+# Anchos (en px) de las miniaturas: carrito, inicio y relacionados, tarjetas del
+# catálogo y detalle. Cada imagen se escala para caber en un cuadro de ese lado.
+TAMANOS = (80, 150, 200, 600)
+
+# Formato -> (formato de Pillow, extensión, tipo MIME, opciones)
+FORMATOS = {
+    'webp': ('WEBP', 'webp', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+_lock = threading.Lock()
+_pool = None
+_en_proceso = {}
+# Imágenes de las que ya se sabe que existen todas las miniaturas, para no
+# revisar el almacenamiento en cada página
+_completas = set()
+
+
+def nombre_miniatura(nombre, tamano, formato):
+    """Nombre de la miniatura, junto al original: productos/foto.png -> productos/foto_200w.webp."""
+    base, _ = os.path.splitext(nombre)
+    return f'{base}_{tamano}w.{FORMATOS[formato][1]}'
+
+
+_NOMBRE_MINIATURA = re.compile(
+    r'_(?:%s)w\.(?:%s)$' % ('|'.join(map(str, TAMANOS)), '|'.join(ext for _, ext, _, _ in FORMATOS.values()))
+)
+
+
+def es_miniatura(nombre):
+    return bool(_NOMBRE_MINIATURA.search(nombre))
+
+
+def miniaturas_de(nombre):
+    """Nombres de todas las miniaturas posibles de una imagen."""
+    return [nombre_miniatura(nombre, tamano, formato) for tamano in TAMANOS for formato in FORMATOS]
+
+
+def _ultima(nombre):
+    # generar() escribe las miniaturas en el orden de TAMANOS y FORMATOS: si
+    # existe la última, existen todas
+    return nombre_miniatura(nombre, TAMANOS[-1], tuple(FORMATOS)[-1])
+
+
+def completas(nombre):
+    """True si ya existen todas las miniaturas de la imagen; revisa un solo archivo."""
+    if nombre in _completas:
+        return True
+    if imagenes.exists(_ultima(nombre)):
+        _completas.add(nombre)
+        return True
+    return False
+
+
+def _abrir(nombre):
+    with imagenes.open(nombre, 'rb') as archivo:
+        imagen = Image.open(archivo)
+        imagen.load()
+    return ImageOps.exif_transpose(imagen)
+
+
+def _codificar(imagen, tamano, formato):
+    formato_pillow, _, _, opciones = FORMATOS[formato]
+    imagen = imagen.copy()
+    imagen.thumbnail((tamano, tamano), Image.LANCZOS)
+    if formato == 'jpeg':
+        # JPEG no tiene transparencia: se pone sobre fondo blanco
+        imagen = imagen.convert('RGBA')
+        fondo = Image.new('RGB', imagen.size, (255, 255, 255))
+        fondo.paste(imagen, mask=imagen.getchannel('A'))
+        imagen = fondo
+    elif imagen.mode not in ('RGB', 'RGBA'):
+        imagen = imagen.convert('RGBA')
+    salida = BytesIO()
+    imagen.save(salida, formato_pillow, **opciones)
+    return salida.getvalue()
+
+
+def generar(nombre, tamanos=TAMANOS, formatos=tuple(FORMATOS), reemplazar=False):
+    """
+    Genera las miniaturas de una imagen que todavía no existen (o todas, con
+    `reemplazar`). Regresa cuántas se generaron.
+    """
+    pendientes = [
+        (tamano, formato) for tamano in tamanos for formato in formatos
+        if reemplazar or not imagenes.exists(nombre_miniatura(nombre, tamano, formato))
+    ]
+    if not pendientes:
+        return 0
+
+    imagen = _abrir(nombre)
+    for tamano, formato in pendientes:
+        imagenes.guardar_derivado(nombre_miniatura(nombre, tamano, formato), _codificar(imagen, tamano, formato))
+    return len(pendientes)
+
+
+def _generar_una_vez(nombre, **kwargs):
+    """Evita que dos hilos generen a la vez las miniaturas de la misma imagen."""
+    with _lock:
+        evento = _en_proceso.get(nombre)
+        propio = evento is None
+        if propio:
+            evento = _en_proceso[nombre] = threading.Event()
+    if not propio:
+        evento.wait()
+        return 0
+    try:
+        return generar(nombre, **kwargs)
+    finally:
+        with _lock:
+            _en_proceso.pop(nombre).set()
+
+
+def _en_segundo_plano(nombre):
+    try:
+        _generar_una_vez(nombre)
+    except (OSError, UnidentifiedImageError):
+        logger.exception('No se pudieron generar las miniaturas de %s', nombre)
+
+
+def programar(nombre):
+    """Genera las miniaturas en el grupo de hilos (Pillow libera el GIL al escalar y codificar)."""
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'MINIATURAS_HILOS', 2), thread_name_prefix='miniaturas'
+            )
+    return _pool.submit(_en_segundo_plano, nombre)
+
+
+def obtener(nombre, tamano, formato):
+    """
+    Nombre de la miniatura, generándola en este momento si no existe. Es el
+    camino de las miniaturas que se piden antes de que el grupo las genere.
+    """
+    destino = nombre_miniatura(nombre, tamano, formato)
+    if not imagenes.exists(destino):
+        _generar_una_vez(nombre)
+        if not imagenes.exists(destino):
+            # Otro hilo las estaba generando; se generan las que falten, en
+            # orden, para que _ultima() siga indicando que están todas
+            _generar_una_vez(nombre)
+    return destino
+
+
+def limpiar():
+    """Olvida qué miniaturas existen (por ejemplo, después de borrar archivos)."""
+    _completas.clear()
+
+
+def urls(nombre, tamanos=TAMANOS, formatos=tuple(FORMATOS)):
+    """
+    {(tamaño, formato): URL} de las miniaturas de una imagen: la del archivo si
+    ya existen, o la de la vista que las genera al primer uso (y mientras tanto
+    se programa su generación).
+    """
+    if completas(nombre):
+        return {
+            (tamano, formato): imagenes.url(nombre_miniatura(nombre, tamano, formato))
+            for tamano in tamanos for formato in formatos
+        }
+    if nombre not in _en_proceso:
+        programar(nombre)
+    return {
+        (tamano, formato): reverse('miniatura', args=[tamano, formato, nombre])
+        for tamano in tamanos for formato in formatos
+    }
+
+
+def url(nombre, tamano, formato):
+    """URL de una sola miniatura (ver urls())."""
+    return urls(nombre, (tamano,), (formato,))[tamano, formato]
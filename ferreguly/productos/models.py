@@ -1,6 +1,12 @@
-from django.db import models
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, Now, Substr
 from django.utils import timezone
 
+from .almacenamiento import imagenes
+
 class Categoria(models.Model):
     id_categoria = models.AutoField(primary_key=True)
     nombre = models.CharField(max_length=35)
@@ -28,26 +34,352 @@ class Marca(models.Model):
         verbose_name = 'Marca'
         verbose_name_plural = 'Marcas'
 
+class ProductoQuerySet(models.QuerySet):
+    # Columnas que usan las tarjetas de producto en catálogo, inicio y listas
+    CAMPOS_TARJETA = (
+        'id_producto', 'nombre', 'precio', 'stock', 'imagen', 'activo', 'fecha_creacion',
+        'id_categoria__id_categoria', 'id_categoria__nombre',
+        'id_marca__id_marca', 'id_marca__nombre',
+    )
+    
+    # Las tarjetas muestran la descripción truncada a 80 caracteres; con 81 el
+    # filtro truncatechars produce el mismo resultado que con el texto completo
+    LARGO_DESCRIPCION_CORTA = 81
+    
+    def tarjetas(self):
+        """
+        Productos listos para mostrarse en tarjetas: une categoría y marca,
+        carga sólo las columnas necesarias y trae la descripción ya recortada
+        en `descripcion_corta`.
+        """
+        return (
+            self.select_related('id_categoria', 'id_marca')
+            .only(*self.CAMPOS_TARJETA)
+            .annotate(descripcion_corta=Substr('descripcion', 1, self.LARGO_DESCRIPCION_CORTA))
+        )
+    
+    def con_existencia(self):
+        """
+        Agrega `pendiente`, la suma de los movimientos de inventario que
+        todavía no se compactan (por el índice parcial de los pendientes),
+        `existencia`, el stock real (stock + pendiente), y `reservado`, las
+        unidades apartadas en carritos.
+        """
+        return (
+            self.annotate(pendiente=pendiente_inventario('pk'), reservado=reservado_carritos('pk'))
+            .annotate(existencia=F('stock') + F('pendiente'))
+        )
+
+
+def pendiente_inventario(producto):
+    """
+    Suma de los movimientos sin compactar del producto `producto` (nombre del
+    campo de la consulta externa con su id), para sumarla al stock.
+    """
+    return Coalesce(Subquery(
+        MovimientoInventario.objects.filter(id_producto=OuterRef(producto), compactado=False)
+        .order_by().values('id_producto').annotate(total=Sum('cantidad')).values('total')
+    ), 0)
+
+
+def reservado_carritos(producto):
+    """
+    Suma de las reservas de stock vigentes (pedidos.Reserva) del producto
+    `producto` (nombre del campo de la consulta externa con su id).
+    """
+    Reserva = apps.get_model('pedidos', 'Reserva')
+    return Coalesce(Subquery(
+        Reserva.objects.filter(id_producto=OuterRef(producto), expira__gt=Now())
+        .order_by().values('id_producto').annotate(total=Sum('cantidad')).values('total')
+    ), 0)
+
 class Producto(models.Model):
     id_producto = models.AutoField(primary_key=True)
+    # Clave del proveedor; productos_import la usa para actualizar en lugar de duplicar
+    sku = models.CharField(max_length=50, unique=True, null=True, blank=True)
     nombre = models.CharField(max_length=100)
     descripcion = models.TextField()
     id_categoria = models.ForeignKey(Categoria, on_delete=models.RESTRICT, related_name='productos')
     id_marca = models.ForeignKey(Marca, on_delete=models.RESTRICT, related_name='productos')
     precio = models.DecimalField(max_digits=10, decimal_places=2)
+    # Saldo del inventario hasta el último movimiento compactado; el stock
+    # real también suma los movimientos pendientes (ver productos/inventario.py)
     stock = models.IntegerField(default=0)
-    imagen = models.ImageField(upload_to='productos/', max_length=200, null=True, blank=True)
+    imagen = models.ImageField(upload_to='productos/', storage=imagenes, max_length=200, null=True, blank=True)
     activo = models.BooleanField(default=True)
     fecha_creacion = models.DateTimeField(default=timezone.now)
+    # Las actualizaciones con QuerySet.update() deben asignarla explícitamente
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    
+    objects = ProductoQuerySet.as_manager()
     
     def __str__(self):
         return self.nombre
     
+    @property
+    def disponible(self):
+        """
+        Stock que todavía no está apartado en ningún carrito. Sólo incluye los
+        movimientos de inventario pendientes y las reservas si se cargó con
+        con_existencia().
+        """
+        return max(getattr(self, 'existencia', self.stock) - getattr(self, 'reservado', 0), 0)
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._stock_cargado = instancia.__dict__.get('stock')
+        # Valores tal como se leyeron, para que la señal pre_save conozca el
+        # estado anterior sin volver a leer la fila
+        instancia._cargado = dict(zip(field_names, values))
+        return instancia
+    
+    def save(self, *args, **kwargs):
+        # Una copia cargada antes de que se compactara el inventario no debe
+        # pisar el saldo: stock sólo se guarda si se cambió en esta copia
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            excluidos = set(self.get_deferred_fields())
+            if 'stock' not in excluidos and self.stock == getattr(self, '_stock_cargado', None):
+                excluidos.add('stock')
+            kwargs['update_fields'] = [
+                campo.name for campo in self._meta.concrete_fields
+                if not campo.primary_key and campo.attname not in excluidos and campo.name not in excluidos
+            ]
+        super().save(*args, **kwargs)
+        self._stock_cargado = self.__dict__.get('stock')
+        self._cargado = None
+    
     class Meta:
         db_table = 'producto'
         verbose_name = 'Producto'
         verbose_name_plural = 'Productos'
         indexes = [
-            models.Index(fields=['id_categoria'], name='idx_producto_categoria'),
+            models.Index(fields=['id_categoria', 'fecha_actualizacion'], name='idx_producto_cat_actualizacion'),
             models.Index(fields=['id_marca'], name='idx_producto_marca'),
-        ]
\ No newline at end of file
+            models.Index(fields=['fecha_creacion', 'id_producto'], name='idx_producto_fecha'),
+            models.Index(fields=['precio', 'id_producto'], name='idx_producto_precio'),
+            models.Index(fields=['fecha_actualizacion'], name='idx_producto_actualizacion'),
+        ]
+
+class Generacion(models.Model):
+    """
+    Contador por tipo de dato de referencia (categorías, marcas). Cada cambio
+    lo incrementa y así todos los procesos saben que su copia en memoria ya no
+    es válida. La fecha del último cambio sirve para Last-Modified.
+    """
+    clave = models.CharField(max_length=30, primary_key=True)
+    valor = models.BigIntegerField(default=0)
+    fecha = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.clave}: {self.valor}"
+    
+    class Meta:
+        db_table = 'generacion'
+        verbose_name = 'Generación'
+        verbose_name_plural = 'Generaciones'
+
+class ArchivoImagenQuerySet(models.QuerySet):
+    def sumar(self, nombre, cantidad):
+        """Suma (o resta) referencias al archivo `nombre`."""
+        if not nombre:
+            return
+        actualizados = self.filter(nombre=nombre).update(referencias=F('referencias') + cantidad)
+        if not actualizados and cantidad > 0:
+            try:
+                with transaction.atomic():
+                    self.create(nombre=nombre, referencias=cantidad)
+            except IntegrityError:
+                self.filter(nombre=nombre).update(referencias=F('referencias') + cantidad)
+
+class ArchivoImagen(models.Model):
+    """
+    Archivo del almacenamiento de imágenes (uno por contenido) y cuántos
+    productos lo usan. Los que quedan en cero los borra recolectar_imagenes.
+    """
+    nombre = models.CharField(max_length=200, primary_key=True)
+    referencias = models.IntegerField(default=0)
+    fecha_creacion = models.DateTimeField(default=timezone.now)
+    
+    objects = ArchivoImagenQuerySet.as_manager()
+    
+    def __str__(self):
+        return f"{self.nombre} ({self.referencias})"
+    
+    class Meta:
+        db_table = 'archivo_imagen'
+        verbose_name = 'Archivo de imagen'
+        verbose_name_plural = 'Archivos de imagen'
+
+class AjusteMasivo(models.Model):
+    """
+    Registro de cada ajuste masivo de precios o stock: quién lo hizo, a qué
+    productos (filtros) y cuántos cambiaron.
+    """
+    TIPOS_PRECIO = [
+        ('porcentaje', 'Porcentaje'),
+        ('monto', 'Monto fijo'),
+    ]
+    
+    id_ajuste = models.AutoField(primary_key=True)
+    id_usuario = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, related_name='ajustes_masivos', null=True
+    )
+    fecha = models.DateTimeField(default=timezone.now)
+    id_categoria = models.ForeignKey(Categoria, on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    id_marca = models.ForeignKey(Marca, on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    busqueda = models.CharField(max_length=100, blank=True)
+    tipo_precio = models.CharField(max_length=10, choices=TIPOS_PRECIO, blank=True)
+    valor_precio = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    delta_stock = models.IntegerField(default=0)
+    productos_afectados = models.IntegerField()
+    
+    def __str__(self):
+        return f"Ajuste #{self.id_ajuste} ({self.productos_afectados} productos)"
+    
+    class Meta:
+        db_table = 'ajuste_masivo'
+        verbose_name = 'Ajuste masivo'
+        verbose_name_plural = 'Ajustes masivos'
+
+class MovimientoInventario(models.Model):
+    """
+    Libro de movimientos de inventario: cada venta, reabasto, ajuste o
+    cancelación se registra insertando una fila, sin escribir en el producto.
+    compactar_inventario suma los movimientos pendientes a Producto.stock y
+    los marca como compactados; el stock real es Producto.stock más los
+    pendientes (ProductoQuerySet.con_existencia()).
+    """
+    TIPOS = [
+        ('venta', 'Venta'),
+        ('reabasto', 'Reabasto'),
+        ('ajuste', 'Ajuste'),
+        ('cancelacion', 'Cancelación'),
+    ]
+    
+    id_movimiento = models.BigAutoField(primary_key=True)
+    id_producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='movimientos')
+    tipo = models.CharField(max_length=12, choices=TIPOS)
+    # Unidades que entran (positivo) o salen (negativo)
+    cantidad = models.IntegerField()
+    id_pedido = models.ForeignKey(
+        'pedidos.Pedido', on_delete=models.SET_NULL, related_name='movimientos_inventario', null=True, blank=True
+    )
+    id_usuario = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, related_name='+', null=True, blank=True
+    )
+    fecha = models.DateTimeField(default=timezone.now)
+    compactado = models.BooleanField(default=False)
+    
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.cantidad:+d} - {self.id_producto_id}"
+    
+    class Meta:
+        db_table = 'movimiento_inventario'
+        verbose_name = 'Movimiento de inventario'
+        verbose_name_plural = 'Movimientos de inventario'
+        indexes = [
+            # Sólo los pendientes, que son pocos: la suma por producto es barata
+            models.Index(fields=['id_producto'], name='idx_movimiento_pendiente', condition=Q(compactado=False)),
+            models.Index(fields=['id_producto', 'fecha'], name='idx_movimiento_producto'),
+        ]
+
+class CoocurrenciaProducto(models.Model):
+    """
+    Cuántos pedidos incluyen a la vez `id_producto` e `id_relacionado` (cada
+    par se guarda en los dos sentidos). La llena comprados_juntos.py.
+    """
+    id_coocurrencia = models.AutoField(primary_key=True)
+    id_producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='+')
+    id_relacionado = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='+')
+    veces = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.id_producto_id} + {self.id_relacionado_id}: {self.veces}"
+    
+    class Meta:
+        db_table = 'coocurrencia_producto'
+        verbose_name = 'Coocurrencia de productos'
+        verbose_name_plural = 'Coocurrencias de productos'
+        unique_together = ('id_producto', 'id_relacionado')
+
+class ProductoRelacionado(models.Model):
+    """
+    Los productos que más se compran junto con `id_producto`, en orden
+    (posicion 1 es el más frecuente). Se leen con el índice (id_producto,
+    posicion).
+    """
+    id_producto_relacionado = models.AutoField(primary_key=True)
+    id_producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='comprados_juntos')
+    id_relacionado = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='comprado_con')
+    posicion = models.SmallIntegerField()
+    veces = models.IntegerField()
+    
+    def __str__(self):
+        return f"{self.id_producto_id} #{self.posicion}: {self.id_relacionado_id}"
+    
+    class Meta:
+        db_table = 'producto_relacionado'
+        verbose_name = 'Producto comprado junto'
+        verbose_name_plural = 'Productos comprados juntos'
+        unique_together = ('id_producto', 'posicion')
+
+class CatalogoItemQuerySet(models.QuerySet):
+    def tarjetas(self):
+        """Como ProductoQuerySet.tarjetas(): todo menos la descripción completa."""
+        return self.defer('descripcion')
+
+class CatalogoItem(models.Model):
+    """
+    Modelo de lectura del catálogo público: una fila por producto activo con
+    los datos de su categoría y marca ya copiados, así el catálogo, el inicio y
+    el detalle se leen de una sola tabla. Lo mantiene catalogo.py con las
+    señales de Producto, Categoria y Marca; no se edita directamente.
+    """
+    id_producto = models.IntegerField(primary_key=True)
+    nombre = models.CharField(max_length=100)
+    descripcion = models.TextField()
+    descripcion_corta = models.CharField(max_length=ProductoQuerySet.LARGO_DESCRIPCION_CORTA)
+    precio = models.DecimalField(max_digits=10, decimal_places=2)
+    # Índice del rango de precios (ver catalogo.RANGOS_PRECIO)
+    rango_precio = models.SmallIntegerField()
+    # Stock real: Producto.stock más los movimientos de inventario pendientes
+    stock = models.IntegerField()
+    en_stock = models.BooleanField()
+    # Copia de la suma de las reservas de stock (ver pedidos/reservas.py)
+    reservado = models.IntegerField(default=0)
+    imagen = models.ImageField(upload_to='productos/', storage=imagenes, max_length=200, null=True, blank=True)
+    # URL de la miniatura de 200 px (vacía si no hay imagen)
+    miniatura = models.CharField(max_length=300, blank=True)
+    # Sin restricción de llave foránea: sólo se usan los ids, nunca se une
+    id_categoria = models.ForeignKey(Categoria, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    categoria_nombre = models.CharField(max_length=35)
+    categoria_activa = models.BooleanField()
+    id_marca = models.ForeignKey(Marca, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    marca_nombre = models.CharField(max_length=35)
+    marca_activa = models.BooleanField()
+    fecha_creacion = models.DateTimeField()
+    fecha_actualizacion = models.DateTimeField()
+    
+    objects = CatalogoItemQuerySet.as_manager()
+    
+    def __str__(self):
+        return self.nombre
+    
+    @property
+    def disponible(self):
+        return max(self.stock - self.reservado, 0)
+    
+    class Meta:
+        db_table = 'catalogo_item'
+        verbose_name = 'Producto del catálogo'
+        verbose_name_plural = 'Productos del catálogo'
+        indexes = [
+            models.Index(fields=['fecha_creacion', 'id_producto'], name='idx_catalogo_fecha'),
+            models.Index(fields=['precio', 'id_producto'], name='idx_catalogo_precio'),
+            models.Index(fields=['id_categoria', 'fecha_creacion', 'id_producto'], name='idx_catalogo_categoria'),
+            models.Index(fields=['id_marca', 'fecha_creacion', 'id_producto'], name='idx_catalogo_marca'),
+            # Versiones del catálogo y del detalle (ver versiones.py)
+            models.Index(fields=['fecha_actualizacion'], name='idx_catalogo_actualizacion'),
+            models.Index(fields=['id_categoria', 'fecha_actualizacion'], name='idx_catalogo_cat_actualizacion'),
+        ]
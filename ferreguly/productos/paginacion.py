@@ -0,0 +1,162 @@
+from datetime import datetime
+from decimal import Decimal
+
+from django.core import signing
+from django.db.models import Q
+
+# Ordenes disponibles para la paginación por cursor. Cada uno es una columna
+# más el id_producto como desempate, para que la llave sea única.
+ORDENES = {
+    'recientes': ('fecha_creacion', True),
+    'precio': ('precio', False),
+    'precio_desc': ('precio', True),
+}
+
+_SALT = 'productos.paginacion'
+
+
+def _serializar(valor):
+    if isinstance(valor, datetime):
+        return ['f', valor.isoformat()]
+    if isinstance(valor, Decimal):
+        return ['d', str(valor)]
+    return ['v', valor]
+
+
+def _deserializar(dato):
+    tipo, valor = dato
+    if tipo == 'f':
+        return datetime.fromisoformat(valor)
+    if tipo == 'd':
+        return Decimal(valor)
+    return valor
+
+
+def codificar_cursor(orden, objeto, direccion):
+    """Token opaco (firmado) que apunta a la posición de un objeto."""
+    campo, _ = ORDENES[orden]
+    return signing.dumps(
+        {'o': orden, 'v': _serializar(getattr(objeto, campo)), 'id': objeto.pk, 'd': direccion},
+        salt=_SALT,
+        compress=True
+    )
+
+
+def decodificar_cursor(token, orden):
+    """Regresa (valor, id, direccion) o None si el token no es válido."""
+    try:
+        datos = signing.loads(token, salt=_SALT)
+        if datos['o'] != orden or datos['d'] not in ('siguiente', 'anterior'):
+            return None
+        return _deserializar(datos['v']), datos['id'], datos['d']
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        return None
+
+
+class PaginaCursor:
+    def __init__(self, objetos, cursor_siguiente, cursor_anterior, total_aproximado=None):
+        self.objetos = objetos
+        self.cursor_siguiente = cursor_siguiente
+        self.cursor_anterior = cursor_anterior
+        self.total_aproximado = total_aproximado
+
+    def has_next(self):
+        return self.cursor_siguiente is not None
+
+    def has_previous(self):
+        return self.cursor_anterior is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.objetos)
+
+    def __len__(self):
+        return len(self.objetos)
+
+
+def paginar(queryset, por_pagina, orden='recientes', cursor=None):
+    """
+    Paginación por llave (keyset): en lugar de OFFSET se filtra a partir de la
+    última fila vista usando (columna, id_producto), así cualquier página cuesta
+    lo mismo que la primera y no se necesita COUNT(*).
+    """
+    campo, descendente = ORDENES[orden]
+    posicion = decodificar_cursor(cursor, orden) if cursor else None
+
+    # Para ir hacia atrás se invierte el orden y después se voltea la página
+    hacia_atras = posicion is not None and posicion[2] == 'anterior'
+    invertido = descendente != hacia_atras
+    prefijo = '-' if invertido else ''
+    queryset = queryset.order_by(f'{prefijo}{campo}', f'{prefijo}id_producto')
+
+    if posicion is not None:
+        valor, id_objeto, _ = posicion
+        operador = 'lt' if invertido else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{campo}__{operador}': valor}) |
+            Q(**{campo: valor, f'id_producto__{operador}': id_objeto})
+        )
+
+    objetos = list(queryset[:por_pagina + 1])
+    hay_mas = len(objetos) > por_pagina
+    objetos = objetos[:por_pagina]
+    if hacia_atras:
+        objetos.reverse()
+
+    if not objetos:
+        return PaginaCursor(objetos, None, None)
+
+    if hacia_atras:
+        hay_siguiente, hay_anterior = True, hay_mas
+    else:
+        hay_siguiente, hay_anterior = hay_mas, posicion is not None
+
+    return PaginaCursor(
+        objetos,
+        codificar_cursor(orden, objetos[-1], 'siguiente') if hay_siguiente else None,
+        codificar_cursor(orden, objetos[0], 'anterior') if hay_anterior else None,
+    )
+
+
+class PaginacionCursorMixin:
+    """
+    Mixin para ListView que reemplaza el Paginator (COUNT + OFFSET) por la
+    paginación por cursor. Las vistas pueden sobrescribir `usar_cursor` para
+    conservar la paginación numerada (por ejemplo, al ordenar por relevancia) y
+    `total_aproximado` para mostrar un total sin hacer COUNT(*).
+    """
+    orden_default = 'recientes'
+
+    def get_orden(self):
+        orden = self.request.GET.get('orden')
+        return orden if orden in ORDENES else self.orden_default
+
+    def usar_cursor(self):
+        return True
+
+    def total_aproximado(self):
+        return None
+
+    def _url_con_cursor(self, cursor):
+        parametros = self.request.GET.copy()
+        parametros.pop('page', None)
+        parametros['cursor'] = cursor
+        return f'?{parametros.urlencode()}'
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.usar_cursor():
+            return super().paginate_queryset(queryset, page_size)
+
+        pagina = paginar(queryset, page_size, self.get_orden(), self.request.GET.get('cursor'))
+        pagina.total_aproximado = self.total_aproximado()
+        pagina.url_siguiente = self._url_con_cursor(pagina.cursor_siguiente) if pagina.cursor_siguiente else None
+        pagina.url_anterior = self._url_con_cursor(pagina.cursor_anterior) if pagina.cursor_anterior else None
+        return (None, pagina, pagina.objetos, pagina.has_other_pages())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['paginacion_cursor'] = self.usar_cursor()
+        context['orden'] = self.get_orden()
+        return context
@@ -0,0 +1,98 @@
+import threading
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Categoria, Marca, Generacion
+
+# Las generaciones leídas se recuerdan durante una petición (ver
+# ReferenciasMiddleware), así una página que usa categorías y marcas sólo hace
+# una consulta pequeña a la tabla generacion.
+_local = threading.local()
+
+_lock = threading.Lock()
+_cache = {}
+
+
+def _leer():
+    memo = getattr(_local, 'generaciones', None)
+    if memo is not None:
+        return memo
+    filas = list(Generacion.objects.values_list('clave', 'valor', 'fecha'))
+    leido = (
+        {clave: valor for clave, valor, _ in filas},
+        max((fecha for _, _, fecha in filas), default=None),
+    )
+    if getattr(_local, 'en_peticion', False):
+        _local.generaciones = leido
+    return leido
+
+
+def generaciones():
+    return _leer()[0]
+
+
+def ultimo_cambio():
+    """Fecha del último cambio a categorías, marcas o bajas de productos."""
+    return _leer()[1]
+
+
+def incrementar(clave):
+    """Marca como obsoletas, en todos los procesos, las copias de `clave`."""
+    actualizados = Generacion.objects.filter(clave=clave).update(valor=F('valor') + 1, fecha=timezone.now())
+    if not actualizados:
+        try:
+            with transaction.atomic():
+                Generacion.objects.create(clave=clave, valor=1)
+        except IntegrityError:
+            Generacion.objects.filter(clave=clave).update(valor=F('valor') + 1, fecha=timezone.now())
+    _local.generaciones = None
+
+
+def _obtener(nombre, clave, cargar):
+    generacion = generaciones().get(clave, 0)
+    guardado = _cache.get(nombre)
+    if guardado is not None and guardado[0] == generacion:
+        return guardado[1]
+    datos = tuple(cargar())
+    with _lock:
+        _cache[nombre] = (generacion, datos)
+    return datos
+
+
+def limpiar():
+    """Descarta las copias en memoria de este proceso."""
+    with _lock:
+        _cache.clear()
+    _local.generaciones = None
+
+
+def categorias(activas=True):
+    """Categorías (sólo activas por omisión), desde la memoria del proceso."""
+    if activas:
+        return _obtener('categorias_activas', 'categoria', lambda: Categoria.objects.filter(activo=True))
+    return _obtener('categorias', 'categoria', lambda: Categoria.objects.all())
+
+
+def marcas(activas=True):
+    """Marcas (sólo activas por omisión), desde la memoria del proceso."""
+    if activas:
+        return _obtener('marcas_activas', 'marca', lambda: Marca.objects.filter(activo=True))
+    return _obtener('marcas', 'marca', lambda: Marca.objects.all())
+
+
+class ReferenciasMiddleware:
+    """Limita la lectura de las generaciones a una consulta por petición."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.en_peticion = True
+        _local.generaciones = None
+        try:
+            return self.get_response(request)
+        finally:
+            _local.en_peticion = False
+            _local.generaciones = None
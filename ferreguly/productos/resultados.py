@@ -0,0 +1,294 @@
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+
+from .models import CatalogoItem
+from . import busqueda, facetas, referencias
+from .paginacion import ORDENES, paginar
+
+logger = logging.getLogger(__name__)
+
+# Mientras una entrada tenga menos de FRESCO_SEGUNDOS se sirve sin más. Hasta
+# VENCIDO_SEGUNDOS se sirve igual, pero se recalcula en segundo plano; después
+# de eso se recalcula antes de responder.
+FRESCO_SEGUNDOS = 30
+VENCIDO_SEGUNDOS = 600
+MAX_ENTRADAS = 2000
+
+# Cada proceso tiene su propia caché y sólo se entera de los cambios que hace
+# él mismo. Las altas y bajas de categorías y marcas, y las bajas de productos,
+# incrementan estas generaciones compartidas: una entrada guardada con otras
+# generaciones se trata como vencida en todos los procesos. Los demás cambios
+# hechos en otro proceso (precio, stock, productos nuevos) se ven a más tardar
+# cuando la entrada deja de estar fresca, FRESCO_SEGUNDOS después de calcularla.
+GENERACIONES = ('categoria', 'marca', 'producto')
+
+# Tiempo máximo que una petición espera a que otra termine de calcular la
+# misma consulta antes de calcularla por su cuenta
+ESPERA_SEGUNDOS = 5
+
+POR_PAGINA = 12
+
+# Parámetros del catálogo ya normalizados; sirve como llave de la caché
+Consulta = namedtuple('Consulta', 'categoria marca busqueda modo orden cursor pagina')
+
+# ids de los productos de la página (en orden), total de resultados (sólo en
+# búsquedas), número de página, cursores y conteos por (categoría, marca) de
+# la búsqueda
+Resultado = namedtuple(
+    'Resultado', 'ids total numero aproximada cursor_siguiente cursor_anterior pares'
+)
+
+
+def _entero(valor):
+    """Convierte un parámetro GET a entero; None si no es válido."""
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def consulta(parametros):
+    """
+    Normaliza los parámetros GET del catálogo: descarta los que no cambian el
+    resultado, para que variantes de la misma URL compartan la entrada.
+    """
+    texto = ' '.join(parametros.get('busqueda', '').lower().split())[:100]
+    categoria = _entero(parametros.get('categoria')) or None
+    marca = _entero(parametros.get('marca')) or None
+    if texto:
+        modo = 'aproximado' if parametros.get('modo') == 'aproximado' else ''
+        return Consulta(categoria, marca, texto, modo, None, None, max(_entero(parametros.get('page')) or 1, 1))
+    orden = parametros.get('orden')
+    return Consulta(
+        categoria, marca, '', '', orden if orden in ORDENES else 'recientes', parametros.get('cursor') or None, None
+    )
+
+
+def calcular(consulta):
+    """
+    Ejecuta la consulta del catálogo. Regresa (Resultado, productos de la página).
+    """
+    # El catálogo de lectura sólo tiene productos activos
+    queryset = CatalogoItem.objects.tarjetas()
+    filtros = {}
+    if consulta.categoria:
+        filtros['id_categoria_id'] = consulta.categoria
+    if consulta.marca:
+        filtros['id_marca_id'] = consulta.marca
+
+    if not consulta.busqueda:
+        pagina = paginar(queryset.filter(**filtros), POR_PAGINA, consulta.orden, consulta.cursor)
+        resultado = Resultado(
+            tuple(producto.pk for producto in pagina.objetos), None, None, False,
+            pagina.cursor_siguiente, pagina.cursor_anterior, None
+        )
+        return resultado, pagina.objetos
+
+    # Búsqueda de texto completo (ordenada por relevancia). Si no hay
+    # resultados, o si se pide explícitamente, se usa la búsqueda aproximada.
+    # Las facetas se cuentan sobre la búsqueda sin filtros.
+    aproximada = False
+    exacta = busqueda.buscar(queryset, consulta.busqueda)
+    if consulta.modo == 'aproximado' or not exacta.filter(**filtros).exists():
+        queryset = busqueda.buscar_aproximado(queryset, consulta.busqueda)
+        aproximada = True
+    else:
+        queryset = exacta
+    pares = facetas.contar_pares(queryset)
+
+    paginator = Paginator(queryset.filter(**filtros), POR_PAGINA)
+    pagina = paginator.get_page(consulta.pagina)
+    objetos = list(pagina.object_list)
+    resultado = Resultado(
+        tuple(producto.pk for producto in objetos), paginator.count, pagina.number, aproximada, None, None, pares
+    )
+    return resultado, objetos
+
+
+def productos(ids):
+    """Productos (para tarjetas) con los ids dados, en el mismo orden."""
+    por_id = CatalogoItem.objects.tarjetas().in_bulk(ids)
+    return [por_id[id_producto] for id_producto in ids if id_producto in por_id]
+
+
+def version():
+    """Generaciones compartidas de las que depende una entrada."""
+    # Dentro de una petición ya se leyeron para el ETag del catálogo
+    generaciones = referencias.generaciones()
+    return tuple(generaciones.get(clave, 0) for clave in GENERACIONES)
+
+
+class Entrada:
+    __slots__ = ('resultado', 'version', 'creada_en', 'vencida')
+
+    def __init__(self, resultado, version, vencida=False):
+        self.resultado = resultado
+        self.version = version
+        self.creada_en = time.monotonic()
+        self.vencida = vencida
+
+
+class CacheResultados:
+    """
+    Caché en memoria de los resultados del catálogo: por cada combinación de
+    parámetros guarda los ids de la página y el total, no los productos, así
+    precios y stock siempre se leen al momento.
+
+    Una entrada vencida se sirve mientras un solo hilo la recalcula en segundo
+    plano; si no hay entrada, las peticiones simultáneas esperan a la primera
+    en lugar de repetir la consulta. Los cambios de un Producto sólo marcan como
+    vencidas las entradas que pueden cambiar.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self._calculando = {}
+        self._generacion = 0
+        self._metricas = Counter()
+
+    def obtener(self, consulta):
+        """
+        Regresa (Resultado, productos); los productos son None cuando el
+        resultado viene de la caché y hay que leerlos con `productos()`.
+        """
+        vigente = version()
+        with self._lock:
+            entrada = self._entradas.get(consulta)
+            if entrada is not None:
+                self._entradas.move_to_end(consulta)
+                if entrada.version != vigente and not entrada.vencida:
+                    # Otro proceso cambió categorías, marcas o dio de baja
+                    # productos
+                    entrada.vencida = True
+                    self._metricas['invalidaciones'] += 1
+                edad = time.monotonic() - entrada.creada_en
+                if not entrada.vencida and edad <= FRESCO_SEGUNDOS:
+                    self._metricas['aciertos'] += 1
+                    return entrada.resultado, None
+                if edad <= VENCIDO_SEGUNDOS and getattr(settings, 'CACHE_CATALOGO_SEGUNDO_PLANO', True):
+                    self._metricas['aciertos_vencidos'] += 1
+                    if consulta not in self._calculando:
+                        self._calculando[consulta] = threading.Event()
+                        threading.Thread(
+                            target=self._refrescar, args=(consulta, vigente, self._generacion), daemon=True
+                        ).start()
+                    return entrada.resultado, None
+
+            self._metricas['fallos'] += 1
+            evento = self._calculando.get(consulta)
+            if evento is None:
+                self._calculando[consulta] = threading.Event()
+            generacion = self._generacion
+
+        if evento is not None:
+            evento.wait(ESPERA_SEGUNDOS)
+            with self._lock:
+                entrada = self._entradas.get(consulta)
+            if entrada is not None:
+                return entrada.resultado, None
+            return calcular(consulta)
+
+        try:
+            resultado, objetos = calcular(consulta)
+            self._guardar(consulta, resultado, vigente, generacion)
+            return resultado, objetos
+        finally:
+            with self._lock:
+                self._calculando.pop(consulta).set()
+
+    def _refrescar(self, consulta, vigente, generacion):
+        try:
+            resultado, _ = calcular(consulta)
+            self._guardar(consulta, resultado, vigente, generacion)
+            with self._lock:
+                self._metricas['refrescos'] += 1
+        except Exception:
+            logger.exception('No se pudo recalcular el catálogo para %s', consulta)
+        finally:
+            with self._lock:
+                self._calculando.pop(consulta).set()
+            connections.close_all()
+
+    def _guardar(self, consulta, resultado, vigente, generacion):
+        with self._lock:
+            # Si hubo cambios mientras se calculaba, el resultado puede no
+            # incluirlos: se guarda, pero ya vencido
+            self._entradas[consulta] = Entrada(resultado, vigente, vencida=generacion != self._generacion)
+            self._entradas.move_to_end(consulta)
+            while len(self._entradas) > MAX_ENTRADAS:
+                self._entradas.popitem(last=False)
+
+    def invalidar(self, id_producto, anterior, actual):
+        """
+        Marca como vencidas las entradas que incluyen el producto o cuyos
+        filtros coinciden con su estado (id_categoria, id_marca, ...) anterior
+        o actual; cualquiera de los dos puede ser None.
+        """
+        estados = [estado for estado in (anterior, actual) if estado]
+        with self._lock:
+            self._generacion += 1
+            for consulta, entrada in self._entradas.items():
+                if entrada.vencida:
+                    continue
+                if id_producto in entrada.resultado.ids or any(
+                    (consulta.categoria is None or consulta.categoria == estado[0]) and
+                    (consulta.marca is None or consulta.marca == estado[1])
+                    for estado in estados
+                ):
+                    entrada.vencida = True
+                    self._metricas['invalidaciones'] += 1
+
+    def invalidar_filtro(self, categoria=None, marca=None):
+        """
+        Marca como vencidas las entradas que pueden incluir productos de la
+        categoría y la marca dadas (None es cualquiera), para cambios hechos
+        con QuerySet.update() a muchos productos a la vez.
+        """
+        with self._lock:
+            self._generacion += 1
+            for consulta, entrada in self._entradas.items():
+                if entrada.vencida:
+                    continue
+                if (
+                    (categoria is None or consulta.categoria is None or consulta.categoria == categoria) and
+                    (marca is None or consulta.marca is None or consulta.marca == marca)
+                ):
+                    entrada.vencida = True
+                    self._metricas['invalidaciones'] += 1
+
+    def invalidar_busquedas(self):
+        """Las búsquedas incluyen el nombre de la categoría y la marca."""
+        with self._lock:
+            self._generacion += 1
+            for consulta, entrada in self._entradas.items():
+                if consulta.busqueda and not entrada.vencida:
+                    entrada.vencida = True
+                    self._metricas['invalidaciones'] += 1
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._metricas.clear()
+
+    def metricas(self):
+        with self._lock:
+            metricas = {
+                clave: self._metricas[clave]
+                for clave in ('aciertos', 'aciertos_vencidos', 'fallos', 'refrescos', 'invalidaciones')
+            }
+            metricas['entradas'] = len(self._entradas)
+        peticiones = metricas['aciertos'] + metricas['aciertos_vencidos'] + metricas['fallos']
+        metricas['tasa_aciertos'] = round(
+            (metricas['aciertos'] + metricas['aciertos_vencidos']) / peticiones, 4
+        ) if peticiones else None
+        return metricas
+
+
+cache = CacheResultados()
@@ -0,0 +1,163 @@
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.db import transaction
+from django.dispatch import receiver
+
+from .models import ArchivoImagen, Categoria, Marca, Producto, pendiente_inventario
+from . import busqueda
+from .trigramas import indice as indice_trigramas
+from .autocompletar import indice as indice_prefijos
+from . import cache_paginas, catalogo, facetas, miniaturas, referencias, resultados
+
+# Campos que, además del estado de facetas, cambian cómo aparece un producto
+# en los listados
+CAMPOS_LISTADO = ('precio', 'nombre', 'descripcion', 'imagen')
+# Columnas del estado anterior que producto_por_guardar toma de la copia cargada
+CAMPOS_CARGADOS = ('id_categoria_id', 'id_marca_id', 'activo', 'stock', *CAMPOS_LISTADO)
+
+
+def preparar_indice_busqueda(sender, **kwargs):
+    """Crea y llena el índice de búsqueda después de aplicar las migraciones."""
+    if busqueda.fts_disponible():
+        busqueda.reconstruir_indice()
+
+
+def preparar_catalogo(sender, **kwargs):
+    """Llena el catálogo de lectura después de aplicar las migraciones."""
+    catalogo.reconstruir()
+
+
+@receiver(pre_save, sender=Producto)
+def producto_por_guardar(sender, instance, **kwargs):
+    # Estado anterior del producto, para ajustar los conteos de facetas y
+    # saber qué páginas en caché purgar. Si la copia se leyó con
+    # con_existencia() (como en las vistas de edición), sale de los valores
+    # que se cargaron (Producto.from_db); si no, se lee la fila
+    instance._estado_anterior = None
+    instance._listado_anterior = None
+    if not instance._state.adding:
+        cargado = getattr(instance, '_cargado', None) or {}
+        pendiente = getattr(instance, 'pendiente', None)
+        if pendiente is not None and all(campo in cargado for campo in CAMPOS_CARGADOS):
+            fila = [cargado[campo] for campo in CAMPOS_CARGADOS]
+            fila.insert(3, cargado['stock'] + pendiente)
+        else:
+            fila = (
+                Producto.objects.filter(pk=instance.pk)
+                .annotate(existencia=F('stock') + pendiente_inventario('pk'))
+                .values_list('id_categoria_id', 'id_marca_id', 'activo', 'existencia', 'stock', *CAMPOS_LISTADO)
+                .first()
+            )
+        if fila is not None:
+            instance._estado_anterior = fila[:4]
+            instance._stock_anterior = fila[4]
+            instance._listado_anterior = fila[5:]
+
+
+def _purgar_paginas(id_producto, anterior, actual, listado_anterior=None, listado_actual=None):
+    etiquetas = {f'producto:{id_producto}'}
+    if not (anterior and actual and anterior[:3] == actual[:3]):
+        # Aparece, desaparece o cambia de categoría o marca: cambian los
+        # conteos de todos los listados y los relacionados de su categoría
+        etiquetas.add('productos')
+        etiquetas.update(f'categoria:{estado[0]}' for estado in (anterior, actual) if estado)
+    elif listado_anterior != listado_actual:
+        # Puede cambiar de lugar sólo en los listados donde ya aparece
+        etiquetas |= cache_paginas.etiquetas_listado(actual[0], actual[1]) | cache_paginas.etiquetas_listado()
+    # Si sólo cambió el stock, basta con las páginas que muestran el producto
+    cache_paginas.purgar(*etiquetas)
+
+
+@receiver(post_save, sender=Producto)
+def producto_guardado(sender, instance, update_fields=None, **kwargs):
+    # El catálogo de lectura se actualiza antes de invalidar las cachés que
+    # se recalculan a partir de él
+    catalogo.actualizar_producto(instance.pk)
+    anterior = getattr(instance, '_estado_anterior', None)
+    # El stock del estado es la existencia (con los movimientos pendientes):
+    # cambia sólo si se guardó un stock distinto
+    actual = facetas.estado_producto(instance)
+    if anterior:
+        existencia = anterior[3]
+        if update_fields is None or 'stock' in update_fields:
+            existencia += instance.stock - instance._stock_anterior
+        actual = actual[:3] + (existencia,)
+    if anterior and anterior[2] and not instance.activo:
+        # Al desactivarlo sale del catálogo de lectura sin dejar fecha; su
+        # generación cambia la versión del catálogo (ver versiones.py)
+        referencias.incrementar('producto')
+    facetas.indice.actualizar(anterior, actual)
+    resultados.cache.invalidar(instance.pk, anterior, actual)
+    listado_anterior = getattr(instance, '_listado_anterior', None)
+    listado = tuple(
+        Producto._meta.get_field(campo).get_prep_value(getattr(instance, campo))
+        for campo in CAMPOS_LISTADO
+    )
+    _purgar_paginas(instance.pk, anterior, actual, listado_anterior, listado)
+    
+    # Imagen nueva: se cuentan las referencias a los archivos y sus miniaturas
+    # se generan después de confirmar la transacción
+    imagen = listado[CAMPOS_LISTADO.index('imagen')]
+    imagen_anterior = listado_anterior[CAMPOS_LISTADO.index('imagen')] if listado_anterior else None
+    if imagen != imagen_anterior:
+        ArchivoImagen.objects.sumar(imagen_anterior, -1)
+        ArchivoImagen.objects.sumar(imagen, 1)
+        if imagen:
+            transaction.on_commit(lambda: miniaturas.programar(imagen))
+    
+    indice_trigramas.actualizar(instance)
+    indice_prefijos.actualizar('producto', instance.pk, instance.nombre, instance.activo)
+    if busqueda.fts_disponible():
+        busqueda.indexar_producto(instance.pk)
+
+
+@receiver(post_delete, sender=Producto)
+def producto_eliminado(sender, instance, **kwargs):
+    catalogo.eliminar_producto(instance.pk)
+    facetas.indice.actualizar(facetas.estado_producto(instance), None)
+    resultados.cache.invalidar(instance.pk, facetas.estado_producto(instance), None)
+    _purgar_paginas(instance.pk, facetas.estado_producto(instance), None)
+    ArchivoImagen.objects.sumar(instance.imagen.name, -1)
+    # La baja no deja fecha_actualizacion; su generación cambia la versión
+    # del catálogo (ver versiones.py)
+    referencias.incrementar('producto')
+    indice_trigramas.eliminar(instance.pk)
+    indice_prefijos.eliminar('producto', instance.pk)
+    if busqueda.fts_disponible():
+        busqueda.eliminar_producto(instance.pk)
+
+
+@receiver(post_save, sender=Categoria)
+def categoria_guardada(sender, instance, created, **kwargs):
+    catalogo.actualizar_categoria(instance)
+    referencias.incrementar('categoria')
+    resultados.cache.invalidar_busquedas()
+    cache_paginas.purgar(f'categoria:{instance.pk}', 'categorias')
+    indice_prefijos.actualizar('categoria', instance.pk, instance.nombre, instance.activo)
+    if not created and busqueda.fts_disponible():
+        busqueda.indexar_por_categoria(instance.pk)
+
+
+@receiver(post_save, sender=Marca)
+def marca_guardada(sender, instance, created, **kwargs):
+    catalogo.actualizar_marca(instance)
+    referencias.incrementar('marca')
+    resultados.cache.invalidar_busquedas()
+    cache_paginas.purgar(f'marca:{instance.pk}', 'marcas')
+    indice_prefijos.actualizar('marca', instance.pk, instance.nombre, instance.activo)
+    if not created and busqueda.fts_disponible():
+        busqueda.indexar_por_marca(instance.pk)
+
+
+@receiver(post_delete, sender=Categoria)
+def categoria_eliminada(sender, instance, **kwargs):
+    referencias.incrementar('categoria')
+    cache_paginas.purgar(f'categoria:{instance.pk}', 'categorias')
+    indice_prefijos.eliminar('categoria', instance.pk)
+
+
+@receiver(post_delete, sender=Marca)
+def marca_eliminada(sender, instance, **kwargs):
+    referencias.incrementar('marca')
+    cache_paginas.purgar(f'marca:{instance.pk}', 'marcas')
+    indice_prefijos.eliminar('marca', instance.pk)
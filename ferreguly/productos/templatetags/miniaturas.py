@@ -0,0 +1,48 @@
+from django import template
+
+from productos import miniaturas
+
+register = template.Library()
+
+
+@register.simple_tag
+def miniatura(imagen, tamano, formato='jpeg'):
+    """URL de la miniatura de `imagen` (un ImageField) del tamaño dado."""
+    if not imagen:
+        return ''
+    return miniaturas.url(imagen.name, int(tamano), formato)
+
+
+@register.simple_tag
+def srcset(imagen, formato='webp'):
+    """Valor de srcset con todas las miniaturas de `imagen` en un formato."""
+    if not imagen:
+        return ''
+    return _srcset(miniaturas.urls(imagen.name, formatos=(formato,)), formato)
+
+
+def _srcset(urls, formato):
+    return ', '.join(f'{urls[tamano, formato]} {tamano}w' for tamano in miniaturas.TAMANOS)
+
+
+@register.inclusion_tag('productos/includes/imagen_producto.html')
+def imagen_producto(imagen, ancho, alt='', clase='', estilo=''):
+    """
+    <picture> con las miniaturas en WebP y JPEG. `ancho` es el ancho (en px)
+    con el que se muestra; el navegador elige la miniatura según la densidad
+    de la pantalla.
+    """
+    ancho = int(ancho)
+    # La miniatura más chica que cubre el ancho mostrado, para el src
+    tamano = next((tamano for tamano in miniaturas.TAMANOS if tamano >= ancho), miniaturas.TAMANOS[-1])
+    # Todas las URLs salen de una sola revisión al almacenamiento
+    urls = miniaturas.urls(imagen.name) if imagen else None
+    return {
+        'src': urls[tamano, 'jpeg'] if urls else '',
+        'srcset_webp': _srcset(urls, 'webp') if urls else '',
+        'srcset_jpeg': _srcset(urls, 'jpeg') if urls else '',
+        'sizes': f'{ancho}px',
+        'alt': alt,
+        'clase': clase,
+        'estilo': estilo,
+    }
@@ -1,3 +1,1420 @@
-from django.test import TestCase
+import copy
+import csv
+import gzip
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+import zipfile
+from decimal import Decimal
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.db.models.fields.files import FieldFile
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.templatetags.static import static
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ferreguly.consultas import presupuesto_consultas
+from ferreguly.pruebas import (
+    PresupuestoConsultasTestCase, crear_direccion, crear_pedido, crear_productos, crear_usuarios
+)
+from pedidos.models import DetallePedido, Pedido
+from pedidos import carritos
+from productos.models import (
+    AjusteMasivo, ArchivoImagen, CatalogoItem, Categoria, Generacion, Marca, MovimientoInventario, Producto,
+    ProductoQuerySet, ProductoRelacionado
+)
+from productos import (
+    ajustes, autocompletar, busqueda, cache_paginas, catalogo, comprados_juntos, facetas, indices, inventario, miniaturas,
+    paginacion, referencias, resultados, trigramas
+)
+from productos.forms import ReferenciaChoiceField
+from productos.almacenamiento import imagenes
+from usuarios.models import Usuario
+from PIL import Image
+
+
+# Un hilo en segundo plano no ve los datos de la transacción de la prueba, así
+# que la caché del catálogo recalcula las entradas vencidas en la petición y
+# los carritos sólo se escriben al llamar a carritos.persistir(). La
+# transacción tampoco se confirma: el catálogo de lectura se copia dentro de
+# ella
+@override_settings(
+    CACHE_CATALOGO_SEGUNDO_PLANO=False, CATALOGO_AL_CONFIRMAR=False, CARRITO_ESCRITURA_SEGUNDO_PLANO=False
+)
+class ProductosTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categorias, cls.marcas, cls.productos = crear_productos()
+        cls.cliente, cls.admin = crear_usuarios()
+
+    def setUp(self):
+        # Las cachés del catálogo son del proceso y pueden traer entradas de
+        # otra clase de pruebas con los mismos ids
+        referencias.limpiar()
+        resultados.cache.limpiar()
+        cache_paginas.limpiar()
+
+
+class PresupuestoConsultasProductosTests(PresupuestoConsultasTestCase, ProductosTestCase):
+    def test_inicio(self):
+        self.assertPresupuesto('inicio')
+
+    def test_catalogo(self):
+        self.assertPresupuesto('catalogo')
+
+    def test_catalogo_con_busqueda(self):
+        self.assertPresupuesto('catalogo', datos={'busqueda': 'tornillo', 'categoria': self.categorias[0].pk})
+
+    def test_producto_detalle(self):
+        self.assertPresupuesto('producto_detalle', args=[self.productos[0].pk])
+
+    def test_autocompletar(self):
+        self.assertPresupuesto('autocompletar', datos={'q': 'torn'})
+
+    def test_categorias_admin(self):
+        categoria = self.categorias[0]
+        self.assertPresupuesto('categorias_lista', usuario=self.admin)
+        self.assertPresupuesto('categoria_crear')
+        self.assertPresupuesto('categoria_editar', args=[categoria.pk])
+        self.assertPresupuesto('categoria_eliminar', args=[categoria.pk])
+
+    def test_marcas_admin(self):
+        marca = self.marcas[0]
+        self.assertPresupuesto('marcas_lista', usuario=self.admin)
+        self.assertPresupuesto('marca_crear')
+        self.assertPresupuesto('marca_editar', args=[marca.pk])
+        self.assertPresupuesto('marca_eliminar', args=[marca.pk])
+
+    def test_productos_admin(self):
+        producto = self.productos[0]
+        self.assertPresupuesto('productos_lista', usuario=self.admin)
+        self.assertPresupuesto('producto_crear')
+        self.assertPresupuesto('producto_editar', args=[producto.pk])
+        self.assertPresupuesto('producto_eliminar', args=[producto.pk])
+        self.assertPresupuesto('productos_ajuste_masivo')
+
+
+class BusquedaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categorias = [Categoria.objects.create(nombre=f'Categoria {i}') for i in range(3)]
+        cls.marcas = [Marca.objects.create(nombre=f'Marca {i}') for i in range(3)]
+        cls.productos = [
+            Producto.objects.create(
+                nombre=f'Tornillo {i}', descripcion=f'Descripcion {i}', id_categoria=cls.categorias[i % 3],
+                id_marca=cls.marcas[i % 3], precio=Decimal('10.00') + i, stock=20
+            )
+            for i in range(15)
+        ]
+        cls.martillo = Producto.objects.create(
+            nombre='Martillo de uña', descripcion='Mango de fibra de vidrio', id_categoria=cls.categorias[0],
+            id_marca=cls.marcas[1], precio=Decimal('150.00'), stock=10
+        )
+        cls.mazo = Producto.objects.create(
+            nombre='Mazo de goma', descripcion='Para no marcar como un martillo', id_categoria=cls.categorias[0],
+            id_marca=cls.marcas[1], precio=Decimal('90.00'), stock=10
+        )
+
+    def setUp(self):
+        resultados.cache.limpiar()
+        cache_paginas.limpiar()
+
+    def buscar(self, texto):
+        return [producto.pk for producto in busqueda.buscar(Producto.objects.all(), texto)]
+
+    def test_busca_en_nombre_descripcion_categoria_y_marca(self):
+        self.assertEqual(self.buscar('fibra'), [self.martillo.pk])
+        # Prefijos, sin acentos y todas las palabras
+        self.assertEqual(self.buscar('marti una'), [self.martillo.pk])
+        self.assertEqual(len(self.buscar('categoria 2')), 5)
+        self.assertEqual(len(self.buscar('tornillo marca 2')), 5)
+
+    def test_el_nombre_pesa_mas_que_la_descripcion(self):
+        self.assertEqual(self.buscar('martillo'), [self.martillo.pk, self.mazo.pk])
+
+    def test_sigue_los_cambios(self):
+        marca = self.marcas[1]
+        marca.nombre = 'Truper'
+        marca.save()
+        self.assertEqual(len(self.buscar('truper')), 7)
+        self.martillo.delete()
+        self.assertEqual(self.buscar('fibra'), [])
+
+    def test_catalogo_combina_busqueda_y_filtros(self):
+        response = self.client.get(reverse('catalogo'), {'busqueda': 'martillo', 'categoria': self.categorias[0].pk})
+        self.assertEqual([producto.pk for producto in response.context['productos']], [self.martillo.pk, self.mazo.pk])
+        self.assertEqual(self.client.get(reverse('catalogo'), {'busqueda': '"\'*'}).status_code, 200)
+
+
+class BusquedaAproximadaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='Herramientas')
+        marca = Marca.objects.create(nombre='Truper')
+        for i in range(15):
+            Producto.objects.create(
+                nombre=f'Tornillo {i}', descripcion=f'Descripcion {i}', id_categoria=categoria,
+                id_marca=marca, precio=Decimal('10.00'), stock=20
+            )
+        cls.desarmador = Producto.objects.create(
+            nombre='Desarmador Phillips #2', descripcion='Punta magnética', id_categoria=categoria,
+            id_marca=marca, precio=Decimal('45.00'), stock=10
+        )
+
+    def setUp(self):
+        # El índice es del proceso; se carga con los datos de esta prueba
+        trigramas.indice.construir()
+        resultados.cache.limpiar()
+        cache_paginas.limpiar()
+
+    def test_trigramas_como_pg_trgm(self):
+        self.assertEqual(trigramas.normalizar('  Llave ESPAÑOLA-3/4 '), 'llave espanola 3 4')
+        self.assertEqual(trigramas.trigramas('uña'), {'  u', ' uñ', 'uña', 'ña '})
+
+    def test_catalogo_usa_la_busqueda_aproximada_sin_resultados_exactos(self):
+        response = self.client.get(reverse('catalogo'), {'busqueda': 'desarmador philips'})
+        self.assertTrue(response.context['busqueda_aproximada'])
+        self.assertEqual([producto.pk for producto in response.context['productos']], [self.desarmador.pk])
+
+        response = self.client.get(reverse('catalogo'), {'busqueda': 'tornilo'})
+        self.assertTrue(response.context['busqueda_aproximada'])
+        self.assertEqual(len(response.context['productos']), 12)
+
+        response = self.client.get(reverse('catalogo'), {'busqueda': 'desarmador'})
+        self.assertFalse(response.context['busqueda_aproximada'])
+
+    def test_sigue_los_cambios(self):
+        self.desarmador.nombre = 'Pinzas de corte'
+        self.desarmador.save()
+        self.assertEqual(trigramas.indice.buscar('pinsas de corte'), [self.desarmador.pk])
+        self.assertEqual(trigramas.indice.buscar('desarmador philips'), [])
+
+        self.desarmador.activo = False
+        self.desarmador.save()
+        self.assertEqual(trigramas.indice.buscar('pinsas de corte'), [])
+
+    def test_indice_vencido_se_usa_mientras_se_refresca(self):
+        indice = trigramas.indice
+        indice._construido_en -= indices.REFRESCO_SEGUNDOS + 1
+        # Como si ya hubiera un refresco en curso en otro hilo
+        indice._refrescando = True
+        self.addCleanup(setattr, indice, '_refrescando', False)
+        with self.assertNumQueries(0):
+            self.assertEqual(indice.buscar('desarmador philips'), [self.desarmador.pk])
+
+
+class AutocompletarTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        ferreteria = Categoria.objects.create(nombre='Ferretería')
+        marca = Marca.objects.create(nombre='Truper')
+        for i in range(15):
+            Producto.objects.create(
+                nombre=f'Tornillo {i}', descripcion=f'Descripcion {i}', id_categoria=ferreteria,
+                id_marca=marca, precio=Decimal('10.00'), stock=20
+            )
+        cls.categoria = Categoria.objects.create(nombre='Tornillería')
+        cls.pija = Producto.objects.create(
+            nombre='Pija hexagonal', descripcion='Para lámina', id_categoria=cls.categoria,
+            id_marca=marca, precio=Decimal('3.00'), stock=10
+        )
+
+    def setUp(self):
+        autocompletar.indice.construir()
+
+    def sugerencias(self, texto):
+        response = self.client.get(reverse('autocompletar'), {'q': texto})
+        return [(sugerencia['tipo'], sugerencia['texto']) for sugerencia in response.json()['sugerencias']]
+
+    def test_categorias_y_marcas_antes_que_productos(self):
+        response = self.client.get(reverse('autocompletar'), {'q': 'TORN'})
+        self.assertIn('max-age=300', response['Cache-Control'])
+        sugerencias = response.json()['sugerencias']
+        self.assertEqual(len(sugerencias), 8)
+        self.assertEqual(sugerencias[0], {
+            'texto': 'Tornillería', 'tipo': 'categoria', 'url': f"{reverse('catalogo')}?categoria={self.categoria.pk}",
+        })
+        self.assertEqual({sugerencia['tipo'] for sugerencia in sugerencias[1:]}, {'producto'})
+
+    def test_sugiere_desde_cualquier_palabra(self):
+        self.assertEqual(self.sugerencias('hexa'), [('producto', 'Pija hexagonal')])
+        self.assertEqual(self.sugerencias('hexa lam'), [])
+        self.assertEqual(self.sugerencias(''), [])
+
+    def test_sigue_los_cambios(self):
+        Marca.objects.create(nombre='Hexagon')
+        self.assertEqual(self.sugerencias('hexa'), [('marca', 'Hexagon'), ('producto', 'Pija hexagonal')])
+        self.pija.nombre = 'Pija de cruz'
+        self.pija.save()
+        self.assertEqual(self.sugerencias('hexa'), [('marca', 'Hexagon')])
+        self.categoria.activo = False
+        self.categoria.save()
+        self.assertNotIn(('categoria', 'Tornillería'), self.sugerencias('torn'))
+
+    def test_indice_vencido_se_usa_mientras_se_refresca(self):
+        indice = autocompletar.indice
+        indice._construido_en -= indices.REFRESCO_SEGUNDOS + 1
+        # Como si ya hubiera un refresco en curso en otro hilo
+        indice._refrescando = True
+        self.addCleanup(setattr, indice, '_refrescando', False)
+        with self.assertNumQueries(0):
+            self.assertEqual(indice.sugerencias('hexa'), [('producto', self.pija.pk, 'Pija hexagonal')])
+
+
+@override_settings(CACHE_CATALOGO_SEGUNDO_PLANO=False)
+class FacetasTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categorias = [Categoria.objects.create(nombre=f'Categoría {i}') for i in range(3)]
+        cls.marcas = [Marca.objects.create(nombre=f'Marca {i}') for i in range(3)]
+        cls.productos = [
+            Producto.objects.create(
+                nombre=f'Tornillo {i}', descripcion=f'Descripcion {i}', id_categoria=cls.categorias[i % 3],
+                id_marca=cls.marcas[i % 3], precio=Decimal('10.00') + i, stock=20
+            )
+            for i in range(15)
+        ]
+        cls.pinturas = Categoria.objects.create(nombre='Pinturas')
+        cls.comex = Marca.objects.create(nombre='Comex')
+        Producto.objects.create(
+            nombre='Pintura roja', descripcion='Vinílica', id_categoria=cls.pinturas, id_marca=cls.comex,
+            precio=Decimal('250.00'), stock=0
+        )
+
+    def setUp(self):
+        facetas.indice.calcular()
+        resultados.cache.limpiar()
+        cache_paginas.limpiar()
+
+    def conteos(self, **datos):
+        response = self.client.get(reverse('catalogo'), datos)
+        return (
+            {categoria.nombre: categoria.num_productos for categoria in response.context['categorias']},
+            {marca.nombre: marca.num_productos for marca in response.context['marcas']},
+        )
+
+    def test_cada_faceta_respeta_el_filtro_de_la_otra(self):
+        categorias, marcas = self.conteos()
+        self.assertEqual(categorias, {'Categoría 0': 5, 'Categoría 1': 5, 'Categoría 2': 5, 'Pinturas': 1})
+        self.assertEqual(marcas, {'Marca 0': 5, 'Marca 1': 5, 'Marca 2': 5, 'Comex': 1})
+
+        categorias, marcas = self.conteos(marca=self.comex.pk)
+        self.assertEqual(categorias, {'Pinturas': 1})
+        self.assertEqual(marcas, {'Marca 0': 5, 'Marca 1': 5, 'Marca 2': 5, 'Comex': 1})
+
+        # Los ids que no son números se ignoran
+        self.assertEqual(self.conteos(categoria='abc')[0]['Pinturas'], 1)
+
+    def test_sigue_los_cambios_de_productos(self):
+        producto = self.productos[0]
+        producto.id_categoria = self.pinturas
+        producto.save()
+        self.productos[14].delete()
+        categorias, _ = self.conteos()
+        self.assertEqual(categorias, {'Categoría 0': 4, 'Categoría 1': 5, 'Categoría 2': 4, 'Pinturas': 2})
+
+        producto.activo = False
+        producto.save()
+        self.assertEqual(self.conteos()[0]['Pinturas'], 1)
+
+    def test_una_copia_con_existencia_no_relee_el_producto(self):
+        # La pintura no tiene stock: cambiar de categoría no la cuenta como
+        # disponible, aunque el estado anterior salga de la copia cargada
+        pintura = Producto.objects.con_existencia().get(nombre='Pintura roja')
+        pintura.id_categoria = self.categorias[0]
+        with CaptureQueriesContext(connection) as consultas:
+            pintura.save()
+        self.assertFalse([
+            consulta['sql'] for consulta in consultas.captured_queries
+            if consulta['sql'].startswith('SELECT') and 'FROM "producto"' in consulta['sql']
+        ])
+        self.assertEqual(facetas.indice._pares[(self.categorias[0].pk, self.comex.pk)], [1, 0])
+        self.assertEqual(self.conteos()[0]['Categoría 0'], 6)
+
+    def test_con_busqueda_cuenta_los_resultados(self):
+        categorias, marcas = self.conteos(busqueda='pintura')
+        self.assertEqual((categorias, marcas), ({'Pinturas': 1}, {'Comex': 1}))
+        categorias, marcas = self.conteos(busqueda='tornillo', marca=self.marcas[1].pk)
+        self.assertEqual(categorias, {'Categoría 1': 5})
+        self.assertEqual(marcas, {'Marca 0': 5, 'Marca 1': 5, 'Marca 2': 5})
+
+
+class PaginacionCursorTests(TestCase):
+    ORDEN_ESPERADO = {
+        'recientes': ('-fecha_creacion', '-id_producto'),
+        'precio': ('precio', 'id_producto'),
+        'precio_desc': ('-precio', '-id_producto'),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='Tornillería')
+        marca = Marca.objects.create(nombre='Truper')
+        productos = [
+            Producto.objects.create(
+                nombre=f'Tornillo {i}', descripcion=f'Descripcion {i}', id_categoria=categoria,
+                id_marca=marca, precio=Decimal('10.00') + i, stock=20
+            )
+            for i in range(15)
+        ]
+        # Empates en la columna del orden: los desempata el id
+        Producto.objects.filter(pk__in=[producto.pk for producto in productos[:8]]).update(
+            precio=Decimal('20.00'), fecha_creacion=productos[0].fecha_creacion
+        )
+        # update() no pasa por las señales que mantienen el catálogo
+        catalogo.reconstruir()
+        cls.cliente = Usuario.objects.create_user('cliente@ferreguly.mx', 'Ana', 'López', 'secreta123')
+        cls.admin = Usuario.objects.create_user(
+            'admin@ferreguly.mx', 'Luis', 'Pérez', 'secreta123', tipo_usuario='administrador'
+        )
+
+    def setUp(self):
+        facetas.indice.calcular()
+        resultados.cache.limpiar()
+        cache_paginas.limpiar()
+
+    def recorrer(self, queryset, orden):
+        paginas, cursor = [], None
+        while True:
+            pagina = paginacion.paginar(queryset, 4, orden, cursor)
+            paginas.append([producto.pk for producto in pagina])
+            if not pagina.has_next():
+                return paginas, pagina
+            cursor = pagina.cursor_siguiente
+
+    def test_recorre_todos_los_ordenes_sin_repetir_ni_saltar(self):
+        queryset = Producto.objects.all()
+        for orden, campos in self.ORDEN_ESPERADO.items():
+            paginas, ultima = self.recorrer(queryset, orden)
+            esperado = list(queryset.order_by(*campos).values_list('pk', flat=True))
+            self.assertEqual(sum(paginas, []), esperado, orden)
+            self.assertEqual([len(pagina) for pagina in paginas], [4, 4, 4, 3])
+
+            # Y de regreso, desde la última página
+            atras, cursor = [], ultima.cursor_anterior
+            while cursor:
+                pagina = paginacion.paginar(queryset, 4, orden, cursor)
+                atras.insert(0, [producto.pk for producto in pagina])
+                cursor = pagina.cursor_anterior
+            self.assertEqual(atras, paginas[:-1], orden)
+
+    def test_cursor_no_valido_o_de_otro_orden_regresa_al_inicio(self):
+        queryset = Producto.objects.all()
+        primera = paginacion.paginar(queryset, 4, 'precio')
+        for cursor in ('basura', primera.cursor_siguiente):
+            pagina = paginacion.paginar(queryset, 4, 'recientes', cursor)
+            self.assertFalse(pagina.has_previous())
+
+    def test_catalogo_y_lista_de_administracion(self):
+        self.client.force_login(self.cliente)
+        vistos, url = [], reverse('catalogo') + '?orden=precio'
+        while url:
+            response = self.client.get(url)
+            pagina = response.context['page_obj']
+            vistos += [producto.pk for producto in response.context['productos']]
+            self.assertEqual(pagina.total_aproximado, 15)
+            url = reverse('catalogo') + pagina.url_siguiente if pagina.url_siguiente else None
+        self.assertEqual(vistos, list(Producto.objects.order_by('precio', 'id_producto').values_list('pk', flat=True)))
+        self.assertEqual(self.client.get(reverse('catalogo'), {'cursor': 'basura'}).status_code, 200)
+
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('productos_lista'), {'orden': 'precio_desc'})
+        self.assertTrue(response.context['paginacion_cursor'])
+        self.assertEqual(len(response.context['productos']), 10)
+        self.assertIn('cursor=', response.context['page_obj'].url_siguiente)
+
+
+class TarjetasTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categorias = [Categoria.objects.create(nombre=f'Categoría {i}') for i in range(2)]
+        cls.marcas = [Marca.objects.create(nombre=f'Marca {i}') for i in range(2)]
+        cls.productos = [
+            Producto.objects.create(
+                nombre=f'Tornillo {i}', descripcion='Tornillo de acero ' * 20, id_categoria=cls.categorias[i],
+                id_marca=cls.marcas[i], precio=Decimal('10.50'), stock=100
+            )
+            for i in range(2)
+        ]
+
+    def test_una_consulta_sin_la_descripcion_completa(self):
+        with self.assertNumQueries(1):
+            tarjetas = list(Producto.objects.tarjetas().order_by('pk'))
+            self.assertEqual(
+                [(producto.id_categoria.nombre, producto.id_marca.nombre) for producto in tarjetas],
+                [('Categoría 0', 'Marca 0'), ('Categoría 1', 'Marca 1')]
+            )
+        self.assertIn('descripcion', tarjetas[0].get_deferred_fields())
+        self.assertEqual(len(tarjetas[0].descripcion_corta), ProductoQuerySet.LARGO_DESCRIPCION_CORTA)
+
+    def test_descripcion_corta_se_trunca_igual_que_la_completa(self):
+        producto = Producto.objects.tarjetas().get(pk=self.productos[0].pk)
+        plantilla = Template('{{ texto|truncatechars:80 }}')
+        self.assertEqual(
+            plantilla.render(Context({'texto': producto.descripcion_corta})),
+            plantilla.render(Context({'texto': self.productos[0].descripcion}))
+        )
+
+
+class ReferenciasTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nombre='Herramientas')
+        cls.marca = Marca.objects.create(nombre='Truper')
+
+    def setUp(self):
+        referencias.limpiar()
+
+    def generacion(self, clave):
+        return Generacion.objects.get(clave=clave).valor
+
+    def test_guardar_incrementa_la_generacion(self):
+        categoria, marca = self.generacion('categoria'), self.generacion('marca')
+        self.categoria.nombre = 'Jardinería'
+        self.categoria.save()
+        self.assertEqual((self.generacion('categoria'), self.generacion('marca')), (categoria + 1, marca))
+        self.marca.activo = False
+        self.marca.save()
+        self.assertEqual((self.generacion('categoria'), self.generacion('marca')), (categoria + 1, marca + 1))
+
+    def test_guardar_recarga_la_copia_del_proceso(self):
+        self.assertEqual([c.nombre for c in referencias.categorias()], ['Herramientas'])
+        self.categoria.nombre = 'Jardinería'
+        self.categoria.save()
+        self.assertEqual([c.nombre for c in referencias.categorias()], ['Jardinería'])
+        self.marca.activo = False
+        self.marca.save()
+        self.assertEqual(referencias.marcas(), ())
+        self.assertEqual([m.nombre for m in referencias.marcas(activas=False)], ['Truper'])
+
+    def test_generacion_vieja_se_recarga(self):
+        referencias.categorias()
+        # Otro proceso cambia la tabla: mientras no incremente la generación,
+        # aquí se sigue usando la copia en memoria con una sola consulta
+        Categoria.objects.filter(pk=self.categoria.pk).update(nombre='Jardinería')
+        with self.assertNumQueries(1):
+            self.assertEqual([c.nombre for c in referencias.categorias()], ['Herramientas'])
+
+        Generacion.objects.filter(clave='categoria').update(valor=F('valor') + 1)
+        with self.assertNumQueries(2):
+            self.assertEqual([c.nombre for c in referencias.categorias()], ['Jardinería'])
+
+
+class CacheResultadosTests(PresupuestoConsultasTestCase, ProductosTestCase):
+    def setUp(self):
+        super().setUp()
+        # Sin sesión, la segunda petición saldría completa de la caché de páginas
+        self.client.force_login(self.cliente)
+
+    def test_segunda_peticion_sale_de_la_cache(self):
+        datos = {'busqueda': 'tornillo', 'categoria': self.categorias[0].pk}
+        primera = self.client.get(reverse('catalogo'), datos)
+        # Versión del catálogo (y generaciones), sesión, usuario y los productos
+        # de la página
+        with presupuesto_consultas(maximo=5):
+            segunda = self.client.get(reverse('catalogo'), datos)
+        self.assertEqual(
+            [p.pk for p in primera.context['productos']], [p.pk for p in segunda.context['productos']]
+        )
+        self.assertEqual(segunda.context['page_obj'].paginator.count, 5)
+        metricas = resultados.cache.metricas()
+        self.assertEqual((metricas['aciertos'], metricas['fallos']), (1, 1))
+
+    def test_parametros_equivalentes_comparten_entrada(self):
+        self.client.get(reverse('catalogo'), {'categoria': self.categorias[1].pk})
+        self.client.get(reverse('catalogo'), {'categoria': self.categorias[1].pk, 'page': 3, 'modo': 'x'})
+        self.assertEqual(resultados.cache.metricas()['entradas'], 1)
+
+    def test_cambio_de_producto_invalida_entradas_afectadas(self):
+        url = reverse('catalogo')
+        self.client.get(url, {'categoria': self.categorias[0].pk})
+        self.client.get(url, {'categoria': self.categorias[1].pk})
+        nuevo = Producto.objects.create(
+            nombre='Martillo', descripcion='Martillo de uña', id_categoria=self.categorias[0],
+            id_marca=self.marcas[0], precio=Decimal('99.00'), stock=5
+        )
+        self.assertEqual(resultados.cache.metricas()['invalidaciones'], 1)
+
+        response = self.client.get(url, {'categoria': self.categorias[0].pk})
+        self.assertEqual(response.context['productos'][0].pk, nuevo.pk)
+        self.client.get(url, {'categoria': self.categorias[1].pk})
+        self.assertEqual(resultados.cache.metricas()['aciertos'], 1)
+
+    def test_metricas_admin(self):
+        self.client.get(reverse('catalogo'))
+        response = self.assertPresupuesto('cache_catalogo_metricas', usuario=self.admin)
+        self.assertEqual(response.json()['fallos'], 1)
+
+    def test_generacion_de_otro_proceso_vence_las_entradas(self):
+        url = reverse('catalogo')
+        self.client.get(url, {'categoria': self.categorias[0].pk})
+        # Otro proceso da de baja un producto: no pasa por las señales de
+        # este, pero incrementa la generación compartida
+        Producto.objects.filter(pk=self.productos[0].pk).update(activo=False)
+        catalogo.reconstruir()
+        referencias.incrementar('producto')
+
+        response = self.client.get(url, {'categoria': self.categorias[0].pk})
+        self.assertNotIn(self.productos[0].pk, [producto.pk for producto in response.context['productos']])
+        metricas = resultados.cache.metricas()
+        self.assertEqual((metricas['invalidaciones'], metricas['fallos']), (1, 2))
+
+    def test_cambios_de_otro_proceso_se_ven_al_dejar_de_estar_fresca(self):
+        url = reverse('catalogo')
+        datos = {'categoria': self.categorias[0].pk}
+        self.client.get(url, datos)
+        # Un producto dado de alta en otro proceso no pasa por las señales de
+        # este ni cambia ninguna generación
+        nuevo, = Producto.objects.bulk_create([Producto(
+            nombre='Martillo', descripcion='Martillo de uña', id_categoria=self.categorias[0],
+            id_marca=self.marcas[0], precio=Decimal('99.00'), stock=5
+        )])
+        catalogo.reconstruir()
+        self.assertNotIn(nuevo.pk, [producto.pk for producto in self.client.get(url, datos).context['productos']])
+
+        # Se ve en cuanto la entrada deja de estar fresca
+        for entrada in resultados.cache._entradas.values():
+            entrada.creada_en -= resultados.FRESCO_SEGUNDOS + 1
+        self.assertEqual(self.client.get(url, datos).context['productos'][0].pk, nuevo.pk)
+
+
+class AjusteMasivoTests(PresupuestoConsultasTestCase, ProductosTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+        self.url = reverse('productos_ajuste_masivo')
+
+    def test_vista_previa_no_cambia_nada(self):
+        response = self.client.post(self.url, {
+            'categoria': self.categorias[0].pk, 'tipo_precio': 'porcentaje', 'valor_precio': '10', 'vista_previa': '',
+        })
+        self.assertEqual(response.context['resumen']['productos'], 5)
+        self.assertEqual(response.context['resumen']['nuevo_minimo'], Decimal('11.55'))
+        self.assertEqual(Producto.objects.get(pk=self.productos[0].pk).precio, Decimal('10.50'))
+        self.assertFalse(AjusteMasivo.objects.exists())
+
+    def test_aplica_con_un_update_y_lo_registra(self):
+        anonimo = Client()
+        anonimo.get(reverse('catalogo'))
+        self.assertEqual(anonimo.get(reverse('catalogo'))['X-Cache'], 'HIT')
+
+        with presupuesto_consultas(maximo=14):
+            response = self.client.post(self.url, {
+                'categoria': self.categorias[0].pk, 'tipo_precio': 'porcentaje', 'valor_precio': '10',
+                'delta_stock': '-150', 'aplicar': '',
+            })
+        self.assertRedirects(response, reverse('productos_lista'))
+        for producto in self.productos:
+            actual = Producto.objects.con_existencia().get(pk=producto.pk)
+            if producto.id_categoria == self.categorias[0]:
+                self.assertEqual(actual.precio, (producto.precio * Decimal('1.1')).quantize(Decimal('0.01')))
+                self.assertEqual(actual.existencia, 0)
+                self.assertGreater(actual.fecha_actualizacion, producto.fecha_actualizacion)
+            else:
+                self.assertEqual((actual.precio, actual.existencia), (producto.precio, 100))
+        self.assertEqual(
+            list(MovimientoInventario.objects.values_list('tipo', 'cantidad', 'id_usuario').distinct()),
+            [('ajuste', -100, self.admin.pk)]
+        )
+
+        ajuste = AjusteMasivo.objects.get()
+        self.assertEqual((ajuste.id_usuario, ajuste.productos_afectados), (self.admin, 5))
+        self.assertEqual(anonimo.get(reverse('catalogo'))['X-Cache'], 'MISS')
+
+    def test_solo_stock_no_reescribe_los_productos(self):
+        Producto.objects.filter(pk=self.productos[0].pk).update(stock=0)
+        catalogo.actualizar_producto(self.productos[0].pk)
+        self.client.post(self.url, {'categoria': self.categorias[0].pk, 'delta_stock': '-30', 'aplicar': ''})
+        for producto in self.productos[:6:3]:
+            actual = Producto.objects.con_existencia().get(pk=producto.pk)
+            self.assertEqual(actual.fecha_actualizacion, producto.fecha_actualizacion)
+            item = CatalogoItem.objects.get(pk=producto.pk)
+            self.assertEqual((item.stock, item.en_stock), (actual.existencia, actual.existencia > 0))
+            self.assertGreater(item.fecha_actualizacion, producto.fecha_actualizacion)
+        self.assertEqual(Producto.objects.con_existencia().get(pk=self.productos[3].pk).existencia, 70)
+        # El producto que ya estaba en cero no recibió movimiento
+        self.assertEqual(AjusteMasivo.objects.get().productos_afectados, 4)
+
+    def test_monto_con_busqueda(self):
+        self.client.post(self.url, {
+            'busqueda': 'tornillo', 'marca': self.marcas[1].pk, 'tipo_precio': 'monto', 'valor_precio': '-12',
+            'aplicar': '',
+        })
+        self.assertEqual(Producto.objects.get(pk=self.productos[1].pk).precio, Decimal('0.00'))
+        self.assertEqual(Producto.objects.get(pk=self.productos[4].pk).precio, Decimal('2.50'))
+        self.assertEqual(Producto.objects.get(pk=self.productos[0].pk).precio, Decimal('10.50'))
+
+    def test_crear_el_campo_no_lee_las_referencias(self):
+        referencias.limpiar()
+        with self.assertNumQueries(0):
+            campo = ReferenciaChoiceField(referencias.marcas, queryset=Marca.objects.none(), empty_label='Todas')
+            copy.deepcopy(campo)
+        self.assertEqual(list(campo.choices)[:2], [('', 'Todas'), (self.marcas[0].pk, 'Marca 0')])
+
+    def test_requiere_un_cambio(self):
+        response = self.client.post(self.url, {'categoria': self.categorias[0].pk, 'aplicar': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].non_field_errors())
+
+
+@unittest.skipUnless(os.environ.get('FERREGULY_BENCHMARK'), 'Defina FERREGULY_BENCHMARK=1 para medir')
+class AjusteMasivoBenchmark(TestCase):
+    """
+    Ajustes masivos sobre 100 000 productos; informa cuánto tarda cada uno.
+    Sólo corre con FERREGULY_BENCHMARK=1.
+    """
+    PRODUCTOS = 100_000
+
+    @classmethod
+    def setUpTestData(cls):
+        categorias, marcas, _ = crear_productos(0)
+        Producto.objects.bulk_create(
+            (
+                Producto(
+                    nombre=f'Producto {i}', descripcion='Producto de prueba', id_categoria=categorias[i % 3],
+                    id_marca=marcas[i % 3], precio=Decimal('10.00') + i % 1000, stock=50,
+                )
+                for i in range(cls.PRODUCTOS)
+            ),
+            batch_size=5000,
+        )
+        catalogo.reconstruir()
+        cls.admin = crear_usuarios()[1]
+
+    def medir(self, descripcion, **ajuste):
+        inicio = time.monotonic()
+        registro = ajustes.aplicar(Producto.objects.all(), self.admin, **ajuste)
+        segundos = time.monotonic() - inicio
+        sys.stderr.write(f'\n{descripcion} de {registro.productos_afectados} productos en {segundos * 1000:.0f} ms\n')
+
+    def test_ajustes(self):
+        self.medir('Ajuste de stock', delta_stock=5)
+        self.medir('Ajuste de precio', tipo_precio='porcentaje', valor_precio=Decimal('10'))
+        self.medir('Ajuste de precio y stock', tipo_precio='monto', valor_precio=Decimal('-1'), delta_stock=-5)
+        self.assertEqual(
+            CatalogoItem.objects.filter(stock=50).count(), self.PRODUCTOS
+        )
+
+
+class ExportarProductosTests(ProductosTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def exportar(self, **parametros):
+        # Las filas se leen al consumir la respuesta: se mide todo dentro del presupuesto
+        with presupuesto_consultas('productos_exportar'):
+            response = self.client.get(reverse('productos_exportar'), parametros)
+            contenido = b''.join(response.streaming_content)
+        return response, contenido
+
+    def test_csv_con_filtros(self):
+        response, contenido = self.exportar(categoria=self.categorias[1].pk, formato='csv')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="productos.csv"')
+        filas = list(csv.reader(StringIO(contenido.decode('utf-8-sig'))))
+        self.assertEqual(filas[0][:3], ['ID', 'SKU', 'Nombre'])
+        self.assertEqual([fila[0] for fila in filas[1:]], [
+            str(producto.pk) for producto in self.productos if producto.id_categoria == self.categorias[1]
+        ])
+        self.assertEqual(filas[1][3:7], ['Categoría 1', 'Marca 1', '11.50', '100'])
+
+    def test_csv_no_deja_formulas(self):
+        Producto.objects.filter(pk=self.productos[0].pk).update(nombre='=HYPERLINK("http://x.mx","Ver")')
+        Producto.objects.filter(pk=self.productos[3].pk).update(nombre='@SUMA(A1)')
+        _, contenido = self.exportar(categoria=self.categorias[0].pk)
+        filas = list(csv.reader(StringIO(contenido.decode('utf-8-sig'))))
+        self.assertEqual([fila[2] for fila in filas[1:3]], ['\'=HYPERLINK("http://x.mx","Ver")', "'@SUMA(A1)"])
+        self.assertEqual(filas[1][5], '10.50')
+
+    def test_xlsx(self):
+        response, contenido = self.exportar(marca=self.marcas[2].pk, formato='xlsx')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="productos.xlsx"')
+        with zipfile.ZipFile(BytesIO(contenido)) as libro:
+            self.assertIsNone(libro.testzip())
+            hoja = libro.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(hoja.count('<row>'), 1 + 5)
+        self.assertIn('<t xml:space="preserve">Tornillo 2</t>', hoja)
+        self.assertIn('<c><v>12.50</v></c>', hoja)
+
+    def test_solo_administradores(self):
+        self.client.force_login(self.cliente)
+        self.assertRedirects(self.client.get(reverse('productos_exportar')), reverse('inicio'))
+
+
+class CompradosJuntosTests(ProductosTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.direccion = crear_direccion(cls.cliente)
+        # Un pedido con los diez primeros productos: cada uno ya tiene nueve pares
+        crear_pedido(cls.cliente, cls.direccion, cls.productos[:10])
+
+    def pedir(self, *indices, estado='pendiente'):
+        pedido = Pedido.objects.create(
+            id_usuario=self.cliente, id_direccion_envio=self.direccion, subtotal=0, total=0, estado=estado
+        )
+        for i in indices:
+            DetallePedido.objects.create(
+                id_pedido=pedido, id_producto=self.productos[i], cantidad=1, precio_unitario=1
+            )
+        return pedido
+
+    def relacionados(self, i):
+        return list(
+            ProductoRelacionado.objects.filter(id_producto=self.productos[i])
+            .order_by('posicion').values_list('id_relacionado', 'veces')
+        )
+
+    def test_cuenta_pares_y_guarda_el_top(self):
+        self.pedir(0, 11)
+        self.pedir(0, 11, 12)
+        self.pedir(0, 13, estado='cancelado')
+        call_command('calcular_comprados_juntos', stdout=StringIO())
+
+        relacionados = self.relacionados(0)
+        self.assertEqual(len(relacionados), comprados_juntos.TOP)
+        self.assertEqual(relacionados[:3], [
+            (self.productos[11].pk, 2), (self.productos[1].pk, 1), (self.productos[2].pk, 1),
+        ])
+        self.assertNotIn(self.productos[13].pk, dict(relacionados))
+        self.assertEqual(self.relacionados(12), [(self.productos[0].pk, 1), (self.productos[11].pk, 1)])
+
+    def test_incremental_y_completo(self):
+        cancelado = self.pedir(0, 11)
+        self.pedir(0, 11)
+        call_command('calcular_comprados_juntos', stdout=StringIO())
+        for _ in range(3):
+            self.pedir(0, 12)
+        # Una segunda corrida sólo suma los pedidos nuevos
+        call_command('calcular_comprados_juntos', '--lote', '1', stdout=StringIO())
+        call_command('calcular_comprados_juntos', stdout=StringIO())
+        self.assertEqual(self.relacionados(0)[:2], [(self.productos[12].pk, 3), (self.productos[11].pk, 2)])
+        self.assertEqual(comprados_juntos.ultimo_pedido(), Pedido.objects.latest('pk').pk)
+
+        cancelado.estado = 'cancelado'
+        cancelado.save()
+        call_command('calcular_comprados_juntos', '--completo', '--top', '20', stdout=StringIO())
+        self.assertEqual(self.relacionados(0)[0], (self.productos[12].pk, 3))
+        self.assertEqual(dict(self.relacionados(0))[self.productos[11].pk], 1)
+
+    def test_detalle_los_muestra(self):
+        url = reverse('producto_detalle', args=[self.productos[11].pk])
+        anonimo = Client()
+        self.assertNotContains(anonimo.get(url), 'Comprados juntos')
+        self.pedir(11, 14)
+        call_command('calcular_comprados_juntos', stdout=StringIO())
+        # La página guardada del producto se purga
+        response = anonimo.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual([producto.pk for producto in response.context['comprados_juntos']], [self.productos[14].pk])
+
+
+class InventarioTests(ProductosTestCase):
+    def existencia(self, producto):
+        return Producto.objects.con_existencia().values_list('stock', 'existencia').get(pk=producto.pk)
+
+    def test_editar_registra_un_ajuste(self):
+        producto = self.productos[0]
+        inventario.registrar([MovimientoInventario(id_producto=producto, tipo='venta', cantidad=-5)])
+        self.client.force_login(self.admin)
+        url = reverse('producto_editar', args=[producto.pk])
+        self.assertEqual(self.client.get(url).context['form'].initial['stock'], 95)
+
+        self.client.post(url, {
+            'nombre': producto.nombre, 'descripcion': producto.descripcion, 'id_categoria': producto.id_categoria_id,
+            'id_marca': producto.id_marca_id, 'precio': producto.precio, 'stock': 90, 'activo': 'on',
+        })
+        self.assertEqual(self.existencia(producto), (100, 90))
+        ajuste = MovimientoInventario.objects.get(tipo='ajuste')
+        self.assertEqual((ajuste.cantidad, ajuste.id_usuario), (-5, self.admin))
+        self.assertEqual(CatalogoItem.objects.get(pk=producto.pk).stock, 90)
+
+    def test_guardar_una_copia_vieja_no_pisa_el_stock(self):
+        producto = Producto.objects.get(pk=self.productos[0].pk)
+        inventario.registrar([MovimientoInventario(id_producto=producto, tipo='venta', cantidad=-5)])
+        inventario.compactar()
+        producto.nombre = 'Tornillo largo'
+        producto.save()
+        self.assertEqual(self.existencia(producto), (95, 95))
+
+    def test_compactar_no_cambia_la_existencia(self):
+        inventario.registrar([
+            MovimientoInventario(id_producto=self.productos[0], tipo='venta', cantidad=-3),
+            MovimientoInventario(id_producto=self.productos[0], tipo='reabasto', cantidad=10),
+            MovimientoInventario(id_producto=self.productos[1], tipo='venta', cantidad=-1),
+        ])
+        self.assertEqual(self.existencia(self.productos[0]), (100, 107))
+
+        salida = StringIO()
+        call_command('compactar_inventario', '--lote', '2', stdout=salida)
+        self.assertIn('3 movimientos compactados', salida.getvalue())
+        self.assertEqual(self.existencia(self.productos[0]), (107, 107))
+        self.assertEqual(self.existencia(self.productos[1]), (99, 99))
+        self.assertFalse(MovimientoInventario.objects.filter(compactado=False).exists())
+
+
+class CatalogoTests(ProductosTestCase):
+    def test_sigue_a_productos_categorias_y_marcas(self):
+        producto = self.productos[0]
+        item = CatalogoItem.objects.get(pk=producto.pk)
+        self.assertEqual((item.nombre, item.precio, item.rango_precio, item.en_stock), (producto.nombre, producto.precio, 0, True))
+        self.assertEqual(item.categoria_nombre, producto.id_categoria.nombre)
+
+        producto.precio = Decimal('300')
+        producto.stock = 0
+        producto.save()
+        item.refresh_from_db()
+        self.assertEqual((item.precio, item.rango_precio, item.en_stock), (Decimal('300'), 2, False))
+
+        categoria = producto.id_categoria
+        categoria.nombre = 'Jardinería'
+        categoria.save()
+        self.assertEqual(
+            set(CatalogoItem.objects.filter(id_categoria=categoria).values_list('categoria_nombre', flat=True)),
+            {'Jardinería'}
+        )
+
+        producto.activo = False
+        producto.save()
+        self.assertFalse(CatalogoItem.objects.filter(pk=producto.pk).exists())
+        # productos[14] no está en ningún pedido
+        self.productos[14].delete()
+        self.assertFalse(CatalogoItem.objects.filter(pk=self.productos[14].pk).exists())
+
+    def test_miniatura(self):
+        producto = self.productos[2]
+        Producto.objects.filter(pk=producto.pk).update(imagen='productos/taladro.jpg')
+        catalogo.actualizar_productos(Producto.objects.filter(pk=producto.pk))
+        self.assertEqual(
+            CatalogoItem.objects.get(pk=producto.pk).miniatura,
+            reverse('miniatura', args=[catalogo.TAMANO_MINIATURA, 'jpeg', 'productos/taladro.jpg'])
+        )
+        self.assertEqual(CatalogoItem.objects.get(pk=self.productos[3].pk).miniatura, '')
+
+    def test_reconstruir(self):
+        CatalogoItem.objects.all().delete()
+        Producto.objects.filter(pk=self.productos[0].pk).update(activo=False)
+        call_command('reconstruir_catalogo', stdout=StringIO())
+        self.assertEqual(
+            set(CatalogoItem.objects.values_list('pk', flat=True)),
+            {producto.pk for producto in self.productos[1:]}
+        )
+
+
+class CachePaginasTests(ProductosTestCase):
+    def setUp(self):
+        super().setUp()
+        carritos.limpiar()
+
+    def test_segunda_visita_anonima_no_genera_la_pagina(self):
+        url = reverse('producto_detalle', args=[self.productos[0].pk])
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        # Sólo la versión para la petición condicional
+        with presupuesto_consultas(maximo=2):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertContains(response, 'Tornillo 0')
+
+    def test_usuario_autenticado_no_usa_cache(self):
+        self.client.force_login(self.cliente)
+        self.client.get(reverse('inicio'))
+        self.assertNotIn('X-Cache', self.client.get(reverse('inicio')))
+
+    def test_token_csrf_es_de_cada_visitante(self):
+        url = reverse('producto_detalle', args=[self.productos[0].pk])
+        self.client.get(url)
+        otro = Client(enforce_csrf_checks=True)
+        response = otro.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+        otro.force_login(self.cliente)
+        response = otro.post(
+            reverse('carrito_agregar', args=[self.productos[0].pk]),
+            {'cantidad': 1, 'id_producto': self.productos[0].pk, 'csrfmiddlewaretoken': token}
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def test_cambio_de_stock_solo_purga_paginas_del_producto(self):
+        producto = self.productos[0]
+        detalle = reverse('producto_detalle', args=[producto.pk])
+        otro_detalle = reverse('producto_detalle', args=[self.productos[1].pk])
+        for url in (detalle, otro_detalle, reverse('catalogo')):
+            self.client.get(url)
+
+        producto.stock = 3
+        producto.save()
+        self.assertEqual(self.client.get(detalle)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(otro_detalle)['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(reverse('catalogo'))['X-Cache'], 'HIT')
+
+        producto.precio = Decimal('1.00')
+        producto.save()
+        self.assertEqual(self.client.get(reverse('catalogo'))['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(otro_detalle)['X-Cache'], 'HIT')
+
+    def test_cambio_de_precio_solo_purga_los_listados_del_producto(self):
+        producto = self.productos[0]
+        url = reverse('catalogo')
+        propios = [url, f'{url}?categoria={producto.id_categoria_id}', f'{url}?marca={producto.id_marca_id}']
+        ajenos = [f'{url}?categoria={self.categorias[1].pk}', f'{url}?marca={self.marcas[2].pk}']
+        for pagina in propios + ajenos:
+            self.client.get(pagina)
+
+        producto.precio = Decimal('1.00')
+        producto.save()
+        self.assertEqual([self.client.get(pagina)['X-Cache'] for pagina in propios], ['MISS'] * 3)
+        self.assertEqual([self.client.get(pagina)['X-Cache'] for pagina in ajenos], ['HIT'] * 2)
+
+    def test_solo_la_purga_de_sus_etiquetas_impide_guardar(self):
+        peticion = RequestFactory().get('/')
+        etiquetas = {f'producto:{self.productos[0].pk}'}
+        inicio = time.time_ns()
+        cache_paginas.purgar(f'producto:{self.productos[1].pk}')
+        cache_paginas.guardar('a', HttpResponse('a'), etiquetas, inicio)
+        self.assertIsNotNone(cache_paginas.obtener('a', peticion))
+
+        # Purgada mientras se generaba: la página podría no incluir el cambio
+        inicio = time.time_ns()
+        cache_paginas.purgar(f'producto:{self.productos[0].pk}')
+        cache_paginas.guardar('b', HttpResponse('b'), etiquetas, inicio)
+        self.assertIsNone(cache_paginas.obtener('b', peticion))
+
+    def test_cambio_de_categoria_purga_sus_paginas(self):
+        categoria = self.categorias[1]
+        detalle = reverse('producto_detalle', args=[self.productos[1].pk])
+        otro_detalle = reverse('producto_detalle', args=[self.productos[0].pk])
+        for url in (detalle, otro_detalle, reverse('inicio')):
+            self.client.get(url)
+
+        categoria.nombre = 'Herramientas'
+        categoria.save()
+        self.assertEqual(self.client.get(detalle)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(otro_detalle)['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(reverse('inicio'))['X-Cache'], 'MISS')
+
+
+class PeticionesCondicionalesTests(ProductosTestCase):
+    def test_catalogo_responde_304_con_el_mismo_etag(self):
+        url = reverse('catalogo')
+        etag = self.client.get(url)['ETag']
+        with presupuesto_consultas(maximo=2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        producto = self.productos[5]
+        producto.stock = 0
+        producto.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detalle_responde_304_con_last_modified(self):
+        url = reverse('producto_detalle', args=[self.productos[0].pk])
+        ultima_modificacion = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=ultima_modificacion)
+        self.assertEqual(response.status_code, 304)
+
+    def test_detalle_cambia_con_sus_relacionados_y_su_categoria(self):
+        url = reverse('producto_detalle', args=[self.productos[0].pk])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Misma categoría que productos[0] y sin pedidos
+        self.productos[12].delete()
+        nuevo = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(nuevo.status_code, 200)
+
+        self.categorias[0].nombre = 'Herramientas'
+        self.categorias[0].save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=nuevo['ETag']).status_code, 200)
+
+    def test_etag_distinto_por_usuario(self):
+        url = reverse('catalogo')
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(self.cliente)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+
+
+class MiniaturasTests(TestCase):
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        ajustes = override_settings(MEDIA_ROOT=directorio)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        miniaturas.limpiar()
+
+        salida = BytesIO()
+        Image.new('RGBA', (1200, 800), (200, 30, 30, 128)).save(salida, 'PNG')
+        self.nombre = default_storage.save('productos/foto.png', ContentFile(salida.getvalue()))
+
+    def test_genera_todos_los_tamanos_y_formatos(self):
+        self.assertEqual(miniaturas.generar(self.nombre), len(miniaturas.TAMANOS) * len(miniaturas.FORMATOS))
+        for tamano in miniaturas.TAMANOS:
+            for formato, (formato_pillow, *_) in miniaturas.FORMATOS.items():
+                with default_storage.open(miniaturas.nombre_miniatura(self.nombre, tamano, formato)) as archivo:
+                    imagen = Image.open(archivo)
+                    self.assertEqual(imagen.format, formato_pillow)
+                    self.assertEqual(imagen.size, (tamano, tamano * 2 // 3))
+        self.assertEqual(miniaturas.generar(self.nombre), 0)
+
+    def test_vista_genera_la_miniatura_al_primer_uso(self):
+        ArchivoImagen.objects.sumar(self.nombre, 1)
+        url = reverse('miniatura', args=[200, 'webp', self.nombre])
+        with presupuesto_consultas('miniatura'):
+            response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertTrue(default_storage.exists(miniaturas.nombre_miniatura(self.nombre, 200, 'webp')))
+        # Ya existe: se sirve sin consultas
+        with presupuesto_consultas(maximo=0):
+            self.client.get(url)
+
+    def test_vista_solo_usa_imagenes_de_productos_como_original(self):
+        url = reverse('miniatura', args=[80, 'jpeg', self.nombre])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        ArchivoImagen.objects.sumar(self.nombre, 1)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        miniatura = miniaturas.nombre_miniatura(self.nombre, 80, 'jpeg')
+        ArchivoImagen.objects.sumar(miniatura, 1)
+        self.assertEqual(self.client.get(reverse('miniatura', args=[80, 'jpeg', miniatura])).status_code, 404)
+        self.assertFalse(default_storage.exists(miniaturas.nombre_miniatura(miniatura, 80, 'jpeg')))
+
+    def test_vista_rechaza_tamanos_y_rutas_no_validas(self):
+        self.assertEqual(self.client.get(reverse('miniatura', args=[123, 'webp', self.nombre])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('miniatura', args=[200, 'webp', 'otra/foto.png'])).status_code, 404)
+        self.assertEqual(
+            self.client.get(reverse('miniatura', args=[200, 'webp', 'productos/../../settings.py'])).status_code, 404
+        )
+
+    def test_etiqueta_usa_el_archivo_si_ya_existe(self):
+        miniaturas.generar(self.nombre)
+        plantilla = Template('{% load miniaturas %}{% imagen_producto imagen 180 alt="Foto" %}')
+        html = plantilla.render(Context({'imagen': FieldFile(None, Producto._meta.get_field('imagen'), self.nombre)}))
+        self.assertIn('src="/media/productos/foto_200w.jpg"', html)
+        self.assertIn('/media/productos/foto_600w.webp 600w', html)
+        self.assertIn('sizes="180px"', html)
+
+    def test_completas_revisa_solo_la_ultima_miniatura(self):
+        miniaturas.generar(self.nombre, tamanos=(80, 150))
+        self.assertFalse(miniaturas.completas(self.nombre))
+        miniaturas.generar(self.nombre)
+        self.assertTrue(miniaturas.completas(self.nombre))
+        # Ya se sabe que existen: no se vuelve a revisar el almacenamiento
+        imagenes.delete(miniaturas.nombre_miniatura(self.nombre, 600, 'jpeg'))
+        self.assertTrue(miniaturas.completas(self.nombre))
+        miniaturas.limpiar()
+        self.assertFalse(miniaturas.completas(self.nombre))
+
+
+class AlmacenamientoImagenesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nombre='Tornillería')
+        cls.marca = Marca.objects.create(nombre='Truper')
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        ajustes = override_settings(MEDIA_ROOT=directorio)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        salida = BytesIO()
+        Image.new('RGB', (40, 40), (10, 120, 200)).save(salida, 'PNG')
+        self.contenido = salida.getvalue()
+
+    def crear_producto(self, nombre_archivo):
+        return Producto.objects.create(
+            nombre='Tornillo', descripcion='Acero', id_categoria=self.categoria, id_marca=self.marca,
+            precio=Decimal('2.50'), stock=5, imagen=SimpleUploadedFile(nombre_archivo, self.contenido)
+        )
+
+    def referencias(self, nombre):
+        return ArchivoImagen.objects.get(nombre=nombre).referencias
+
+    def test_mismo_contenido_se_guarda_una_vez(self):
+        primero = self.crear_producto('foto.PNG')
+        segundo = self.crear_producto('otra_foto.png')
+        self.assertEqual(primero.imagen.name, segundo.imagen.name)
+        self.assertRegex(primero.imagen.name, r'^productos/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(self.referencias(primero.imagen.name), 2)
+
+    def test_subida_desde_el_formulario(self):
+        self.client.force_login(Usuario.objects.create_user(
+            'admin@ferreguly.mx', 'Luis', 'Pérez', 'secreta123', tipo_usuario='administrador'
+        ))
+        self.client.post(reverse('producto_crear'), {
+            'nombre': 'Martillo', 'descripcion': 'Uña', 'id_categoria': self.categoria.pk,
+            'id_marca': self.marca.pk, 'precio': '99.00', 'stock': 3, 'activo': 'on',
+            'imagen': SimpleUploadedFile('martillo.png', self.contenido, content_type='image/png'),
+        })
+        producto = Producto.objects.get(nombre='Martillo')
+        self.assertEqual(producto.imagen.name, self.crear_producto('x.png').imagen.name)
+        self.assertEqual(self.referencias(producto.imagen.name), 2)
+
+    def test_recolecta_archivos_sin_referencias(self):
+        producto = self.crear_producto('foto.png')
+        anterior = producto.imagen.name
+        miniaturas.generar(anterior, tamanos=(80,), formatos=('webp',))
+
+        producto.imagen = SimpleUploadedFile('nueva.png', self.contenido[:-12] + b'otra imagen!')
+        producto.save()
+        self.assertEqual(self.referencias(anterior), 0)
+        self.assertEqual(self.referencias(producto.imagen.name), 1)
+
+        call_command('recolectar_imagenes', gracia=0, stdout=StringIO())
+        self.assertFalse(default_storage.exists(anterior))
+        self.assertFalse(default_storage.exists(miniaturas.nombre_miniatura(anterior, 80, 'webp')))
+        self.assertTrue(default_storage.exists(producto.imagen.name))
+        self.assertFalse(ArchivoImagen.objects.filter(nombre=anterior).exists())
+
+        nombre = producto.imagen.name
+        producto.delete()
+        call_command('recolectar_imagenes', gracia=24, stdout=StringIO())
+        self.assertTrue(default_storage.exists(nombre))
+        call_command('recolectar_imagenes', gracia=0, stdout=StringIO())
+        self.assertFalse(default_storage.exists(nombre))
+
+
+class ServirMediaTests(TestCase):
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        ajustes = override_settings(MEDIA_ROOT=directorio)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.contenido = bytes(range(256)) * 4
+        self.nombre = imagenes.save('productos/foto.png', ContentFile(self.contenido))
+        self.url = reverse('media', args=[self.nombre])
+
+    def test_archivo_completo_e_inmutable(self):
+        with presupuesto_consultas('media'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.contenido)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_archivo_con_nombre_propio_se_revalida(self):
+        nombre = default_storage.save('productos/logo.png', ContentFile(self.contenido))
+        response = self.client.get(reverse('media', args=[nombre]))
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_rangos(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.contenido[10:20])
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.contenido)}')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-4')
+        self.assertEqual(b''.join(response.streaming_content), self.contenido[-4:])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.contenido)}')
+
+        # If-Range de otra versión: se envía el archivo completo
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"otra"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_delega_el_envio_al_proxy(self):
+        with self.settings(MEDIA_DESCARGA='x-accel-redirect'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/media-interna/' + self.nombre)
+        self.assertEqual(response.content, b'')
+
+    def test_rechaza_rutas_fuera_de_media(self):
+        self.assertEqual(self.client.get('/media/../ferreguly/settings.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/productos/').status_code, 404)
+
+
+class EstaticosTests(TestCase):
+    def setUp(self):
+        origen = tempfile.mkdtemp()
+        destino = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, origen)
+        self.addCleanup(shutil.rmtree, destino)
+        os.makedirs(os.path.join(origen, 'css'))
+        with open(os.path.join(origen, 'css', 'tienda.css'), 'w') as archivo:
+            archivo.write(".logo { background: url('../img/ferreguly.jpeg'); }\n" * 200)
+        ajustes = override_settings(
+            STATIC_ROOT=destino, STATICFILES_DIRS=[origen, settings.STATICFILES_DIRS[0]],
+            INSTALLED_APPS=[app for app in settings.INSTALLED_APPS if app != 'django.contrib.admin']
+        )
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def test_nombres_con_hash_y_variantes(self):
+        url = static('css/tienda.css')
+        self.assertRegex(url, r'^/static/css/tienda\.[0-9a-f]{12}\.css$')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn('immutable', response['Cache-Control'])
+        contenido = gzip.decompress(b''.join(response.streaming_content)).decode()
+        self.assertIn('../img/' + static('img/ferreguly.jpeg').rsplit('/', 1)[1], contenido)
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertNotIn('Content-Encoding', response)
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_nombre_original_se_revalida(self):
+        response = self.client.get('/static/img/ferreguly.jpeg')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertNotIn('immutable', response['Cache-Control'])
+        self.assertNotIn('Vary', response)
+        response = self.client.get('/static/img/ferreguly.jpeg', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class IntercambioProductosTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nombre='Herramientas')
+        cls.marca = Marca.objects.create(nombre='Truper')
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        self.directorio = directorio
+
+    def archivo(self, nombre, contenido):
+        ruta = os.path.join(self.directorio, nombre)
+        with open(ruta, 'w', encoding='utf-8') as archivo:
+            archivo.write(contenido)
+        return ruta
+
+    def importar(self, ruta, **opciones):
+        salida, errores = StringIO(), StringIO()
+        call_command('productos_import', ruta, stdout=salida, stderr=errores, **opciones)
+        return salida.getvalue(), errores.getvalue()
+
+    def test_crea_actualiza_y_rechaza_filas(self):
+        ruta = self.archivo('catalogo.csv', (
+            'sku,nombre,descripcion,categoria,marca,precio,stock,activo\n'
+            'T-1,Martillo,Uña,herramientas,Truper,120.5,4,1\n'
+            'T-2,Pinzas,,Herramientas,Truper,80,2,si\n'
+            'T-3,Sierra,,Herramientas,Otra,99,1,1\n'
+            'T-4,Nivel,,Herramientas,Truper,abc,1,1\n'
+        ))
+        salida, errores = self.importar(ruta, lote=1)
+        self.assertIn('2 nuevos', salida)
+        self.assertIn('filas/s', salida)
+        self.assertIn('Línea 4: no existe la marca "Otra"', errores)
+        self.assertIn('Línea 5: precio no válido', errores)
+        martillo = Producto.objects.get(sku='T-1')
+        self.assertEqual((martillo.id_categoria, martillo.precio, martillo.stock), (self.categoria, Decimal('120.50'), 4))
+
+        anterior = martillo.fecha_actualizacion
+        ruta = self.archivo('precios.csv', 'sku,precio\nT-1,130\nT-2,80\nT-9,10\n')
+        salida, errores = self.importar(ruta)
+        self.assertIn('1 actualizados, 1 sin cambios', salida)
+        self.assertIn('producto nuevo sin nombre', errores)
+        martillo.refresh_from_db()
+        self.assertEqual((martillo.precio, martillo.nombre), (Decimal('130.00'), 'Martillo'))
+        self.assertGreater(martillo.fecha_actualizacion, anterior)
+
+    def test_purga_las_paginas_de_los_productos_importados(self):
+        self.importar(self.archivo('nuevo.csv', 'sku,nombre,categoria,marca,precio\nIMP-1,Llave,Herramientas,Truper,111.11\n'))
+        cache_paginas.limpiar()
+        url = reverse('producto_detalle', args=[Producto.objects.get(sku='IMP-1').pk])
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        self.importar(self.archivo('precio.csv', 'sku,precio\nIMP-1,999.99\n'))
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, '999.99')
+
+    def test_exporta_e_importa_jsonl(self):
+        ruta = self.archivo('nuevos.jsonl', (
+            '{"sku": "A-1", "nombre": "Taladro", "categoria": "Eléctricas", "marca": "Bosch", '
+            '"precio": 1500, "stock": 3, "activo": true}\n'
+        ))
+        self.importar(ruta, crear_faltantes=True)
+        self.assertTrue(Categoria.objects.filter(nombre='Eléctricas').exists())
+
+        salida = os.path.join(self.directorio, 'exportados.jsonl')
+        call_command('productos_export', salida=salida, lote=1, stderr=StringIO())
+        with open(salida, encoding='utf-8') as archivo:
+            filas = [json.loads(linea) for linea in archivo]
+        taladro = Producto.objects.get(sku='A-1')
+        self.assertEqual(filas, [{
+            'id_producto': taladro.pk, 'sku': 'A-1', 'nombre': 'Taladro', 'descripcion': '', 'categoria': 'Eléctricas',
+            'marca': 'Bosch', 'precio': '1500.00', 'stock': 3, 'activo': True,
+        }])
+
+        csv_salida = StringIO()
+        call_command('productos_export', formato='csv', stdout=csv_salida)
+        self.assertEqual(
+            csv_salida.getvalue().splitlines(),
+            [
+                'id_producto,sku,nombre,descripcion,categoria,marca,precio,stock,activo',
+                f'{taladro.pk},A-1,Taladro,,Eléctricas,Bosch,1500.00,3,1',
+            ]
+        )
+        self.assertIn('1 sin cambios', self.importar(salida)[0])
+
+    def test_ida_y_vuelta_de_productos_sin_sku(self):
+        serrucho = Producto.objects.create(
+            nombre='Serrucho', id_categoria=self.categoria, id_marca=self.marca, precio=Decimal('150.00'), stock=5
+        )
+        nivel = Producto.objects.create(
+            sku='N-1', nombre='Nivel', id_categoria=self.categoria, id_marca=self.marca, precio=Decimal('90.00'), stock=2
+        )
+        salida = os.path.join(self.directorio, 'exportados.csv')
+        call_command('productos_export', salida=salida, stderr=StringIO())
+        salida_importar, errores = self.importar(salida)
+        self.assertIn('2 sin cambios, 0 con errores', salida_importar)
+        self.assertEqual(errores, '')
+
+        # Un cambio hecho sin señales deja atrás la copia del catálogo del
+        # nivel: la importación no debe volver a copiar lo que no tocó
+        Producto.objects.filter(pk=nivel.pk).update(nombre='Nivel de burbuja')
+        with open(salida, encoding='utf-8') as archivo:
+            cabecera, fila_serrucho, _ = archivo.read().splitlines()
+        ruta = self.archivo('editados.csv', f'{cabecera}\n{fila_serrucho.replace("150.00,5", "175.00,7")}\n')
+        salida_importar, errores = self.importar(ruta)
+        self.assertIn('1 actualizados, 0 sin cambios', salida_importar)
+        self.assertEqual(errores, '')
+        serrucho = Producto.objects.con_existencia().get(pk=serrucho.pk)
+        self.assertEqual((serrucho.sku, serrucho.precio, serrucho.existencia), (None, Decimal('175.00'), 7))
+        self.assertEqual(CatalogoItem.objects.get(pk=serrucho.pk).precio, Decimal('175.00'))
+        self.assertEqual(CatalogoItem.objects.get(pk=nivel.pk).nombre, 'Nivel')
+
+        # Sin sku, un id que no existe se rechaza; con sku, el id se ignora y
+        # el producto sin sku lo recibe
+        ruta = self.archivo('ids.csv', f'id_producto,sku,precio\n999999,,10\n{serrucho.pk},S-1,180\n')
+        salida_importar, errores = self.importar(ruta)
+        self.assertIn('Línea 2: no existe el producto 999999', errores)
+        serrucho.refresh_from_db()
+        self.assertEqual((serrucho.sku, serrucho.precio), ('S-1', Decimal('180.00')))
@@ -0,0 +1,153 @@
+import math
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from .indices import IndiceEnMemoria
+from .models import Producto
+
+# Proporción mínima de los trigramas de la búsqueda que debe tener un nombre
+UMBRAL_SIMILITUD = 0.5
+
+# Máximo de candidatos (los que más trigramas comparten) que se califican
+MAX_CANDIDATOS = 5000
+
+_NO_ALFANUMERICO = re.compile(r'[^a-z0-9]+')
+
+
+def normalizar(texto):
+    """Minúsculas, sin acentos y sólo letras y números separados por un espacio."""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return _NO_ALFANUMERICO.sub(' ', texto).strip()
+
+
+def trigramas(texto):
+    """
+    Conjunto de trigramas de un texto ya normalizado. Igual que pg_trgm, cada
+    palabra se rellena con dos espacios al inicio y uno al final.
+    """
+    resultado = set()
+    for palabra in texto.split():
+        palabra = f'  {palabra} '
+        for i in range(len(palabra) - 2):
+            resultado.add(palabra[i:i + 3])
+    return resultado
+
+
+class IndiceTrigramas(IndiceEnMemoria):
+    """
+    Índice invertido en memoria de trigramas de Producto.nombre.
+
+    Cada producto ocupa una posición ("slot"); las listas de posiciones por
+    trigrama se guardan en arreglos compactos de enteros. Las actualizaciones
+    marcan la posición anterior como eliminada y agregan una nueva; cuando hay
+    demasiadas posiciones eliminadas el índice se compacta.
+    """
+    _CAMPOS = ('_listas', '_ids', '_nombres', '_tamanos', '_slot_por_id', '_eliminados')
+
+    def __init__(self):
+        super().__init__()
+        self._limpiar()
+
+    def _limpiar(self):
+        self._listas = {}
+        self._ids = array('I')
+        self._nombres = []
+        self._tamanos = array('H')
+        self._slot_por_id = {}
+        self._eliminados = 0
+
+    def _agregar(self, id_producto, nombre):
+        slot = len(self._ids)
+        self._ids.append(id_producto)
+        self._nombres.append(nombre)
+        self._slot_por_id[id_producto] = slot
+        propios = trigramas(nombre)
+        self._tamanos.append(min(len(propios), 0xFFFF))
+        for trigrama in propios:
+            lista = self._listas.get(trigrama)
+            if lista is None:
+                lista = self._listas[trigrama] = array('I')
+            lista.append(slot)
+
+    def _quitar(self, id_producto):
+        slot = self._slot_por_id.pop(id_producto, None)
+        if slot is not None:
+            self._ids[slot] = 0
+            self._nombres[slot] = ''
+            self._eliminados += 1
+
+    def _compactar(self):
+        vivos = [(id_producto, nombre) for id_producto, nombre in zip(self._ids, self._nombres) if id_producto]
+        self._limpiar()
+        for id_producto, nombre in vivos:
+            self._agregar(id_producto, nombre)
+
+    def _cargar(self):
+        """Carga los nombres de todos los productos activos."""
+        productos = Producto.objects.filter(activo=True).values_list('id_producto', 'nombre')
+        for id_producto, nombre in productos.iterator(chunk_size=5000):
+            self._agregar(id_producto, normalizar(nombre))
+
+    def _aplicar(self, id_producto, nombre):
+        # nombre es None si el producto ya no debe aparecer
+        self._quitar(id_producto)
+        if nombre is not None:
+            self._agregar(id_producto, nombre)
+        if self._eliminados > len(self._slot_por_id) // 4 + 100:
+            self._compactar()
+
+    def actualizar(self, producto):
+        """Refleja en el índice el alta, cambio o desactivación de un producto."""
+        self._cambiar(producto.pk, normalizar(producto.nombre) if producto.activo else None)
+
+    def eliminar(self, id_producto):
+        self._cambiar(id_producto, None)
+
+    def buscar(self, texto, limite=100):
+        """
+        Regresa los ids de los productos cuyo nombre se parece al texto,
+        ordenados del más al menos parecido.
+        """
+        buscados = trigramas(normalizar(texto))
+        if not buscados:
+            return []
+
+        self._asegurar_construido()
+        with self._lock:
+            # Filtro por prefijo: un nombre que comparte al menos `minimo`
+            # trigramas con la búsqueda forzosamente aparece en alguna de las
+            # (n - minimo + 1) listas más cortas. Sólo esas listas se recorren
+            # completas (Counter cuenta sobre los arreglos en C); las listas de
+            # trigramas muy comunes se consultan con búsqueda binaria para cada
+            # candidato, ya que las posiciones están ordenadas.
+            vacia = array('I')
+            listas = sorted((self._listas.get(t, vacia) for t in buscados), key=len)
+            minimo = max(1, math.ceil(UMBRAL_SIMILITUD * len(buscados)))
+            corte = len(buscados) - minimo + 1
+            candidatos = Counter()
+            for lista in listas[:corte]:
+                candidatos.update(lista)
+            comunes_listas = listas[corte:]
+
+            resultados = []
+            for slot, comunes in candidatos.most_common(MAX_CANDIDATOS):
+                id_producto = self._ids[slot]
+                if not id_producto:
+                    continue
+                for lista in comunes_listas:
+                    i = bisect_left(lista, slot)
+                    if i < len(lista) and lista[i] == slot:
+                        comunes += 1
+                if comunes >= minimo:
+                    jaccard = comunes / (len(buscados) + self._tamanos[slot] - comunes)
+                    resultados.append((comunes, jaccard, id_producto))
+
+        resultados.sort(reverse=True)
+        return [id_producto for _, _, id_producto in resultados[:limite]]
+
+
+indice = IndiceTrigramas()
@@ -5,6 +5,8 @@ urlpatterns = [
     # URLs para catálogo (usuario final)
     path('', views.CatalogoView.as_view(), name='catalogo'),
     path('producto/<int:pk>/', views.ProductoDetailView.as_view(), name='producto_detalle'),
+    path('autocompletar/', views.autocompletar, name='autocompletar'),
+    path('miniatura/<int:tamano>/<str:formato>/<path:nombre>', views.miniatura, name='miniatura'),
     
     # URLs para categorías (admin)
     path('admin/categorias/', views.CategoriaListView.as_view(), name='categorias_lista'),
@@ -23,4 +25,9 @@ urlpatterns = [
     path('admin/productos/crear/', views.ProductoCreateView.as_view(), name='producto_crear'),
     path('admin/productos/editar/<int:pk>/', views.ProductoUpdateView.as_view(), name='producto_editar'),
     path('admin/productos/eliminar/<int:pk>/', views.ProductoDeleteView.as_view(), name='producto_eliminar'),
+    path('admin/productos/ajuste-masivo/', views.AjusteMasivoView.as_view(), name='productos_ajuste_masivo'),
+    path('admin/productos/exportar/', views.exportar_productos, name='productos_exportar'),
+    
+    # Métricas de la caché del catálogo (admin)
+    path('admin/cache-catalogo/', views.metricas_cache_catalogo, name='cache_catalogo_metricas'),
 ]
\ No newline at end of file
@@ -0,0 +1,87 @@
+from django.contrib.messages import get_messages
+from django.db.models import OuterRef, Subquery
+
+from .models import CatalogoItem
+from . import referencias
+
+# Versiones para las peticiones condicionales (If-None-Match e
+# If-Modified-Since) del catálogo y del detalle de producto. Se calculan antes
+# de ejecutar la vista con una consulta por índice más la de generaciones (que
+# la página vuelve a usar); si el cliente ya tiene la versión vigente se
+# responde 304 sin generar la página.
+#
+# Las fechas se leen del catálogo de lectura, cuya fecha_actualizacion cambia
+# con cualquier cambio a un producto, incluidos los movimientos de inventario
+# (que no escriben en producto); los cambios a categorías y marcas, y las
+# bajas y desactivaciones de productos, actualizan la fecha de su Generacion.
+
+
+def _sin_version(request):
+    # Los mensajes pendientes sólo se muestran una vez, así que la página
+    # debe generarse
+    return bool(get_messages(request))
+
+
+def _version(request, atributo, calcular):
+    if not hasattr(request, atributo):
+        setattr(request, atributo, None if _sin_version(request) else calcular())
+    return getattr(request, atributo)
+
+
+def _mas_reciente(fecha):
+    if fecha is None:
+        return None
+    generacion = referencias.ultimo_cambio()
+    return max(fecha, generacion) if generacion else fecha
+
+
+def _fecha_catalogo():
+    return _mas_reciente(
+        CatalogoItem.objects.order_by('-fecha_actualizacion').values_list('fecha_actualizacion', flat=True).first()
+    )
+
+
+def _fecha_producto(pk):
+    # El detalle también muestra productos relacionados de la misma categoría
+    return _mas_reciente(
+        CatalogoItem.objects.filter(pk=pk)
+        .annotate(relacionados=Subquery(
+            CatalogoItem.objects.filter(id_categoria_id=OuterRef('id_categoria_id'))
+            .order_by('-fecha_actualizacion')
+            .values('fecha_actualizacion')[:1]
+        ))
+        .values_list('relacionados', flat=True)
+        .first()
+    )
+
+
+def _etag(prefijo, request, fecha):
+    if fecha is None:
+        return None
+    # La barra de navegación cambia con el usuario
+    usuario = request.user.pk if request.user.is_authenticated else 0
+    return f'{prefijo}-{int(fecha.timestamp() * 1_000_000)}-{usuario}'
+
+
+def _ultima_modificacion(request, fecha):
+    # Con sólo If-Modified-Since no se distingue al usuario, así que las
+    # páginas de usuarios autenticados sólo se validan con el ETag
+    if fecha is None or request.user.is_authenticated:
+        return None
+    return fecha
+
+
+def etag_catalogo(request, *args, **kwargs):
+    return _etag('c', request, _version(request, '_fecha_catalogo', _fecha_catalogo))
+
+
+def ultima_modificacion_catalogo(request, *args, **kwargs):
+    return _ultima_modificacion(request, _version(request, '_fecha_catalogo', _fecha_catalogo))
+
+
+def etag_producto(request, pk, *args, **kwargs):
+    return _etag(f'p{pk}', request, _version(request, '_fecha_producto', lambda: _fecha_producto(pk)))
+
+
+def ultima_modificacion_producto(request, pk, *args, **kwargs):
+    return _ultima_modificacion(request, _version(request, '_fecha_producto', lambda: _fecha_producto(pk)))
@@ -1,57 +1,191 @@
+from copy import copy
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView
-from django.urls import reverse_lazy
+from django.contrib.auth.decorators import login_required
+from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView, FormView
+from django.urls import reverse, reverse_lazy
 from django.contrib import messages
-from django.db.models import Q
+from django.core.paginator import Page, Paginator
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.http import Http404, JsonResponse
+from django.views.decorators.cache import cache_control
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition, require_GET
+
+from ferreguly import exportar
 
-from .models import Categoria, Marca, Producto
-from .forms import CategoriaForm, MarcaForm, ProductoForm
+from .almacenamiento import imagenes
+from .models import AjusteMasivo, ArchivoImagen, CatalogoItem, Categoria, Marca, MovimientoInventario, Producto, ProductoRelacionado
+from .forms import AjusteMasivoForm, CategoriaForm, MarcaForm, ProductoForm
+from . import ajustes, busqueda, facetas, inventario, media, miniaturas, referencias, resultados, versiones
+from .paginacion import PaginaCursor, PaginacionCursorMixin
+from .autocompletar import indice as indice_prefijos
+from .cache_paginas import CachePaginaAnonimaMixin, etiquetas_listado, etiquetas_productos
 
 
 # Vistas para el Catálogo de Productos (Usuario Final)
-class CatalogoView(ListView):
-    model = Producto
+@method_decorator(condition(
+    etag_func=versiones.etag_catalogo, last_modified_func=versiones.ultima_modificacion_catalogo
+), name='dispatch')
+class CatalogoView(CachePaginaAnonimaMixin, PaginacionCursorMixin, ListView):
+    model = CatalogoItem
     template_name = 'productos/catalogo.html'
     context_object_name = 'productos'
-    paginate_by = 12
+    paginate_by = resultados.POR_PAGINA
     
     def get_queryset(self):
-        queryset = Producto.objects.filter(activo=True)
-        
-        # Filtrado por categoría
-        categoria_id = self.request.GET.get('categoria')
-        if categoria_id:
-            queryset = queryset.filter(id_categoria_id=categoria_id)
-            
-        # Filtrado por marca
-        marca_id = self.request.GET.get('marca')
-        if marca_id:
-            queryset = queryset.filter(id_marca_id=marca_id)
-            
-        # Búsqueda por nombre
-        busqueda = self.request.GET.get('busqueda')
-        if busqueda:
-            queryset = queryset.filter(
-                Q(nombre__icontains=busqueda) | 
-                Q(descripcion__icontains=busqueda)
+        # Los ids de la página salen de la caché de resultados; los productos
+        # siempre se leen de la base de datos
+        self.consulta = resultados.consulta(self.request.GET)
+        self.resultado, objetos = resultados.cache.obtener(self.consulta)
+        if objetos is None:
+            objetos = resultados.productos(self.resultado.ids)
+        self.categoria_id = self.consulta.categoria
+        self.marca_id = self.consulta.marca
+        return objetos
+    
+    def usar_cursor(self):
+        # Los resultados de una búsqueda van ordenados por relevancia
+        return not self.consulta.busqueda
+    
+    def total_aproximado(self):
+        return facetas.total(facetas.indice.pares(), self.categoria_id, self.marca_id)
+    
+    def paginate_queryset(self, queryset, page_size):
+        if self.usar_cursor():
+            pagina = PaginaCursor(
+                queryset, self.resultado.cursor_siguiente, self.resultado.cursor_anterior, self.total_aproximado()
             )
-            
-        return queryset
+            pagina.url_siguiente = self._url_con_cursor(pagina.cursor_siguiente) if pagina.cursor_siguiente else None
+            pagina.url_anterior = self._url_con_cursor(pagina.cursor_anterior) if pagina.cursor_anterior else None
+            return (None, pagina, queryset, pagina.has_other_pages())
+        
+        # El total ya viene en el resultado; se asigna para que el Paginator
+        # no haga COUNT(*)
+        paginator = Paginator((), page_size)
+        paginator.count = self.resultado.total
+        pagina = Page(queryset, self.resultado.numero, paginator)
+        return (paginator, pagina, queryset, pagina.has_other_pages())
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categorias'] = Categoria.objects.filter(activo=True)
-        context['marcas'] = Marca.objects.filter(activo=True)
+        
+        # Conteos por categoría y marca: precalculados si no hay búsqueda, o
+        # los que se guardaron con los resultados de la búsqueda
+        if self.resultado.pares is not None:
+            pares = self.resultado.pares
+        else:
+            pares = facetas.indice.pares()
+        por_categoria, por_marca = facetas.conteos(pares, self.categoria_id, self.marca_id)
+        
+        # Se ocultan los filtros sin productos, salvo el que está seleccionado
+        # (se copian porque las instancias en caché se comparten entre peticiones)
+        categorias = []
+        for categoria in referencias.categorias():
+            num_productos = por_categoria.get(categoria.id_categoria, 0)
+            if num_productos or categoria.id_categoria == self.categoria_id:
+                categoria = copy(categoria)
+                categoria.num_productos = num_productos
+                categorias.append(categoria)
+        marcas = []
+        for marca in referencias.marcas():
+            num_productos = por_marca.get(marca.id_marca, 0)
+            if num_productos or marca.id_marca == self.marca_id:
+                marca = copy(marca)
+                marca.num_productos = num_productos
+                marcas.append(marca)
+        
+        context['categorias'] = categorias
+        context['marcas'] = marcas
+        context['busqueda_aproximada'] = self.resultado.aproximada
         return context
+    
+    def etiquetas_pagina(self, context):
+        return (
+            {'productos', 'categorias', 'marcas'}
+            | etiquetas_listado(self.categoria_id, self.marca_id)
+            | etiquetas_productos(context['productos'])
+        )
 
-class ProductoDetailView(DetailView):
-    model = Producto
+@method_decorator(condition(
+    etag_func=versiones.etag_producto, last_modified_func=versiones.ultima_modificacion_producto
+), name='dispatch')
+class ProductoDetailView(CachePaginaAnonimaMixin, DetailView):
+    # El catálogo de lectura sólo tiene productos activos
+    model = CatalogoItem
     template_name = 'productos/detalle.html'
     context_object_name = 'producto'
     
-    def get_queryset(self):
-        return Producto.objects.filter(activo=True)
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['relacionados'] = (
+            CatalogoItem.objects.tarjetas()
+            .filter(id_categoria_id=self.object.id_categoria_id)
+            .exclude(id_producto=self.object.id_producto)
+            .order_by('-fecha_creacion')[:4]
+        )
+        # Calculados por el comando calcular_comprados_juntos; los ids y su
+        # posición salen del índice (id_producto, posicion) de la misma consulta
+        relacionados = ProductoRelacionado.objects.filter(id_producto=self.object.id_producto)
+        context['comprados_juntos'] = (
+            CatalogoItem.objects.tarjetas()
+            .filter(id_producto__in=relacionados.values('id_relacionado'))
+            .annotate(posicion=Subquery(
+                relacionados.filter(id_relacionado=OuterRef('id_producto')).values('posicion')
+            ))
+            .order_by('posicion')[:4]
+        )
+        return context
+    
+    def etiquetas_pagina(self, context):
+        producto = context['producto']
+        return {
+            f'producto:{producto.pk}',
+            f'categoria:{producto.id_categoria_id}',
+            f'marca:{producto.id_marca_id}',
+        } | etiquetas_productos(context['relacionados']) | etiquetas_productos(context['comprados_juntos'])
+
+@require_GET
+@cache_control(public=True, max_age=300)
+def autocompletar(request):
+    """Sugerencias para la caja de búsqueda del catálogo, en JSON."""
+    sugerencias = []
+    for tipo, id_objeto, nombre in indice_prefijos.sugerencias(request.GET.get('q', '')[:100]):
+        if tipo == 'producto':
+            url = reverse('producto_detalle', args=[id_objeto])
+        else:
+            url = f"{reverse('catalogo')}?{tipo}={id_objeto}"
+        sugerencias.append({'texto': nombre, 'tipo': tipo, 'url': url})
+    return JsonResponse({'sugerencias': sugerencias})
+
+def _imagen_de_producto(nombre):
+    # El conteo de ArchivoImagen puede desfasarse (por ejemplo, con
+    # QuerySet.update()): si no hay referencias se revisan los productos
+    return (
+        ArchivoImagen.objects.filter(nombre=nombre, referencias__gt=0).exists()
+        or Producto.objects.filter(imagen=nombre).exists()
+    )
+
+@require_GET
+def miniatura(request, tamano, formato, nombre):
+    """Sirve una miniatura, generándola si todavía no existe."""
+    if tamano not in miniaturas.TAMANOS or formato not in miniaturas.FORMATOS:
+        raise Http404('Tamaño o formato no disponible')
+    # Las miniaturas no se usan como original: cada petición crearía otro archivo
+    if not nombre.startswith(Producto._meta.get_field('imagen').upload_to) or miniaturas.es_miniatura(nombre):
+        raise Http404('Imagen no encontrada')
+    try:
+        if not imagenes.exists(miniaturas.nombre_miniatura(nombre, tamano, formato)):
+            # Sólo se generan miniaturas de imágenes que usa algún producto
+            if not _imagen_de_producto(nombre) or not imagenes.exists(nombre):
+                raise Http404('Imagen no encontrada')
+        destino = miniaturas.obtener(nombre, tamano, formato)
+    except SuspiciousFileOperation:
+        raise Http404('Imagen no encontrada')
+    return media.servir(request, destino)
 
 # Vistas CRUD para Categoría (Admin)
 class CategoriaListView(LoginRequiredMixin, ListView):
@@ -172,7 +306,26 @@ class MarcaDeleteView(LoginRequiredMixin, DeleteView):
         return super().delete(request, *args, **kwargs)
 
 # Vistas CRUD para Producto (Admin)
-class ProductoListView(LoginRequiredMixin, ListView):
+def filtrar_productos(queryset, parametros):
+    """Filtros de la lista de productos del admin (también los usa la exportación)."""
+    # Filtrado por categoría
+    categoria_id = parametros.get('categoria')
+    if categoria_id:
+        queryset = queryset.filter(id_categoria_id=categoria_id)
+        
+    # Filtrado por marca
+    marca_id = parametros.get('marca')
+    if marca_id:
+        queryset = queryset.filter(id_marca_id=marca_id)
+        
+    # Búsqueda por nombre, descripción, categoría o marca
+    texto = parametros.get('busqueda')
+    if texto:
+        queryset = busqueda.buscar(queryset, texto)
+    
+    return queryset
+
+class ProductoListView(LoginRequiredMixin, PaginacionCursorMixin, ListView):
     model = Producto
     template_name = 'productos/admin/productos/lista.html'
     context_object_name = 'productos'
@@ -185,33 +338,16 @@ class ProductoListView(LoginRequiredMixin, ListView):
         return super().dispatch(request, *args, **kwargs)
     
     def get_queryset(self):
-        queryset = Producto.objects.all()
-        
-        # Filtrado por categoría
-        categoria_id = self.request.GET.get('categoria')
-        if categoria_id:
-            queryset = queryset.filter(id_categoria_id=categoria_id)
-            
-        # Filtrado por marca
-        marca_id = self.request.GET.get('marca')
-        if marca_id:
-            queryset = queryset.filter(id_marca_id=marca_id)
-            
-        # Búsqueda por nombre o descripción
-        busqueda = self.request.GET.get('busqueda')
-        if busqueda:
-            queryset = queryset.filter(
-                Q(nombre__icontains=busqueda) | 
-                Q(descripcion__icontains=busqueda)
-            )
-        
-        return queryset
+        return filtrar_productos(Producto.objects.tarjetas().con_existencia(), self.request.GET)
+    
+    def usar_cursor(self):
+        return not self.request.GET.get('busqueda')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # Agregar categorías y marcas al contexto para los filtros
-        context['categorias'] = Categoria.objects.all()
-        context['marcas'] = Marca.objects.all()
+        context['categorias'] = referencias.categorias(activas=False)
+        context['marcas'] = referencias.marcas(activas=False)
         return context
 
 class ProductoCreateView(LoginRequiredMixin, CreateView):
@@ -242,9 +378,25 @@ class ProductoUpdateView(LoginRequiredMixin, UpdateView):
             return redirect('inicio')
         return super().dispatch(request, *args, **kwargs)
     
+    def get_queryset(self):
+        return Producto.objects.con_existencia()
+    
+    def get_initial(self):
+        # El formulario muestra el stock real, con los movimientos pendientes
+        return {'stock': self.object.existencia}
+    
     def form_valid(self, form):
+        # El stock no se escribe en el producto: la diferencia con la
+        # existencia se registra como un ajuste de inventario
+        ajuste = form.instance.stock - self.object.existencia
+        form.instance.stock = form.instance._stock_cargado
+        with transaction.atomic():
+            respuesta = super().form_valid(form)
+            inventario.registrar([MovimientoInventario(
+                id_producto=self.object, tipo='ajuste', cantidad=ajuste, id_usuario=self.request.user
+            )])
         messages.success(self.request, 'Producto actualizado correctamente')
-        return super().form_valid(form)
+        return respuesta
 
 class ProductoDeleteView(LoginRequiredMixin, DeleteView):
     model = Producto
@@ -257,6 +409,78 @@ class ProductoDeleteView(LoginRequiredMixin, DeleteView):
             return redirect('inicio')
         return super().dispatch(request, *args, **kwargs)
     
+    def get_queryset(self):
+        return Producto.objects.select_related('id_categoria', 'id_marca').con_existencia()
+    
     def delete(self, request, *args, **kwargs):
         messages.success(self.request, 'Producto eliminado correctamente')
-        return super().delete(request, *args, **kwargs)
\ No newline at end of file
+        return super().delete(request, *args, **kwargs)
+
+class AjusteMasivoView(LoginRequiredMixin, FormView):
+    """
+    Ajuste de precios y stock de todos los productos de un filtro. Primero se
+    muestra la vista previa; el ajuste se aplica al confirmar.
+    """
+    form_class = AjusteMasivoForm
+    template_name = 'productos/admin/productos/ajuste_masivo.html'
+    
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.tipo_usuario == 'administrador':
+            messages.error(request, 'No tienes permisos para acceder a esta página')
+            return redirect('inicio')
+        return super().dispatch(request, *args, **kwargs)
+    
+    def get_initial(self):
+        # Los filtros llegan desde la lista de productos
+        return {
+            campo: self.request.GET[campo]
+            for campo in ('categoria', 'marca', 'busqueda') if self.request.GET.get(campo)
+        }
+    
+    def form_valid(self, form):
+        filtros = form.filtros()
+        queryset = ajustes.productos(**filtros)
+        resumen = ajustes.vista_previa(queryset, **form.cambio())
+        if resumen['nuevo_maximo'] is not None and resumen['nuevo_maximo'] >= ajustes.PRECIO_MAXIMO:
+            form.add_error('valor_precio', 'El ajuste deja precios fuera del rango permitido')
+            return self.form_invalid(form)
+        
+        if 'aplicar' in self.request.POST and resumen['productos']:
+            ajuste = ajustes.aplicar(queryset, self.request.user, **filtros, **form.cambio())
+            messages.success(self.request, f'Ajuste aplicado a {ajuste.productos_afectados} productos')
+            return redirect('productos_lista')
+        return self.render_to_response(self.get_context_data(form=form, resumen=resumen))
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['ajustes'] = (
+            AjusteMasivo.objects.select_related('id_usuario', 'id_categoria', 'id_marca')
+            .order_by('-fecha')[:10]
+        )
+        return context
+
+@login_required
+def metricas_cache_catalogo(request):
+    """Aciertos, fallos e invalidaciones de la caché de resultados del catálogo."""
+    if not request.user.tipo_usuario == 'administrador':
+        messages.error(request, 'No tienes permisos para acceder a esta función')
+        return redirect('inicio')
+    return JsonResponse(resultados.cache.metricas())
+
+@login_required
+def exportar_productos(request):
+    """Productos de la lista del admin (con sus filtros) en CSV o XLSX."""
+    if not request.user.tipo_usuario == 'administrador':
+        messages.error(request, 'No tienes permisos para acceder a esta función')
+        return redirect('inicio')
+    queryset = filtrar_productos(Producto.objects.con_existencia(), request.GET)
+    if not request.GET.get('busqueda'):
+        queryset = queryset.order_by('id_producto')
+    # Nombres de categoría y marca con JOIN; el iterador lee por bloques
+    filas = queryset.values_list(
+        'id_producto', 'sku', 'nombre', 'id_categoria__nombre', 'id_marca__nombre',
+        'precio', 'existencia', 'activo', 'fecha_actualizacion',
+    ).iterator(chunk_size=2000)
+    return exportar.respuesta(exportar.formato(request), 'productos', (
+        'ID', 'SKU', 'Nombre', 'Categoría', 'Marca', 'Precio', 'Stock', 'Activo', 'Actualizado',
+    ), filas)
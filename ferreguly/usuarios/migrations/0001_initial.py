@@ -0,0 +1,66 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Usuario',
+            fields=[
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('is_superuser', models.BooleanField(default=False, help_text='Designates that this user has all permissions without explicitly assigning them.', verbose_name='superuser status')),
+                ('id_usuario', models.AutoField(primary_key=True, serialize=False)),
+                ('nombre', models.CharField(max_length=35)),
+                ('apellidos', models.CharField(max_length=50)),
+                ('email', models.EmailField(max_length=45, unique=True)),
+                ('telefono', models.CharField(blank=True, max_length=10, null=True)),
+                ('tipo_usuario', models.CharField(choices=[('cliente', 'Cliente'), ('administrador', 'Administrador')], default='cliente', max_length=15)),
+                ('fecha_registro', models.DateTimeField(default=django.utils.timezone.now)),
+                ('activo', models.BooleanField(default=True)),
+                ('is_staff', models.BooleanField(default=False)),
+                ('is_active', models.BooleanField(default=True)),
+                ('groups', models.ManyToManyField(blank=True, help_text='The groups this user belongs to. A user will get all permissions granted to each of their groups.', related_name='user_set', related_query_name='user', to='auth.group', verbose_name='groups')),
+                ('user_permissions', models.ManyToManyField(blank=True, help_text='Specific permissions for this user.', related_name='user_set', related_query_name='user', to='auth.permission', verbose_name='user permissions')),
+            ],
+            options={
+                'verbose_name': 'Usuario',
+                'verbose_name_plural': 'Usuarios',
+                'db_table': 'usuario',
+            },
+        ),
+        migrations.CreateModel(
+            name='Direccion',
+            fields=[
+                ('id_direccion', models.AutoField(primary_key=True, serialize=False)),
+                ('nombre', models.CharField(max_length=35)),
+                ('apellidos', models.CharField(max_length=50)),
+                ('telefono', models.CharField(max_length=10)),
+                ('email', models.EmailField(max_length=45)),
+                ('calle', models.CharField(max_length=80)),
+                ('numero_ext', models.CharField(max_length=10)),
+                ('numero_int', models.CharField(blank=True, max_length=10, null=True)),
+                ('colonia', models.CharField(max_length=60)),
+                ('ciudad', models.CharField(max_length=40)),
+                ('estado', models.CharField(max_length=30)),
+                ('codigo_postal', models.CharField(max_length=5)),
+                ('id_usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='direcciones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Dirección',
+                'verbose_name_plural': 'Direcciones',
+                'db_table': 'direccion',
+            },
+        ),
+    ]
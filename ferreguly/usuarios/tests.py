@@ -1,3 +1,36 @@
 from django.test import TestCase
 
-# Create your tests here.
+from ferreguly.pruebas import (
+    PresupuestoConsultasTestCase, crear_direccion, crear_pedido, crear_productos, crear_usuarios
+)
+
+
+class PresupuestoConsultasUsuariosTests(PresupuestoConsultasTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        _, _, productos = crear_productos(10)
+        cls.cliente, cls.admin = crear_usuarios()
+        cls.direccion = crear_direccion(cls.cliente)
+        # El detalle de usuario lista sus pedidos y direcciones
+        crear_pedido(cls.cliente, cls.direccion, productos)
+
+    def test_registro_y_login(self):
+        self.assertPresupuesto('registro')
+        self.assertPresupuesto('login')
+
+    def test_logout(self):
+        self.assertPresupuesto('logout', usuario=self.cliente)
+
+    def test_perfil(self):
+        self.assertPresupuesto('perfil', usuario=self.cliente)
+
+    def test_direcciones(self):
+        self.assertPresupuesto('direcciones_lista', usuario=self.cliente)
+        self.assertPresupuesto('direccion_crear')
+        self.assertPresupuesto('direccion_editar', args=[self.direccion.pk])
+        self.assertPresupuesto('direccion_eliminar', args=[self.direccion.pk])
+
+    def test_usuarios_admin(self):
+        self.assertPresupuesto('usuarios_admin_lista', usuario=self.admin)
+        self.assertPresupuesto('usuario_admin_detalle', args=[self.cliente.pk])
+        self.assertPresupuesto('usuario_admin_editar', args=[self.cliente.pk])
@@ -134,6 +134,9 @@ class UsuarioDetailView(LoginRequiredMixin, DetailView):
             messages.error(request, 'No tienes permisos para acceder a esta página')
             return redirect('inicio')
         return super().dispatch(request, *args, **kwargs)
+    
+    def get_queryset(self):
+        return Usuario.objects.prefetch_related('direcciones', 'pedidos')
 
 class UsuarioUpdateAdminView(LoginRequiredMixin, UpdateView):
     model = Usuario